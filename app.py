@@ -1,5 +1,6 @@
 from flask import Flask, request, jsonify, send_file, abort, Response
 from flask_cors import CORS
+from werkzeug.utils import safe_join
 import os
 import uuid
 import subprocess
@@ -10,7 +11,38 @@ import time
 import random
 import threading
 import re
-from collections import defaultdict
+import json
+import math
+import tempfile
+import hashlib
+import mimetypes
+import functools
+from contextlib import ExitStack
+from collections import defaultdict, Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from services.cache import get_cached_media_info, cache_media_info, cookie_context, get_cache_version
+from services.compression import compress_body
+from services.singleflight import SingleFlight, process_lock
+from services.artifacts import ArtifactStore, artifact_key
+from services.pacing import pace
+from services.ladder import order_rungs, record_rung, ladder_stats
+from services.cookies import SessionJarCache, CookieFile, is_auth_error
+from services.ydl_pool import YoutubeDLPool, DeferredPostprocess, BeforeDownload
+from services.connections import ConnectionBudget
+from services.bandwidth import BandwidthScheduler
+from services.codecs import (
+    normalize_audio_format, audio_postprocessor, audio_mode, stream_audio_plan, video_postprocess_plan, video_postprocessor,
+    AUDIO_SELECTORS, AUDIO_FORMATS
+)
+from services.janitor import Janitor
+from services.journal import write_journal, read_journal, record_attempt, remove_journal, JOB_MAX_ATTEMPTS
+from services.cleanup import is_ffmpeg_installed
+from services import metrics
+from services.metrics import track_stage, PostprocessTimer, cookie_step_tried, cookie_step_succeeded, slot_acquired, slot_released
+from services.jobs import (
+    WorkerPool, PriorityWorkerPool, ProgressTracker, create_job, update_job, get_job, delete_job, list_jobs, mark_job_served,
+    claim_orphaned_jobs, release_owned_jobs, add_counter, count_jobs_by_state, job_view, get_job_view, wait_for_job_change, is_terminal_status
+)
 try:
     import requests
 except ImportError:
@@ -27,12 +59,80 @@ CORS(app)
 # Configuration
 TEMP_DIR = os.environ.get('TEMP_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'temp'))
 DOWNLOAD_EXPIRY = int(os.environ.get('DOWNLOAD_EXPIRY', 3600))  # 1 hour
+DISK_QUOTA_BYTES = int(os.environ.get('DISK_QUOTA_BYTES', 0))  # 0 = tanpa batas
+JANITOR_INTERVAL = int(os.environ.get('JANITOR_INTERVAL', 30))
 MAX_CONCURRENT_DOWNLOADS = int(os.environ.get('MAX_CONCURRENT_DOWNLOADS', 5))
+MAX_QUEUED_DOWNLOADS = int(os.environ.get('MAX_QUEUED_DOWNLOADS', 50))
+AUDIO_LANE_WORKERS = int(os.environ.get('AUDIO_LANE_WORKERS', 1))        # worker yang mendahulukan job audio
+SCHED_AGING = float(os.environ.get('SCHED_AGING', 1.0))                  # detik prioritas per detik menunggu
+SCHED_THROUGHPUT_BPS = int(os.environ.get('SCHED_THROUGHPUT_BPS', 2 * 1024 * 1024))  # untuk perkiraan durasi job
+SCHED_DEFAULT_SECONDS = float(os.environ.get('SCHED_DEFAULT_SECONDS', 60))  # kalau info belum ada di cache
+ESTIMATE_WORKERS = int(os.environ.get('ESTIMATE_WORKERS', 2))  # ekstraksi latar untuk perkiraan job yang belum di cache
+def postprocess_workers():
+    """Worker merge/convert ffmpeg per proses: POSTPROCESS_WORKERS, atau core dibagi rata ke worker gunicorn.
+
+    WEB_CONCURRENCY di-set gunicorn.conf.py dari jumlah worker sebenarnya (termasuk -w).
+    """
+    configured = os.environ.get('POSTPROCESS_WORKERS')
+    if configured:
+        return int(configured)
+    return max(1, (os.cpu_count() or 1) // int(os.environ.get('WEB_CONCURRENCY') or 1))
+
+POSTPROCESS_WORKERS = postprocess_workers()
+JOB_DRAIN_TIMEOUT = float(os.environ.get('JOB_DRAIN_TIMEOUT', 20))  # tunggu job jalan saat worker berhenti
+PROGRESS_INTERVAL = float(os.environ.get('PROGRESS_INTERVAL', 0.5))
+STATUS_MAX_WAIT = float(os.environ.get('STATUS_MAX_WAIT', 30))
+STATUS_BULK_LIMIT = int(os.environ.get('STATUS_BULK_LIMIT', 100))
+SSE_HEARTBEAT = float(os.environ.get('SSE_HEARTBEAT', 15))
+# Stream SSE ditutup sebelum timeout worker gunicorn, EventSource tersambung lagi dengan Last-Event-ID
+SSE_MAX_DURATION = float(os.environ.get('SSE_MAX_DURATION', 25))
+STREAM_SLOT_TIMEOUT = int(os.environ.get('STREAM_SLOT_TIMEOUT', 30))
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 8))
+BATCH_PLATFORM_CONCURRENCY = int(os.environ.get('BATCH_PLATFORM_CONCURRENCY', 3))
 COOKIE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cookies.txt')
 
 # Create temp directory if it doesn't exist
 os.makedirs(TEMP_DIR, exist_ok=True)
 download_semaphore = threading.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+# Worker pool untuk job download, request /api/download langsung balik dengan download_id
+download_pool = PriorityWorkerPool(
+    'download', MAX_CONCURRENT_DOWNLOADS, MAX_QUEUED_DOWNLOADS,
+    lanes={'audio': min(AUDIO_LANE_WORKERS, MAX_CONCURRENT_DOWNLOADS - 1)}, aging=SCHED_AGING, on_dequeue=metrics.queue_waited,
+    # Slot diambil sebelum job dipilih, supaya antrian prioritas tidak kalah dengan /api/stream
+    slot=download_semaphore, on_slot=lambda waited: slot_acquired('download', waited)
+)
+# Tahap CPU job download: merge/convert jalan di sini setelah slot download dilepas
+postprocess_pool = PriorityWorkerPool(
+    'postprocess', POSTPROCESS_WORKERS, MAX_QUEUED_DOWNLOADS + MAX_CONCURRENT_DOWNLOADS, on_dequeue=metrics.queue_waited,
+    # Job yang dibuang saat shutdown masih memegang lock artifact
+    on_drop=lambda fn, args, kwargs: kwargs['artifact_lock'].close()
+)
+# Ekstraksi untuk perkiraan durasi job yang URL-nya belum di cache, di luar request dan thread janitor
+estimate_pool = WorkerPool('estimate', ESTIMATE_WORKERS, MAX_QUEUED_DOWNLOADS)
+# download_id -> jumlah thread yang sedang mengerjakannya di proses ini
+running_jobs = Counter()
+running_jobs_lock = threading.Lock()
+extract_flight = SingleFlight('extract')
+login_flight = SingleFlight('login')
+# Cookie hasil login per akun (tanpa password) dan cookies.txt yang di-parse sekali
+session_jars = SessionJarCache()
+cookie_file = CookieFile(COOKIE_FILE)
+# Instance YoutubeDL yang dipakai ulang antar request (extractor, cookie jar, koneksi keep-alive)
+ydl_pool = YoutubeDLPool()
+# Koneksi fragment HLS/DASH dibagi semua job di node ini, lebar per job menyempit kalau antrian ramai
+fragment_budget = ConnectionBudget(demand=lambda: sum(
+    count for state, count in count_jobs_by_state().items() if state in ('queued', 'downloading')
+))
+# Kapasitas ingress/egress node dibagi ke download, stream dan file yang sedang jalan
+bandwidth = BandwidthScheduler()
+# Batas ekstraksi batch bersamaan per platform, dibagi semua request batch di worker ini
+batch_platform_slots = defaultdict(lambda: threading.BoundedSemaphore(BATCH_PLATFORM_CONCURRENCY))
+# Store hasil download berbasis konten, harus satu filesystem dengan TEMP_DIR supaya bisa hardlink
+artifact_store = ArtifactStore(os.path.join(TEMP_DIR, '.store'), on_bytes_changed=lambda delta: add_counter('store_bytes', delta))
+# Pembersih expiry + kuota disk, dijalankan satu leader per host
+janitor = Janitor(
+    TEMP_DIR, artifact_store, DOWNLOAD_EXPIRY, DISK_QUOTA_BYTES, JANITOR_INTERVAL, recover=lambda: resume_orphaned_jobs()
+)
 
 # User agents untuk rotasi, lebih banyak variasi
 USER_AGENTS = [
@@ -59,51 +159,17 @@ SUPPORTED_PLATFORMS = [
     'animepahe', 'zoro', 'aniwatch', 'animeflv', 'wakanim', 'vrv'
 ]
 
-class StreamWithCleanup:
-    def __init__(self, file_path):
-        self.file_path = file_path
-        self.file = open(file_path, 'rb')
-    
-    def __iter__(self):
-        return self
-    
-    def __next__(self):
-        chunk = self.file.read(32768)  # Buffer: 32768 biar stabil
-        if not chunk:
-            self.file.close()
-            self.cleanup()
-            raise StopIteration
-        return chunk
-    
-    def cleanup(self):
-        try:
-            if os.path.exists(self.file_path):
-                os.remove(self.file_path)
-                dir_path = os.path.dirname(self.file_path)
-                if os.path.exists(dir_path) and not os.listdir(dir_path):
-                    os.rmdir(dir_path)
-        except Exception as e:
-            logger.error(f"Cleanup error: {str(e)}")
-
-def is_ffmpeg_installed():
-    return shutil.which('ffmpeg') is not None
+# Protokol yt-dlp yang di-download per fragment (bisa paralel lewat concurrent_fragment_downloads)
+FRAGMENT_PROTOCOL_PATTERN = re.compile(r'm3u8|dash|f4m|ism')
 
 FFMPEG_AVAILABLE = is_ffmpeg_installed()
+# Stream audio dengan codec yang tidak dikenal disalin ke matroska audio
+mimetypes.add_type('audio/x-matroska', '.mka')
 logger.info(f"FFmpeg available: {FFMPEG_AVAILABLE}")
 
-def cleanup_expired_downloads():
-    current_time = time.time()
-    for download_id in os.listdir(TEMP_DIR):
-        download_path = os.path.join(TEMP_DIR, download_id)
-        if os.path.isdir(download_path):
-            if current_time - os.path.getmtime(download_path) > DOWNLOAD_EXPIRY:
-                try:
-                    shutil.rmtree(download_path)
-                    logger.info(f"Cleaned up expired download: {download_id}")
-                except Exception as e:
-                    logger.error(f"Error cleaning up {download_id}: {str(e)}")
-
-cleanup_expired_downloads()
+@app.before_request
+def start_janitor():
+    janitor.ensure_started()
 
 def convert_to_txt(subtitle_file, output_file):
     try:
@@ -136,9 +202,31 @@ def detect_platform(url):
     return None
 
 def fetch_session_cookies(url, session_data):
+    """Cookie sesi untuk akun ini, dari cache kalau masih berlaku, kalau tidak login dulu.
+
+    Login bersamaan untuk akun yang sama digabung (per proses dan lintas worker).
+    """
+    platform = detect_platform(url)
+    cookies = session_jars.get(platform, session_data)
+    if cookies:
+        logger.info(f"Using cached session cookies for {platform}")
+        return cookies
+    key = session_jars.key(platform, session_data)
+    return login_flight.do(key, lambda: _login_and_cache(url, platform, session_data, key))
+
+def _login_and_cache(url, platform, session_data, key):
+    with process_lock(f"login:{key}"):
+        cookies = session_jars.get(platform, session_data)
+        if cookies:
+            return cookies
+        cookies = login_session_cookies(url, platform, session_data)
+        if cookies:
+            session_jars.put(platform, session_data, cookies)
+        return cookies
+
+def login_session_cookies(url, platform, session_data):
     """Simulasi login untuk ambil cookie sesi dengan anti-bot"""
     session = requests.Session()
-    platform = detect_platform(url)
     headers = {
         'User-Agent': random.choice(USER_AGENTS),
         'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
@@ -212,7 +300,7 @@ def fetch_session_cookies(url, session_data):
         if response.status_code == 200:
             cookies = session.cookies.get_dict()
             cookie_str = '; '.join([f"{k}={v}" for k, v in cookies.items()])
-            logger.info(f"Session cookies fetched for {platform}: {cookie_str}")
+            logger.info(f"Session cookies fetched for {platform} ({len(cookies)} cookies)")
             return cookie_str
         else:
             logger.error(f"Failed to fetch session cookies: {response.status_code}")
@@ -221,6 +309,90 @@ def fetch_session_cookies(url, session_data):
         logger.error(f"Error fetching session cookies: {str(e)}")
         return None
 
+# Label rung untuk log
+RUNG_LABELS = {
+    'session': 'session cookies',
+    'user': 'user cookies',
+    'cookiefile': 'backend cookies.txt',
+    'none': 'no cookies',
+}
+
+def cookie_rungs(user_cookies, session_data):
+    """Rung tangga cookie yang bisa dipakai request ini, dalam urutan default"""
+    rungs = []
+    if session_data:
+        rungs.append('session')  # Cookie sesi login pengunjung
+    if user_cookies:
+        rungs.append('user')  # Cookie pengguna dari input
+    if cookie_file.valid():
+        rungs.append('cookiefile')  # Cookie dari cookies.txt
+    rungs.append('none')  # Tanpa cookie, maksimalin anti-bot
+    return rungs
+
+def rung_opts(rung, ydl_opts_base, url, user_cookies, session_data):
+    """Opsi yt-dlp untuk satu rung. Return None kalau rung tidak bisa dipakai (login sesi gagal)"""
+    ydl_opts = dict(ydl_opts_base, http_headers=dict(ydl_opts_base['http_headers']))
+    if rung == 'session':
+        session_cookies = fetch_session_cookies(url, session_data)
+        if not session_cookies:
+            return None
+        ydl_opts['http_headers']['Cookie'] = session_cookies
+    elif rung == 'user':
+        ydl_opts['http_headers']['Cookie'] = user_cookies
+    elif rung == 'cookiefile':
+        ydl_opts[COOKIEFILE_OPTION] = True
+    return ydl_opts
+
+# Bukan opsi yt-dlp: penanda rung cookies.txt, dibuang pooled_ydl sebelum opsi sampai ke YoutubeDL
+COOKIEFILE_OPTION = 'use_cookie_file'
+
+def pooled_ydl(ydl_opts):
+    """YoutubeDL dari pool. Rung cookies.txt memakai jar yang sudah di-parse CookieFile
+    (yt-dlp tidak membaca atau menulis balik file-nya), profilnya ikut berganti kalau file berubah
+    """
+    if not ydl_opts.get(COOKIEFILE_OPTION):
+        return ydl_pool.get(ydl_opts)
+    opts = {k: v for k, v in ydl_opts.items() if k != COOKIEFILE_OPTION}
+    # Stamp dibaca dulu: kalau file diganti di antaranya, jar baru cuma masuk profil lama yang tidak dipakai lagi
+    stamp = cookie_file.stamp
+    return ydl_pool.get(opts, ('cookiefile', stamp), cookie_file.jar())
+
+def run_cookie_ladder(phase, url, platform, ydl_opts_base, user_cookies, session_data, attempt):
+    """Coba rung tangga cookie sampai attempt(ydl_opts) memberi hasil. Return (hasil, error terakhir).
+
+    Urutan rung diambil dari statistik per platform (perkiraan waktu sampai
+    sukses), dan hasil serta latency tiap rung dicatat kembali ke statistik.
+    """
+    last_error = None
+    for rung in order_rungs(phase, platform, cookie_rungs(user_cookies, session_data)):
+        cookie_step_tried(phase, platform, rung)
+        pace(platform)  # Anti-Bot: tunggu giliran dari scheduler per platform
+        start = time.monotonic()
+        result = None
+        try:
+            ydl_opts = rung_opts(rung, ydl_opts_base, url, user_cookies, session_data)
+            if ydl_opts is None:
+                last_error = 'Session login failed'
+            else:
+                result = attempt(ydl_opts)
+                if not result:
+                    last_error = 'No media info returned'
+        except Exception as e:
+            last_error = str(e)
+            # Cookie sesi yang ditolak dibuang dari cache supaya request berikutnya login ulang
+            if rung == 'session' and is_auth_error(last_error):
+                session_jars.invalidate(platform, session_data)
+        try:
+            record_rung(phase, platform, rung, bool(result), time.monotonic() - start)
+        except Exception as e:
+            logger.error(f"Failed to record ladder stats: {str(e)}")
+        if result:
+            logger.info(f"{phase.capitalize()} success with {RUNG_LABELS[rung]} for {platform}")
+            cookie_step_succeeded(phase, platform, rung)
+            return result, None
+        logger.warning(f"{phase.capitalize()} with {RUNG_LABELS[rung]} failed for {platform}: {last_error}")
+    return None, last_error
+
 def extract_with_cookies(url, user_cookies=None, session_data=None):
     """Ekstrak info dengan anti-bot tanpa proxy"""
     platform = detect_platform(url)
@@ -256,63 +428,94 @@ def extract_with_cookies(url, user_cookies=None, session_data=None):
         'noplaylist': True,                # Fokus single video
     }
 
-    # Step 0: Cookie sesi login pengunjung
-    if session_data:
-        session_cookies = fetch_session_cookies(url, session_data)
-        if session_cookies:
-            ydl_opts = ydl_opts_base.copy()
-            ydl_opts['http_headers']['Cookie'] = session_cookies
-            try:
-                time.sleep(random.uniform(2, 6))  # Anti-Bot: Delay variatif
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info = ydl.extract_info(url, download=False)
-                logger.info(f"Success with session cookies for {platform}")
-                return info
-            except Exception as e:
-                logger.warning(f"Session cookies failed for {platform}: {str(e)}")
-
-    # Step 1: Cookie pengguna dari input
-    if user_cookies:
-        ydl_opts = ydl_opts_base.copy()
-        ydl_opts['http_headers']['Cookie'] = user_cookies
-        try:
-            time.sleep(random.uniform(2, 6))
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-            logger.info(f"Success with user cookies for {platform}")
-            return info
-        except Exception as e:
-            logger.warning(f"User cookies failed for {platform}: {str(e)}")
+    def attempt(ydl_opts):
+        with pooled_ydl(ydl_opts) as ydl:
+            return ydl.extract_info(url, download=False)
 
-    # Step 2: Cookie dari cookies.txt
-    if os.path.exists(COOKIE_FILE) and os.stat(COOKIE_FILE).st_size > 0:
-        ydl_opts = ydl_opts_base.copy()
-        ydl_opts['cookiefile'] = COOKIE_FILE
-        try:
-            with open(COOKIE_FILE, 'r') as f:
-                cookie_content = f.read().strip()
-                if not cookie_content.startswith('#') or '\t' not in cookie_content:
-                    logger.warning("Invalid cookies.txt format - must be Netscape format with tabs, skipping")
-                else:
-                    time.sleep(random.uniform(2, 6))
-                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                        info = ydl.extract_info(url, download=False)
-                    logger.info(f"Success with backend cookies.txt for {platform}")
-                    return info
-        except Exception as e:
-            logger.warning(f"Backend cookies.txt failed for {platform}: {str(e)}")
+    info, last_error = run_cookie_ladder('extract', url, platform, ydl_opts_base, user_cookies, session_data, attempt)
+    if not info:
+        logger.error(f"All attempts failed for {platform}: {last_error}")
+    return info
 
-    # Step 3: Tanpa cookie, maksimalin anti-bot
-    ydl_opts = ydl_opts_base.copy()
-    try:
-        time.sleep(random.uniform(3, 7))  # Anti-Bot: Delay lebih lama
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-        logger.info(f"Success without cookies for {platform}")
+def extract_cached(url, user_cookies=None, session_data=None):
+    """Ekstrak info lewat cache metadata bersama, fallback ke extract_with_cookies.
+
+    Request bersamaan untuk URL dan konteks cookie yang sama digabung: hanya
+    satu yang menjalankan yt-dlp, sisanya menunggu hasilnya.
+    """
+    context = cookie_context(user_cookies, session_data)
+    info = get_cached_media_info(url, context)
+    if info:
         return info
-    except Exception as e:
-        logger.error(f"All attempts failed for {platform}: {str(e)}")
+    flight_key = f"{url}\n{context}"
+    return extract_flight.do(flight_key, lambda: _extract_and_cache(url, user_cookies, session_data, context, flight_key))
+
+def _extract_and_cache(url, user_cookies, session_data, context, flight_key):
+    with process_lock(f"extract:{flight_key}"):
+        # Worker gunicorn lain mungkin sudah selesai ekstrak selama kita menunggu lock
+        info = get_cached_media_info(url, context)
+        if info:
+            return info
+        with track_stage('extract', detect_platform(url)) as stage:
+            info = extract_with_cookies(url, user_cookies, session_data)
+            if not info:
+                stage.fail()
+        if info:
+            info = yt_dlp.YoutubeDL.sanitize_info(info)
+            cache_media_info(url, info, context)
+        return info
+
+# Field ringkasan format default di /api/extract, field lain lewat parameter `fields`
+FORMAT_SUMMARY_FIELDS = ('format_id', 'ext', 'resolution', 'vcodec', 'acodec', 'filesize', 'fps', 'tbr', 'has_audio', 'has_video')
+
+def parse_fields(fields):
+    """`fields` boleh list atau string dipisah koma. Return set field tambahan, atau None untuk format lengkap (`all`).
+
+    ValueError kalau bukan string atau list string.
+    """
+    if isinstance(fields, str):
+        fields = fields.split(',')
+    if fields is not None and not (isinstance(fields, list) and all(isinstance(f, str) for f in fields)):
+        raise ValueError('fields must be a string or a list of strings')
+    fields = {f.strip() for f in fields or [] if f and f.strip()}
+    if 'all' in fields or '*' in fields:
         return None
+    return fields
+
+def summarize_format(fmt, extra_fields=()):
+    summary = {
+        'format_id': fmt.get('format_id'),
+        'ext': fmt.get('ext'),
+        'resolution': fmt.get('resolution'),
+        'vcodec': fmt.get('vcodec'),
+        'acodec': fmt.get('acodec'),
+        'filesize': fmt.get('filesize') or fmt.get('filesize_approx'),
+        'fps': fmt.get('fps'),
+        'tbr': fmt.get('tbr'),
+        # yt-dlp memakai 'none' untuk track yang tidak ada, None berarti tidak diketahui
+        'has_audio': fmt.get('acodec') != 'none',
+        'has_video': fmt.get('vcodec') != 'none',
+    }
+    for field in extra_fields:
+        if field in fmt:
+            summary[field] = fmt[field]
+    return summary
+
+def extract_etag(version, extra_fields):
+    """ETag dari versi entry cache + proyeksi field, jadi 304 bisa dijawab tanpa membaca info"""
+    projection = 'all' if extra_fields is None else ','.join(sorted(extra_fields))
+    digest = hashlib.sha256(f"{version}\n{projection}\n{FFMPEG_AVAILABLE}".encode('utf-8')).hexdigest()[:24]
+    return digest
+
+def compressed_json(payload, status=200, etag=None):
+    body, encoding = compress_body(json.dumps(payload, separators=(',', ':')).encode('utf-8'), request.accept_encodings)
+    response = Response(body, status=status, mimetype='application/json')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    if etag:
+        response.set_etag(etag, weak=True)
+    return response
 
 @app.route('/api/extract', methods=['POST'])
 def extract_info():
@@ -320,18 +523,35 @@ def extract_info():
     url = data.get('url')
     user_cookies = data.get('cookies', '')
     session_data = data.get('session_data', {})
+    try:
+        extra_fields = parse_fields(data.get('fields', request.args.get('fields')))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
     
     if not url:
         return jsonify({'status': 'error', 'message': 'URL is required'}), 400
     
     try:
-        info = extract_with_cookies(url, user_cookies, session_data)
+        context = cookie_context(user_cookies, session_data)
+        version = get_cache_version(url, context)
+        if version:
+            etag = extract_etag(version, extra_fields)
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+                response.set_etag(etag, weak=True)
+                response.vary.add('Accept-Encoding')
+                return response
+        
+        info = extract_cached(url, user_cookies, session_data)
         
         if not info:
             return jsonify({'status': 'error', 'message': 'Failed to extract info, likely due to bot detection or server issues. Try valid cookies or session data.'}), 400
         
         has_subtitles = bool(info.get('subtitles'))
         subtitle_languages = list(info.get('subtitles', {}).keys()) if has_subtitles else []
+        formats = info.get('formats', [])
+        if extra_fields is not None:
+            formats = [summarize_format(fmt, extra_fields) for fmt in formats]
         
         response_data = {
             'status': 'success',
@@ -339,7 +559,7 @@ def extract_info():
                 'title': info.get('title', 'Unknown Title'),
                 'duration': info.get('duration'),
                 'thumbnail': info.get('thumbnail'),
-                'formats': info.get('formats', []),
+                'formats': formats,
                 'ffmpeg_available': FFMPEG_AVAILABLE,
                 'has_subtitles': has_subtitles,
                 'subtitle_languages': subtitle_languages,
@@ -347,7 +567,9 @@ def extract_info():
             }
         }
         
-        return jsonify(response_data)
+        # Entry cache baru ditulis kalau tadi miss
+        version = version or get_cache_version(url, context)
+        return compressed_json(response_data, etag=extract_etag(version, extra_fields) if version else None)
     except Exception as e:
         logger.error(f"Error extracting info: {str(e)}")
         return jsonify({'status': 'error', 'message': f'Error: {str(e)}'}), 500
@@ -365,312 +587,678 @@ def download_media():
     
     subtitle_option = options.get('subtitle_option', 0)
     subtitle_lang = options.get('subtitle_lang')
+    audio_format = normalize_audio_format(data.get('audio_format') or options.get('audio_format'))
     
     if not url:
         return jsonify({'status': 'error', 'message': 'URL is required'}), 400
     
+    if not audio_format:
+        return jsonify({'status': 'error', 'message': f"audio_format must be one of: {', '.join(AUDIO_FORMATS)}"}), 400
+    
     if (subtitle_option in [1, 2]) and not FFMPEG_AVAILABLE:
         return jsonify({'status': 'error', 'message': 'FFmpeg is required for subtitle options'}), 400
     
+    download_id = str(uuid.uuid4())
+    download_dir = os.path.join(TEMP_DIR, download_id)
+    os.makedirs(download_dir, exist_ok=True)
+    platform = detect_platform(url)
+    params = {
+        'url': url, 'format_id': format_id, 'download_type': download_type, 'custom_name': custom_name,
+        'subtitle_option': subtitle_option, 'subtitle_lang': subtitle_lang, 'audio_format': audio_format,
+        'user_cookies': user_cookies, 'session_data': session_data,
+    }
+    # Journal ditulis sebelum job terlihat di registry, jadi job yang terdaftar selalu bisa dilanjutkan
+    write_journal(download_id, journal_params(params, platform))
+    create_job(download_id, url=url, platform=platform, expires_in=DOWNLOAD_EXPIRY)
+    
+    submitted, lane, expected_seconds = submit_download(download_id, params)
+    if not submitted:
+        shutil.rmtree(download_dir, ignore_errors=True)
+        delete_job(download_id)
+        remove_journal(download_id)
+        metrics.DOWNLOAD_REQUESTS.labels(status='rejected').inc()
+        return jsonify({'status': 'error', 'message': 'Download queue is full, try again later'}), 503, {'Retry-After': '30'}
+    
+    metrics.DOWNLOAD_REQUESTS.labels(status='queued').inc()
+    return jsonify({
+        'status': 'queued',
+        'download_id': download_id,
+        'status_url': f'/api/status/{download_id}',
+        'platform': platform or 'unknown',
+        'lane': lane,
+        'expected_seconds': round(expected_seconds, 1) if expected_seconds is not None else None
+    }), 202
+
+def submit_download(download_id, params):
+    """Masukkan job ke antrian prioritas. Job pendek jalan duluan, job audio punya lane sendiri"""
+    lane = 'audio' if params['download_type'] == 'audio' else 'video'
+    expected_seconds = estimate_job_seconds(
+        params['url'], params['format_id'], params['download_type'], params['user_cookies'], params['session_data']
+    )
+    submitted = download_pool.submit_prioritized(
+        lane, expected_seconds if expected_seconds is not None else SCHED_DEFAULT_SECONDS,
+        run_download_job, download_id, **params
+    )
+    if submitted and expected_seconds is None:
+        # Belum di cache: antri dulu dengan perkiraan default, prioritasnya diperbaiki setelah ekstraksi latar
+        estimate_pool.submit(refine_job_estimate, download_id, params)
+    return submitted, lane, expected_seconds
+
+def refine_job_estimate(download_id, params):
+    """Ekstrak info job yang masih antri lalu ganti perkiraan durasinya di antrian"""
+    def is_job(fn, args, kwargs):
+        return args[:1] == (download_id,)
+    if not download_pool.is_queued(is_job):
+        return
     try:
-        with download_semaphore:
-            download_id = str(uuid.uuid4())
-            download_dir = os.path.join(TEMP_DIR, download_id)
-            os.makedirs(download_dir, exist_ok=True)
-            
-            platform = detect_platform(url)
-            ydl_opts_base = {
-                'outtmpl': os.path.join(download_dir, '%(title)s.%(ext)s'),
-                'restrictfilenames': True,
-                'nocheckcertificate': True,
-                'geo_bypass': True,
-                'extractor_retries': 15,
-                'socket_timeout': 30,
-                'user_agent': random.choice(USER_AGENTS),
-                'merge_output_format': 'mp4',
-                'fragment_retries': 15,
-                'retries': 15,
-                'fixup': 'force',
-                'http_headers': {
-                    'Referer': 'https://www.youtube.com/' if platform == 'youtube' else 'https://wetv.vip/' if platform == 'wetv' else 'https://www.tiktok.com/' if platform == 'tiktok' else 'https://www.google.com/',
-                    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-                    'Accept-Language': 'en-US,en;q=0.5',
-                    'Connection': 'keep-alive',
-                    'Upgrade-Insecure-Requests': '1',
-                    'DNT': '1',
-                    'Sec-Fetch-Dest': 'document',
-                    'Sec-Fetch-Mode': 'navigate',
-                    'Sec-Fetch-Site': 'same-origin',
-                    'Sec-Fetch-User': '?1',
-                },
-                'noplaylist': True,
-            }
-            
-            subtitle_file = None
-            warning = None
-            info = None
-            last_error = None
-            
-            status_file = os.path.join(download_dir, 'status.txt')
-            with open(status_file, 'w') as f:
-                f.write('downloading')
-
-            if session_data:
-                session_cookies = fetch_session_cookies(url, session_data)
-                if session_cookies:
-                    ydl_opts = ydl_opts_base.copy()
-                    ydl_opts['http_headers']['Cookie'] = session_cookies
-                    try:
-                        if download_type == 'audio' and FFMPEG_AVAILABLE:
-                            ydl_opts['format'] = 'bestaudio/best'
-                            ydl_opts['postprocessors'] = [{
-                                'key': 'FFmpegExtractAudio',
-                                'preferredcodec': 'mp3',
-                                'preferredquality': '192',
-                            }]
-                            file_extension = 'mp3'
-                        else:
-                            ydl_opts['format'] = f"{format_id}+bestaudio/best" if format_id else 'bestvideo+bestaudio/best'
-                            file_extension = 'mp4'
-
-                        if subtitle_option == 1 and subtitle_lang:
-                            temp_ydl_opts = {'skip_download': True, 'http_headers': ydl_opts['http_headers']}
-                            with yt_dlp.YoutubeDL(temp_ydl_opts) as ydl:
-                                info = ydl.extract_info(url, download=False)
-                                audio_langs = set(fmt.get('language') for fmt in info.get('formats', []) if fmt.get('language') and fmt.get('acodec') != 'none')
-                                if subtitle_lang in audio_langs:
-                                    ydl_opts['format'] = f"bestvideo+bestaudio[language={subtitle_lang}]"
-                                    if format_id:
-                                        ydl_opts['format'] = f"{format_id}+bestaudio[language={subtitle_lang}]"
-                                    ydl_opts['postprocessors'] = [{'key': 'FFmpegVideoConvertor', 'preferedformat': 'mp4'}]
-                                else:
-                                    warning = f"Tidak ada audio dalam bahasa {subtitle_lang}"
-                                    ydl_opts['format'] = f"{format_id}+bestaudio/best" if format_id else 'bestvideo+bestaudio/best'
-                                    ydl_opts['postprocessors'] = [{'key': 'FFmpegVideoConvertor', 'preferedformat': 'mp4'}]
-                        
-                        elif subtitle_option == 2 and subtitle_lang:
-                            ydl_opts['writesubtitles'] = True
-                            ydl_opts['subtitleslangs'] = [subtitle_lang]
-                            ydl_opts['subtitlesformat'] = 'vtt'
-                            ydl_opts['format'] = f"{format_id}+bestaudio/best" if format_id else 'bestvideo+bestaudio/best'
-                            ydl_opts['postprocessors'] = [{'key': 'FFmpegVideoConvertor', 'preferedformat': 'mp4'}]
-                        
-                        time.sleep(random.uniform(3, 7))
-                        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                            info = ydl.extract_info(url, download=True)
-                        logger.info(f"Download success with session cookies for {platform}")
-                    except Exception as e:
-                        last_error = str(e)
-                        logger.warning(f"Session cookies failed for {platform}: {last_error}")
-
-            if not info and user_cookies:
-                ydl_opts = ydl_opts_base.copy()
-                ydl_opts['http_headers']['Cookie'] = user_cookies
-                try:
-                    if download_type == 'audio' and FFMPEG_AVAILABLE:
-                        ydl_opts['format'] = 'bestaudio/best'
-                        ydl_opts['postprocessors'] = [{
-                            'key': 'FFmpegExtractAudio',
-                            'preferredcodec': 'mp3',
-                            'preferredquality': '192',
-                        }]
-                        file_extension = 'mp3'
-                    else:
-                        ydl_opts['format'] = f"{format_id}+bestaudio/best" if format_id else 'bestvideo+bestaudio/best'
-                        file_extension = 'mp4'
-
-                    if subtitle_option == 1 and subtitle_lang:
-                        temp_ydl_opts = {'skip_download': True, 'http_headers': ydl_opts['http_headers']}
-                        with yt_dlp.YoutubeDL(temp_ydl_opts) as ydl:
-                            info = ydl.extract_info(url, download=False)
-                            audio_langs = set(fmt.get('language') for fmt in info.get('formats', []) if fmt.get('language') and fmt.get('acodec') != 'none')
-                            if subtitle_lang in audio_langs:
-                                ydl_opts['format'] = f"bestvideo+bestaudio[language={subtitle_lang}]"
-                                if format_id:
-                                    ydl_opts['format'] = f"{format_id}+bestaudio[language={subtitle_lang}]"
-                                ydl_opts['postprocessors'] = [{'key': 'FFmpegVideoConvertor', 'preferedformat': 'mp4'}]
-                            else:
-                                warning = f"Tidak ada audio dalam bahasa {subtitle_lang}"
-                                ydl_opts['format'] = f"{format_id}+bestaudio/best" if format_id else 'bestvideo+bestaudio/best'
-                                ydl_opts['postprocessors'] = [{'key': 'FFmpegVideoConvertor', 'preferedformat': 'mp4'}]
-                    
-                    elif subtitle_option == 2 and subtitle_lang:
-                        ydl_opts['writesubtitles'] = True
-                        ydl_opts['subtitleslangs'] = [subtitle_lang]
-                        ydl_opts['subtitlesformat'] = 'vtt'
-                        ydl_opts['format'] = f"{format_id}+bestaudio/best" if format_id else 'bestvideo+bestaudio/best'
-                        ydl_opts['postprocessors'] = [{'key': 'FFmpegVideoConvertor', 'preferedformat': 'mp4'}]
-                    
-                    time.sleep(random.uniform(3, 7))
-                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                        info = ydl.extract_info(url, download=True)
-                    logger.info(f"Download success with user cookies for {platform}")
-                
-                except Exception as e:
-                    last_error = str(e)
-                    logger.warning(f"User cookies failed for {platform}: {last_error}")
-
-            if not info and os.path.exists(COOKIE_FILE) and os.stat(COOKIE_FILE).st_size > 0:
-                ydl_opts = ydl_opts_base.copy()
-                ydl_opts['cookiefile'] = COOKIE_FILE
-                try:
-                    with open(COOKIE_FILE, 'r') as f:
-                        cookie_content = f.read().strip()
-                        if not cookie_content.startswith('#') or '\t' not in cookie_content:
-                            logger.warning("Invalid cookies.txt format - must be Netscape format with tabs, skipping")
-                        else:
-                            if download_type == 'audio' and FFMPEG_AVAILABLE:
-                                ydl_opts['format'] = 'bestaudio/best'
-                                ydl_opts['postprocessors'] = [{
-                                    'key': 'FFmpegExtractAudio',
-                                    'preferredcodec': 'mp3',
-                                    'preferredquality': '192',
-                                }]
-                                file_extension = 'mp3'
-                            else:
-                                ydl_opts['format'] = f"{format_id}+bestaudio/best" if format_id else 'bestvideo+bestaudio/best'
-                                file_extension = 'mp4'
-
-                            if subtitle_option == 1 and subtitle_lang:
-                                temp_ydl_opts = {'skip_download': True, 'cookiefile': COOKIE_FILE}
-                                with yt_dlp.YoutubeDL(temp_ydl_opts) as ydl:
-                                    info = ydl.extract_info(url, download=False)
-                                    audio_langs = set(fmt.get('language') for fmt in info.get('formats', []) if fmt.get('language') and fmt.get('acodec') != 'none')
-                                    if subtitle_lang in audio_langs:
-                                        ydl_opts['format'] = f"bestvideo+bestaudio[language={subtitle_lang}]"
-                                        if format_id:
-                                            ydl_opts['format'] = f"{format_id}+bestaudio[language={subtitle_lang}]"
-                                        ydl_opts['postprocessors'] = [{'key': 'FFmpegVideoConvertor', 'preferedformat': 'mp4'}]
-                                    else:
-                                        warning = f"Tidak ada audio dalam bahasa {subtitle_lang}"
-                                        ydl_opts['format'] = f"{format_id}+bestaudio/best" if format_id else 'bestvideo+bestaudio/best'
-                                        ydl_opts['postprocessors'] = [{'key': 'FFmpegVideoConvertor', 'preferedformat': 'mp4'}]
-                            
-                            elif subtitle_option == 2 and subtitle_lang:
-                                ydl_opts['writesubtitles'] = True
-                                ydl_opts['subtitleslangs'] = [subtitle_lang]
-                                ydl_opts['subtitlesformat'] = 'vtt'
-                                ydl_opts['format'] = f"{format_id}+bestaudio/best" if format_id else 'bestvideo+bestaudio/best'
-                                ydl_opts['postprocessors'] = [{'key': 'FFmpegVideoConvertor', 'preferedformat': 'mp4'}]
-                            
-                            time.sleep(random.uniform(3, 7))
-                            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                                info = ydl.extract_info(url, download=True)
-                            logger.info(f"Download success with backend cookies.txt for {platform}")
-                
-                except Exception as e:
-                    last_error = str(e)
-                    logger.warning(f"Backend cookies.txt failed for {platform}: {last_error}")
+        extract_cached(params['url'], params['user_cookies'], params['session_data'])
+    except Exception as e:
+        logger.warning(f"Background extract for job estimate failed for {download_id}: {str(e)}")
+        return
+    expected_seconds = estimate_job_seconds(
+        params['url'], params['format_id'], params['download_type'], params['user_cookies'], params['session_data']
+    )
+    if expected_seconds is not None and download_pool.reprioritize(is_job, expected_seconds):
+        logger.info(f"Job {download_id} re-queued with estimate {expected_seconds:.1f}s")
 
-            if not info:
-                ydl_opts = ydl_opts_base.copy()
-                try:
-                    if download_type == 'audio' and FFMPEG_AVAILABLE:
-                        ydl_opts['format'] = 'bestaudio/best'
-                        ydl_opts['postprocessors'] = [{
-                            'key': 'FFmpegExtractAudio',
-                            'preferredcodec': 'mp3',
-                            'preferredquality': '192',
-                        }]
-                        file_extension = 'mp3'
-                    else:
-                        ydl_opts['format'] = f"{format_id}+bestaudio/best" if format_id else 'bestvideo+bestaudio/best'
-                        file_extension = 'mp4'
-
-                    if subtitle_option == 1 and subtitle_lang:
-                        temp_ydl_opts = {'skip_download': True}
-                        with yt_dlp.YoutubeDL(temp_ydl_opts) as ydl:
-                            info = ydl.extract_info(url, download=False)
-                            audio_langs = set(fmt.get('language') for fmt in info.get('formats', []) if fmt.get('language') and fmt.get('acodec') != 'none')
-                            if subtitle_lang in audio_langs:
-                                ydl_opts['format'] = f"bestvideo+bestaudio[language={subtitle_lang}]"
-                                if format_id:
-                                    ydl_opts['format'] = f"{format_id}+bestaudio[language={subtitle_lang}]"
-                                ydl_opts['postprocessors'] = [{'key': 'FFmpegVideoConvertor', 'preferedformat': 'mp4'}]
-                            else:
-                                warning = f"Tidak ada audio dalam bahasa {subtitle_lang}"
-                                ydl_opts['format'] = f"{format_id}+bestaudio/best" if format_id else 'bestvideo+bestaudio/best'
-                                ydl_opts['postprocessors'] = [{'key': 'FFmpegVideoConvertor', 'preferedformat': 'mp4'}]
-                    
-                    elif subtitle_option == 2 and subtitle_lang:
-                        ydl_opts['writesubtitles'] = True
-                        ydl_opts['subtitleslangs'] = [subtitle_lang]
-                        ydl_opts['subtitlesformat'] = 'vtt'
-                        ydl_opts['format'] = f"{format_id}+bestaudio/best" if format_id else 'bestvideo+bestaudio/best'
-                        ydl_opts['postprocessors'] = [{'key': 'FFmpegVideoConvertor', 'preferedformat': 'mp4'}]
-                    
-                    time.sleep(random.uniform(3, 7))
-                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                        info = ydl.extract_info(url, download=True)
-                    logger.info(f"Download success without cookies for {platform}")
-                
-                except Exception as e:
-                    last_error = str(e)
-                    logger.warning(f"Download failed without cookies for {platform}: {last_error}")
+def journal_params(params, platform):
+    """Parameter job untuk journal, tanpa cookie dan password.
 
-            if not info:
-                with open(status_file, 'w') as f:
-                    f.write(f'error: {last_error or "Unknown error"}')
-                return jsonify({'status': 'error', 'message': f"Download failed after all attempts for {platform}: {last_error or 'Unknown error'}"}), 500
-            
-            file_extension = info.get('ext', file_extension)
-            downloaded_files = [f for f in os.listdir(download_dir) if os.path.isfile(os.path.join(download_dir, f))]
-            
-            if not downloaded_files:
-                with open(status_file, 'w') as f:
-                    f.write('error: No files downloaded')
-                return jsonify({'status': 'error', 'message': 'No files were downloaded'}), 500
-            
-            media_file = next((f for f in downloaded_files if f.endswith(f'.{file_extension}')), downloaded_files[0])
-            
-            if subtitle_option == 2 and subtitle_lang:
-                subtitle_vtt = next((f for f in downloaded_files if f.endswith(f'.{subtitle_lang}.vtt')), None)
-                if subtitle_vtt:
-                    subtitle_txt = f"{os.path.splitext(media_file)[0]}.txt"
-                    if convert_to_txt(os.path.join(download_dir, subtitle_vtt), os.path.join(download_dir, subtitle_txt)):
-                        subtitle_file = subtitle_txt
-                        os.remove(os.path.join(download_dir, subtitle_vtt))
-                    else:
-                        warning = "Failed to convert subtitle to text file"
-                else:
-                    warning = f"Tidak ada subtitle dalam bahasa {subtitle_lang}"
-            
-            if custom_name:
-                new_media_file = f"{custom_name}.{file_extension}"
-                os.rename(os.path.join(download_dir, media_file), os.path.join(download_dir, new_media_file))
-                media_file = new_media_file
-                if subtitle_file:
-                    new_subtitle_file = f"{custom_name}.txt"
-                    os.rename(os.path.join(download_dir, subtitle_file), os.path.join(download_dir, new_subtitle_file))
-                    subtitle_file = new_subtitle_file
-            
-            with open(status_file, 'w') as f:
-                f.write('completed')
-            
-            response = {
-                'status': 'success',
-                'download_id': download_id,
-                'filename': media_file,
-                'subtitle_filename': subtitle_file if subtitle_option == 2 else None,
-                'warning': warning,
-                'platform': platform or 'unknown'
-            }
+    Sesi login cukup dirujuk lewat key HMAC jar-nya di SessionJarCache,
+    cookie mentah dari request hanya ditandai ada atau tidak.
+    """
+    entry = {k: v for k, v in params.items() if k not in ('user_cookies', 'session_data')}
+    entry['has_cookies'] = bool(params['user_cookies'])
+    entry['session_key'] = session_jars.key(platform, params['session_data']) if params['session_data'] else None
+    return entry
+
+def restore_params(params):
+    """Kebalikan journal_params. Return (params, error) - error kalau kredensial job tidak bisa dipulihkan"""
+    params = dict(params)
+    has_cookies = params.pop('has_cookies', False)
+    session_key = params.pop('session_key', None)
+    params.setdefault('user_cookies', '')
+    params.setdefault('session_data', {})
+    if has_cookies:
+        return None, 'Job was interrupted and used request cookies, which are not kept; submit it again'
+    if session_key:
+        cookies = session_jars.get_by_key(session_key)
+        if not cookies:
+            return None, 'Job was interrupted and its login session is no longer cached; submit it again with session data'
+        # Cookie sesi dari jar dipakai sebagai cookie biasa, password tidak diperlukan lagi
+        params['user_cookies'] = cookies
+    return params, None
+
+def resume_orphaned_jobs():
+    """Lanjutkan job yang ditinggal worker mati atau dilepas saat shutdown (dipanggil janitor leader).
+
+    File .part yang sudah ada di direktori job dilanjutkan yt-dlp lewat HTTP Range.
+    """
+    stats = download_pool.stats()
+    for download_id in claim_orphaned_jobs(limit=MAX_QUEUED_DOWNLOADS - stats['queued']):
+        entry = read_journal(download_id)
+        if entry is None:
+            update_job(download_id, state='error', error='Job was interrupted and cannot be resumed')
+            continue
+        params, error = restore_params(entry['params'])
+        if error:
+            update_job(download_id, state='error', error=error)
+            remove_journal(download_id)
+            continue
+        submitted, _, _ = submit_download(download_id, params)
+        if not submitted:
+            update_job(download_id, state='error', error='Job was interrupted and the queue is full')
+            remove_journal(download_id)
+            continue
+        logger.info(f"Resuming interrupted download job {download_id} (attempt {entry.get('attempts', 0) + 1})")
+
+def shutdown_downloads(timeout=JOB_DRAIN_TIMEOUT):
+    """Dipanggil saat worker berhenti (SIGTERM): tolak job baru, tunggu job yang jalan sampai timeout,
+    lalu lepas job yang belum selesai supaya worker lain melanjutkannya dari file .part
+    """
+    deadline = time.monotonic() + timeout
+    # Pool download dulu, job yang selesai diunduh masih bisa masuk pool postprocess
+    running = download_pool.shutdown(timeout)
+    running += postprocess_pool.shutdown(max(0, deadline - time.monotonic()))
+    # Job yang thread-nya masih jalan tetap milik proses ini, baru bisa diklaim setelah proses keluar
+    with running_jobs_lock:
+        still_running = list(running_jobs)
+    released = release_owned_jobs(keep=still_running)
+    if running or released:
+        logger.info(f"Worker shutdown: {running} jobs still running, {released} jobs released for resume")
+
+# Perkiraan bitrate kalau format tidak punya filesize/tbr (byte per detik durasi)
+FALLBACK_AUDIO_BPS = 16 * 1024
+FALLBACK_VIDEO_BPS = 256 * 1024
+
+def _format_size(fmt, duration):
+    return fmt.get('filesize') or fmt.get('filesize_approx') or int((fmt.get('tbr') or 0) * 125 * duration) or None
+
+def estimate_job_seconds(url, format_id, download_type, user_cookies, session_data):
+    """Perkiraan lama job dari info di cache (duration, filesize/filesize_approx). None kalau belum diekstrak.
+
+    Tidak pernah mengekstrak sendiri: dipanggil dari request /api/download dan thread janitor.
+    """
+    info = get_cached_media_info(url, cookie_context(user_cookies, session_data))
+    if not info:
+        return None
+    duration = info.get('duration') or 0
+    formats = info.get('formats') or [info]
+    # Format yt-dlp diurutkan dari yang terburuk, jadi yang terakhir = pilihan 'best'
+    audio = next((f for f in reversed(formats) if f.get('vcodec') == 'none' and f.get('acodec') not in (None, 'none')), None)
+    if download_type == 'audio':
+        chosen = [audio or formats[-1]]
+    else:
+        video = next((f for f in formats if f.get('format_id') == format_id), None) if format_id else None
+        video = video or next((f for f in reversed(formats) if f.get('vcodec') not in (None, 'none')), formats[-1])
+        chosen = [video] + ([audio] if audio and video.get('acodec') in (None, 'none') else [])
+    size = sum(_format_size(fmt, duration) or 0 for fmt in chosen)
+    if not size:
+        size = duration * (FALLBACK_AUDIO_BPS if download_type == 'audio' else FALLBACK_VIDEO_BPS)
+    if not size:
+        return None
+    return size / SCHED_THROUGHPUT_BPS
+
+def is_fragmented(info):
+    """Apakah format yang sudah di-resolve (termasuk gabungan video+audio) di-download per fragment"""
+    return bool(FRAGMENT_PROTOCOL_PATTERN.search(info.get('protocol') or ''))
+
+def plan_video_postprocess(info, format_selector):
+    """Remux (stream copy) kalau codec track yang akan diunduh cocok dengan mp4, selain itu transcode"""
+    if not info:
+        return 'convert'
+    try:
+        _, formats = resolve_formats(info, format_selector)
+    except Exception as e:
+        logger.warning(f"Cannot resolve formats for postprocess plan, falling back to convert: {str(e)}")
+        return 'convert'
+    return video_postprocess_plan(formats)
+
+def fetch_media(download_dir, url, format_id, download_type, subtitle_option, subtitle_lang, user_cookies, session_data, progress=None, postprocess_timer=None, fragments=None, flow=None, audio_format='best'):
+    """Tahap network: download media ke download_dir lewat tangga cookie.
+
+    Merge, fixup dan postprocessor yt-dlp tidak dijalankan di sini, tapi
+    dikembalikan (dict fetched) untuk postprocess_media di pool CPU.
+    """
+    platform = detect_platform(url)
+    ydl_opts_base = {
+        'outtmpl': os.path.join(download_dir, '%(title)s.%(ext)s'),
+        'restrictfilenames': True,
+        'nocheckcertificate': True,
+        'geo_bypass': True,
+        'extractor_retries': 15,
+        'socket_timeout': 30,
+        'user_agent': random.choice(USER_AGENTS),
+        'merge_output_format': 'mp4',
+        'fragment_retries': 15,
+        'retries': 15,
+        # File .part dari job yang terputus dilanjutkan dengan HTTP Range, bukan dari nol
+        'continuedl': True,
+        'fixup': 'force',
+        'http_headers': {
+            'Referer': 'https://www.youtube.com/' if platform == 'youtube' else 'https://wetv.vip/' if platform == 'wetv' else 'https://www.tiktok.com/' if platform == 'tiktok' else 'https://www.google.com/',
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+            'Accept-Language': 'en-US,en;q=0.5',
+            'Connection': 'keep-alive',
+            'Upgrade-Insecure-Requests': '1',
+            'DNT': '1',
+            'Sec-Fetch-Dest': 'document',
+            'Sec-Fetch-Mode': 'navigate',
+            'Sec-Fetch-Site': 'same-origin',
+            'Sec-Fetch-User': '?1',
+        },
+        'noplaylist': True,
+    }
+    if progress:
+        ydl_opts_base['progress_hooks'] = [progress.download_hook]
+        ydl_opts_base['postprocessor_hooks'] = [progress.postprocessor_hook]
+        ydl_opts_base['logger'] = progress.ydl_logger()
+    if flow:
+        ydl_opts_base['progress_hooks'] = ydl_opts_base.get('progress_hooks', []) + [flow.progress_hook]
+    if postprocess_timer:
+        ydl_opts_base['postprocessor_hooks'] = ydl_opts_base.get('postprocessor_hooks', []) + [postprocess_timer.hook]
+
+    warning = None
+
+    if download_type == 'audio' and FFMPEG_AVAILABLE:
+        # Stream audio disalin ke container yang cocok, encode ulang hanya kalau codec-nya beda dari yang diminta
+        ydl_opts_base['format'] = AUDIO_SELECTORS[audio_format]
+        ydl_opts_base['postprocessors'] = [audio_postprocessor(audio_format)]
+        file_extension = audio_format if audio_format != 'best' else None
+    else:
+        ydl_opts_base['format'] = f"{format_id}+bestaudio/best" if format_id else 'bestvideo+bestaudio/best'
+        file_extension = 'mp4'
+
+    postprocess = None
+    if subtitle_option == 1 and subtitle_lang:
+        media_info = extract_cached(url, user_cookies, session_data) or {}
+        audio_langs = set(fmt.get('language') for fmt in media_info.get('formats', []) if fmt.get('language') and fmt.get('acodec') != 'none')
+        if subtitle_lang in audio_langs:
+            ydl_opts_base['format'] = f"bestvideo+bestaudio[language={subtitle_lang}]"
+            if format_id:
+                ydl_opts_base['format'] = f"{format_id}+bestaudio[language={subtitle_lang}]"
+        else:
+            warning = f"Tidak ada audio dalam bahasa {subtitle_lang}"
+            ydl_opts_base['format'] = f"{format_id}+bestaudio/best" if format_id else 'bestvideo+bestaudio/best'
+        postprocess = plan_video_postprocess(media_info, ydl_opts_base['format'])
+
+    elif subtitle_option == 2 and subtitle_lang:
+        ydl_opts_base['writesubtitles'] = True
+        ydl_opts_base['subtitleslangs'] = [subtitle_lang]
+        ydl_opts_base['subtitlesformat'] = 'vtt'
+        ydl_opts_base['format'] = f"{format_id}+bestaudio/best" if format_id else 'bestvideo+bestaudio/best'
+        postprocess = plan_video_postprocess(extract_cached(url, user_cookies, session_data), ydl_opts_base['format'])
+
+    if postprocess:
+        ydl_opts_base['postprocessors'] = [video_postprocessor(postprocess)]
+
+    def attempt(ydl_opts):
+        deferred = DeferredPostprocess()
+        with pooled_ydl(ydl_opts) as ydl, deferred.capture(ydl):
+            if fragments:
+                # Lease diambil setelah format di-resolve, hanya kalau protokolnya HLS/DASH
+                def lease_fragments(ydl, info):
+                    if is_fragmented(info):
+                        ydl.params['concurrent_fragment_downloads'] = fragments.acquire()
+                        if progress:
+                            progress.update(fragment_width=fragments.width)
+                ydl.add_post_processor(BeforeDownload(ydl, lease_fragments), when='before_dl')
+
+                # Lebar dibaca downloader setiap mulai satu format, jadi dihitung ulang setiap satu file selesai
+                def rebalance(d):
+                    if d.get('status') == 'finished' and fragments.rebalance():
+                        ydl.params['concurrent_fragment_downloads'] = fragments.width
+                        if progress:
+                            progress.update(fragment_width=fragments.width)
+                ydl.add_progress_hook(rebalance)
+            info = ydl.extract_info(url, download=True)
+        return (info, ydl_opts, deferred) if info else None
+
+    result, last_error = run_cookie_ladder('download', url, platform, ydl_opts_base, user_cookies, session_data, attempt)
+    if not result:
+        raise Exception(f"Download failed after all attempts for {platform}: {last_error or 'Unknown error'}")
+
+    info, ydl_opts, deferred = result
+    return {
+        'download_dir': download_dir, 'download_type': download_type, 'audio_format': audio_format,
+        'subtitle_option': subtitle_option, 'subtitle_lang': subtitle_lang,
+        'info': info, 'ydl_opts': ydl_opts, 'deferred': deferred,
+        'file_extension': file_extension, 'postprocess': postprocess, 'warning': warning,
+    }
+
+def postprocess_media(fetched, progress=None):
+    """Tahap CPU: jalankan merge/fixup/postprocessor yang ditunda fetch_media, return info file hasilnya"""
+    download_dir = fetched['download_dir']
+    download_type, audio_format = fetched['download_type'], fetched['audio_format']
+    subtitle_option, subtitle_lang = fetched['subtitle_option'], fetched['subtitle_lang']
+    postprocess, warning = fetched['postprocess'], fetched['warning']
+    subtitle_file = None
+
+    info = fetched['info']
+    if fetched['deferred'].pending:
+        with pooled_ydl(fetched['ydl_opts']) as ydl:
+            processed = fetched['deferred'].run(ydl)
+        # Info file terakhir sudah berisi ext/filepath setelah merge dan postprocessor
+        info = processed[-1] if processed else info
+
+    file_extension = info.get('ext') or fetched['file_extension'] or 'mp4'
+    if postprocess:
+        metrics.postprocess_path('video', postprocess)
+    elif download_type == 'audio' and FFMPEG_AVAILABLE:
+        # Dinilai dari format sumber, info hasil postprocessor sudah berisi codec/ekstensi tujuan
+        postprocess = audio_mode(fetched['info'], audio_format)
+        metrics.postprocess_path('audio', postprocess)
+    if postprocess and progress:
+        progress.update(postprocess=postprocess)
+    downloaded_files = [f for f in os.listdir(download_dir) if os.path.isfile(os.path.join(download_dir, f))]
+
+    if not downloaded_files:
+        raise Exception('No files downloaded')
+
+    media_file = next((f for f in downloaded_files if f.endswith(f'.{file_extension}')), downloaded_files[0])
+
+    if subtitle_option == 2 and subtitle_lang:
+        subtitle_vtt = next((f for f in downloaded_files if f.endswith(f'.{subtitle_lang}.vtt')), None)
+        if subtitle_vtt:
+            subtitle_txt = f"{os.path.splitext(media_file)[0]}.txt"
+            if convert_to_txt(os.path.join(download_dir, subtitle_vtt), os.path.join(download_dir, subtitle_txt)):
+                subtitle_file = subtitle_txt
+                os.remove(os.path.join(download_dir, subtitle_vtt))
+            else:
+                warning = "Failed to convert subtitle to text file"
+        else:
+            warning = f"Tidak ada subtitle dalam bahasa {subtitle_lang}"
+    
+    return {
+        'media_file': media_file,
+        'subtitle_file': subtitle_file,
+        'warning': warning,
+        'file_extension': file_extension,
+        'postprocess': postprocess,
+        'files': [f for f in os.listdir(download_dir) if os.path.isfile(os.path.join(download_dir, f))]
+    }
+
+def tracked_job(fn):
+    """Catat job yang thread-nya sedang jalan di proses ini, supaya tidak dilepas saat shutdown"""
+    @functools.wraps(fn)
+    def wrapper(download_id, *args, **kwargs):
+        with running_jobs_lock:
+            running_jobs[download_id] += 1
+        try:
+            return fn(download_id, *args, **kwargs)
+        finally:
+            with running_jobs_lock:
+                running_jobs[download_id] -= 1
+                if running_jobs[download_id] <= 0:
+                    del running_jobs[download_id]
+    return wrapper
+
+@tracked_job
+def run_download_job(download_id, url, format_id, download_type, custom_name, subtitle_option, subtitle_lang, user_cookies, session_data, audio_format='best'):
+    """Tahap network job download (di download_pool): unduh dengan slot download, lalu serahkan
+    merge/convert ke postprocess_pool supaya slot langsung bisa dipakai job berikutnya
+    """
+    download_dir = os.path.join(TEMP_DIR, download_id)
+    started = time.monotonic()
+    # Slot download sudah diambil worker download_pool sebelum job ini dipilih, dilepas begitu tahap network selesai
+    slot = ExitStack()
+    slot.callback(slot_released, 'download')
+    slot.callback(download_semaphore.release)
+    # Lock artifact ikut pindah ke tahap CPU dan baru dilepas setelah hasilnya masuk store
+    artifact_lock = ExitStack()
+    try:
+        attempt = record_attempt(download_id)
+        if attempt > JOB_MAX_ATTEMPTS:
+            update_job(download_id, state='error', error=f'Job was interrupted {attempt - 1} times, giving up')
+            remove_journal(download_id)
+            return
+        platform = detect_platform(url)
+        os.makedirs(download_dir, exist_ok=True)
+        try:
+            update_job(download_id, state='downloading')
             
-            return jsonify(response)
+            key = artifact_key(
+                url, format_id, download_type, subtitle_option, subtitle_lang, cookie_context(user_cookies, session_data),
+                audio_format if download_type == 'audio' else None
+            )
+            # Job identik yang bersamaan menunggu di sini lalu cukup di-link dari store
+            artifact_lock.enter_context(process_lock(f"artifact:{key}"))
+            artifact = artifact_store.link_into(key, download_dir)
+            if artifact:
+                logger.info(f"Artifact store hit for {download_id}")
+            else:
+                progress = ProgressTracker(download_id, PROGRESS_INTERVAL)
+                progress.on_fragment_event = lambda kind: metrics.fragment_event(platform, kind)
+                postprocess_timer = PostprocessTimer(platform)
+                flow = bandwidth.open(download_id, 'download', platform)
+                flow.on_refresh = lambda f: progress.update(
+                    throughput=round(f.rate or 0), bandwidth_share=round(f.share) if f.share else None,
+                    throttled_seconds=round(f.throttled, 2)
+                )
+                with fragment_budget.lease(download_id) as fragments, track_stage('download', platform):
+                    progress.update(force=True)
+                    try:
+                        fetched = fetch_media(
+                            download_dir, url, format_id, download_type, subtitle_option, subtitle_lang,
+                            user_cookies, session_data, progress, postprocess_timer, fragments, flow, audio_format
+                        )
+                    finally:
+                        flow.close()
+        finally:
+            slot.close()
+        
+        if artifact:
+            artifact_lock.close()
+            complete_download_job(download_id, artifact, custom_name, subtitle_option, platform, started)
+            return
+        update_job(download_id, state='postprocessing')
+        progress.update(force=True, stage='postprocess_queued', speed=None, eta=None)
+        # Kalau antrian CPU penuh, thread ini menunggu (slot download sudah dilepas) supaya download baru tertahan
+        submitted = postprocess_pool.put_prioritized(
+            'postprocess', 0, run_postprocess_job, download_id, fetched, key, progress, custom_name, subtitle_option,
+            platform, started, time.monotonic(), artifact_lock=artifact_lock
+        )
+        if not submitted:
+            # Pool berhenti (worker shutdown): job dilanjutkan worker lain dari file yang sudah diunduh
+            artifact_lock.close()
+            logger.info(f"Postprocess pool stopped, leaving {download_id} for resume")
+    except Exception as e:
+        artifact_lock.close()
+        fail_download_job(download_id, e, started)
+    finally:
+        slot.close()
+
+@tracked_job
+def run_postprocess_job(download_id, fetched, key, progress, custom_name, subtitle_option, platform, started, queued_at, artifact_lock):
+    """Tahap CPU job download (di postprocess_pool): merge/fixup/convert tanpa memegang slot download"""
+    slot_acquired('postprocess', time.monotonic() - queued_at)
+    try:
+        with artifact_lock:
+            artifact = postprocess_media(fetched, progress)
+            progress.update(force=True, stage='done', speed=None, eta=None)
+            artifact_store.ingest(key, fetched['download_dir'], artifact)
+        complete_download_job(download_id, artifact, custom_name, subtitle_option, platform, started)
     except Exception as e:
-        with open(status_file, 'w') as f:
-            f.write(f'error: {str(e)}')
-        logger.error(f"Download error: {str(e)}")
-        return jsonify({'status': 'error', 'message': f'Download failed: {str(e)}'}), 500
+        fail_download_job(download_id, e, started)
+    finally:
+        slot_released('postprocess')
+
+def complete_download_job(download_id, artifact, custom_name, subtitle_option, platform, started):
+    """Rename hasil sesuai custom_name lalu tandai job selesai"""
+    download_dir = os.path.join(TEMP_DIR, download_id)
+    media_file = artifact['media_file']
+    subtitle_file = artifact['subtitle_file']
+    warning = artifact['warning']
+    file_extension = artifact['file_extension']
+    
+    if custom_name:
+        new_media_file = f"{custom_name}.{file_extension}"
+        os.rename(os.path.join(download_dir, media_file), os.path.join(download_dir, new_media_file))
+        media_file = new_media_file
+        if subtitle_file:
+            new_subtitle_file = f"{custom_name}.txt"
+            os.rename(os.path.join(download_dir, subtitle_file), os.path.join(download_dir, new_subtitle_file))
+            subtitle_file = new_subtitle_file
+    
+    response = {
+        'status': 'success',
+        'download_id': download_id,
+        'filename': media_file,
+        'subtitle_filename': subtitle_file if subtitle_option == 2 else None,
+        'warning': warning,
+        'platform': platform or 'unknown',
+        'postprocess': artifact.get('postprocess')
+    }
+    stats = {
+        name: os.stat(os.path.join(download_dir, name))
+        for name in os.listdir(download_dir) if os.path.isfile(os.path.join(download_dir, name))
+    }
+    files = [{'name': name, 'size': st.st_size} for name, st in stats.items()]
+    update_job(
+        download_id, state='completed', result=response, warning=warning,
+        files=files, total_bytes=sum(f['size'] for f in files),
+        # File yang juga di-hardlink ke store sudah terhitung di store_bytes
+        own_bytes=sum(st.st_size for st in stats.values() if st.st_nlink == 1)
+    )
+    metrics.DOWNLOAD_SIZE.observe(sum(f['size'] for f in files))
+    metrics.DOWNLOAD_DURATION.labels(status='completed').observe(time.monotonic() - started)
+    remove_journal(download_id)
+    logger.info(f"Download job {download_id} completed")
+
+def fail_download_job(download_id, error, started):
+    update_job(download_id, state='error', error=str(error))
+    metrics.DOWNLOAD_DURATION.labels(status='error').observe(time.monotonic() - started)
+    remove_journal(download_id)
+    logger.error(f"Download error: {str(error)}")
 
 @app.route('/api/status/<download_id>', methods=['GET'])
 def check_status(download_id):
-    status_file = os.path.join(TEMP_DIR, download_id, 'status.txt')
-    if os.path.exists(status_file):
-        with open(status_file, 'r') as f:
-            status = f.read().strip()
-        return jsonify({'status': status})
-    return jsonify({'status': 'error', 'message': 'Download ID not found'}), 404
+    """Status job. Dengan ?wait=<detik>&since=<updated_at> jadi long-poll sampai ada perubahan"""
+    try:
+        wait = float(request.args.get('wait') or 0)
+        since = float(request.args.get('since') or 0)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'wait and since must be numbers'}), 400
+    if not (math.isfinite(wait) and math.isfinite(since)) or wait < 0:
+        return jsonify({'status': 'error', 'message': 'wait must be a non-negative number and since a finite number'}), 400
+    wait = min(wait, STATUS_MAX_WAIT)
+    if wait > 0:
+        view = wait_for_job_change(download_id, since, wait)
+    else:
+        view = get_job_view(download_id)
+    if view is None:
+        return jsonify({'status': 'error', 'message': 'Download ID not found'}), 404
+    return jsonify(view)
+
+@app.route('/api/status', methods=['POST'])
+def bulk_status():
+    data = request.json or {}
+    ids = data.get('ids', []) if isinstance(data, dict) else None
+    if not isinstance(ids, list) or not all(isinstance(download_id, str) for download_id in ids):
+        return jsonify({'status': 'error', 'message': 'ids must be a list of strings'}), 400
+    if not ids:
+        return jsonify({'status': 'error', 'message': 'No ids provided'}), 400
+    if len(ids) > STATUS_BULK_LIMIT:
+        return jsonify({'status': 'error', 'message': f'At most {STATUS_BULK_LIMIT} ids per request'}), 400
+    statuses = {}
+    for download_id in ids:
+        statuses[download_id] = get_job_view(download_id) or {'status': 'not_found'}
+    return jsonify({'status': 'success', 'statuses': statuses})
+
+@app.route('/api/jobs', methods=['GET'])
+def jobs_list():
+    state = request.args.get('state')
+    try:
+        limit = int(request.args.get('limit') or 50)
+        offset = int(request.args.get('offset') or 0)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'limit and offset must be integers'}), 400
+    if limit < 1 or offset < 0:
+        return jsonify({'status': 'error', 'message': 'limit must be positive and offset non-negative'}), 400
+    limit = min(limit, 500)
+    jobs = [dict(job_view(job), download_id=job['id']) for job in list_jobs(state, limit, offset)]
+    return jsonify({'status': 'success', 'jobs': jobs, 'counts': count_jobs_by_state()})
+
+@app.route('/api/ladder', methods=['GET'])
+def ladder_inspect():
+    """Statistik menang/kalah tiap rung tangga cookie per platform"""
+    platform = request.args.get('platform')
+    stats = ladder_stats(platform)
+    # Urutan rung yang tercatat saat ini (tanpa rung yang di-skip)
+    orders = defaultdict(list)
+    for entry in sorted(stats, key=lambda e: e['expected_cost']):
+        if not entry['skipped']:
+            orders[f"{entry['phase']}:{entry['platform']}"].append(entry['rung'])
+    return jsonify({'status': 'success', 'rungs': stats, 'order': orders})
+
+@app.route('/api/bandwidth', methods=['GET'])
+def bandwidth_inspect():
+    """Kapasitas node, laju aktual, share dan waktu throttle tiap transfer yang sedang jalan"""
+    return jsonify({'status': 'success', **bandwidth.stats()})
+
+@app.route('/api/status/<download_id>/events', methods=['GET'])
+def status_events(download_id):
+    """Server-Sent Events: kirim status/progress setiap berubah sampai job selesai.
+
+    Satu stream paling lama SSE_MAX_DURATION detik. Tiap event membawa id
+    (updated_at), jadi EventSource yang tersambung lagi mengirim
+    Last-Event-ID (atau ?since=) dan melanjutkan dari situ.
+    """
+    try:
+        since = float(request.headers.get('Last-Event-ID') or request.args.get('since') or 0)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'since must be a number'}), 400
+    if get_job(download_id) is None:
+        return jsonify({'status': 'error', 'message': 'Download ID not found'}), 404
+    
+    def generate(since):
+        deadline = time.monotonic() + SSE_MAX_DURATION
+        yield "retry: 1000\n\n"
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            view = wait_for_job_change(download_id, since, min(SSE_HEARTBEAT, remaining))
+            if view is None:
+                yield 'event: error\ndata: {"status": "not_found"}\n\n'
+                return
+            if view['updated_at'] > since or is_terminal_status(view['status']):
+                since = view['updated_at']
+                yield f"id: {since}\nevent: status\ndata: {json.dumps(view)}\n\n"
+                if is_terminal_status(view['status']):
+                    return
+            else:
+                yield ': keep-alive\n\n'
+    
+    return Response(generate(since), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def resolve_formats(info, format_selector):
+    """Pilih format dari info yang sudah diekstrak tanpa request ulang ke platform"""
+    with ydl_pool.get({'quiet': True, 'no_warnings': True, 'format': format_selector}) as ydl:
+        selected = ydl.process_ie_result(dict(info), download=False)
+    return selected, selected.get('requested_formats') or [selected]
+
+def _ytdlp_pipe(info_path, format_id, user_cookies):
+    cmd = [
+        'yt-dlp', '--quiet', '--no-warnings', '--no-playlist',
+        '--load-info-json', info_path,
+        '-f', format_id,
+        '-o', '-'
+    ]
+    if user_cookies:
+        cmd += ['--add-header', f"Cookie: {user_cookies}"]
+    return subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+def start_stream_pipeline(info_path, formats, download_type, user_cookies, processes, audio_format='best'):
+    """Jalankan pipeline yt-dlp -> ffmpeg lewat pipe, tanpa file sementara di disk.
+
+    Setiap format yang dipilih diambil oleh proses yt-dlp sendiri ke stdout,
+    lalu ffmpeg membaca pipe-pipe itu (pipe:<fd>) dan menulis hasil ke
+    stdout: fragmented MP4 untuk video+audio terpisah. Audio disalin ke
+    container yang cocok dengan codec-nya (atau dikirim langsung tanpa
+    ffmpeg), encode ulang hanya kalau audio_format meminta codec lain.
+    Semua proses dicatat di processes supaya bisa dibersihkan pemanggil.
+    Return (proses yang stdout-nya dikirim ke client, ekstensi file).
+    """
+    passthrough = not FFMPEG_AVAILABLE or (download_type != 'audio' and len(formats) == 1)
+    if download_type == 'audio' and not passthrough:
+        audio_output, extension, mode = stream_audio_plan(formats[0], audio_format)
+        metrics.postprocess_path('audio', mode)
+        passthrough = audio_output is None
+    if passthrough:
+        process = _ytdlp_pipe(info_path, formats[0]['format_id'], user_cookies)
+        processes.append(process)
+        return process, formats[0].get('ext') or 'mp4'
+    
+    sources = []
+    for fmt in formats:
+        source = _ytdlp_pipe(info_path, fmt['format_id'], user_cookies)
+        processes.append(source)
+        sources.append(source)
+    fds = [source.stdout.fileno() for source in sources]
+    
+    cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error']
+    for fd in fds:
+        cmd += ['-i', f'pipe:{fd}']
+    if download_type == 'audio':
+        cmd += audio_output + ['pipe:1']
+    else:
+        video_input = next((i for i, fmt in enumerate(formats) if fmt.get('vcodec') != 'none'), 0)
+        audio_input = next((i for i, fmt in enumerate(formats) if fmt.get('acodec') != 'none' and i != video_input), video_input)
+        cmd += [
+            '-map', f'{video_input}:v:0', '-map', f'{audio_input}:a:0?',
+            '-c', 'copy',
+            '-movflags', 'frag_keyframe+empty_moov+default_base_moof',
+            '-f', 'mp4', 'pipe:1'
+        ]
+        extension = 'mp4'
+    muxer = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, pass_fds=fds)
+    processes.append(muxer)
+    # ffmpeg sudah punya salinan pipe, tutup di sini supaya EOF/SIGPIPE diteruskan dengan benar
+    for source in sources:
+        source.stdout.close()
+        source.stdout = None
+    return muxer, extension
 
 @app.route('/api/stream', methods=['POST'])
 def stream_media():
@@ -678,227 +1266,126 @@ def stream_media():
     url = data.get('url')
     format_id = data.get('format_id')
     download_type = data.get('download_type', 'video')
+    audio_format = normalize_audio_format(data.get('audio_format'))
     user_cookies = data.get('cookies', '')
     session_data = data.get('session_data', {})
     
     if not url:
         return jsonify({'status': 'error', 'message': 'URL is required'}), 400
     
+    if not audio_format:
+        return jsonify({'status': 'error', 'message': f"audio_format must be one of: {', '.join(AUDIO_FORMATS)}"}), 400
+    
+    # Slot dipegang selama stream berjalan, dilepas saat selesai atau client putus
+    wait_start = time.monotonic()
+    if not download_semaphore.acquire(timeout=STREAM_SLOT_TIMEOUT):
+        return jsonify({'status': 'error', 'message': 'Server busy, try again later'}), 503, {'Retry-After': '30'}
+    slot_acquired('stream', time.monotonic() - wait_start)
+    
+    platform = detect_platform(url)
+    state = {'processes': [], 'info_path': None, 'done': False, 'started': time.monotonic(), 'bytes': 0, 'outcome': 'error'}
+    flow = bandwidth.open(f"stream:{uuid.uuid4()}", 'stream', platform)
+    state_lock = threading.Lock()
+    
+    def finish():
+        with state_lock:
+            if state['done']:
+                return
+            state['done'] = True
+        for process in state['processes']:
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+            if process.stdout:
+                process.stdout.close()
+        if state['info_path'] and os.path.exists(state['info_path']):
+            os.remove(state['info_path'])
+        flow.close()
+        download_semaphore.release()
+        slot_released('stream')
+        metrics.observe_stage('serve', platform, time.monotonic() - state['started'], state['outcome'])
+        metrics.BYTES_SERVED.labels(route='stream').inc(state['bytes'])
+    
     try:
-        with download_semaphore:
-            platform = detect_platform(url)
-            ydl_opts_base = {
-                'quiet': True,
-                'no_warnings': True,
-                'ignoreerrors': False,
-                'outtmpl': '-',
-                'nocheckcertificate': True,
-                'geo_bypass': True,
-                'extractor_retries': 15,
-                'socket_timeout': 30,
-                'user_agent': random.choice(USER_AGENTS),
-                'fragment_retries': 15,
-                'retries': 15,
-                'http_headers': {
-                    'Referer': 'https://www.youtube.com/' if platform == 'youtube' else 'https://wetv.vip/' if platform == 'wetv' else 'https://www.tiktok.com/' if platform == 'tiktok' else 'https://www.google.com/',
-                    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-                    'Accept-Language': 'en-US,en;q=0.5',
-                    'Connection': 'keep-alive',
-                    'Upgrade-Insecure-Requests': '1',
-                    'DNT': '1',
-                    'Sec-Fetch-Dest': 'document',
-                    'Sec-Fetch-Mode': 'navigate',
-                    'Sec-Fetch-Site': 'same-origin',
-                    'Sec-Fetch-User': '?1',
-                },
-                'noplaylist': True,
-            }
-
-            def generate():
-                info = None
-                last_error = None
-                
-                if session_data:
-                    session_cookies = fetch_session_cookies(url, session_data)
-                    if session_cookies:
-                        ydl_opts = ydl_opts_base.copy()
-                        ydl_opts['http_headers']['Cookie'] = session_cookies
-                        try:
-                            if download_type == 'audio' and FFMPEG_AVAILABLE:
-                                ydl_opts['format'] = 'bestaudio/best'
-                                ydl_opts['postprocessors'] = [{
-                                    'key': 'FFmpegExtractAudio',
-                                    'preferredcodec': 'mp3',
-                                    'preferredquality': '192',
-                                }]
-                                content_type = 'audio/mpeg'
-                                extension = 'mp3'
-                            else:
-                                ydl_opts['format'] = f"{format_id}+bestaudio/best" if format_id else 'bestvideo+bestaudio/best'
-                                content_type = 'video/mp4'
-                                extension = 'mp4'
-                            
-                            temp_ydl_opts = {'quiet': True, 'skip_download': True, 'http_headers': ydl_opts['http_headers']}
-                            with yt_dlp.YoutubeDL(temp_ydl_opts) as ydl:
-                                info = ydl.extract_info(url, download=False)
-                                title = info.get('title', 'download').replace('/', '_')
-                                filename = f"{title}.{extension}"
-                            
-                            time.sleep(random.uniform(3, 7))
-                            process = subprocess.Popen(
-                                ['yt-dlp', '-f', ydl_opts['format'], '-o', '-', url, '--http-header', f"Cookie: {session_cookies}"],
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE
-                            )
-                            
-                            for chunk in iter(lambda: process.stdout.read(32768), b''):
-                                yield chunk
-                            
-                            process.stdout.close()
-                            process.wait()
-                            logger.info(f"Stream success with session cookies for {platform}")
-                            return
-                        except Exception as e:
-                            last_error = str(e)
-                            logger.warning(f"Session cookies failed for {platform}: {last_error}")
-
-                if user_cookies:
-                    ydl_opts = ydl_opts_base.copy()
-                    ydl_opts['http_headers']['Cookie'] = user_cookies
-                    try:
-                        if download_type == 'audio' and FFMPEG_AVAILABLE:
-                            ydl_opts['format'] = 'bestaudio/best'
-                            ydl_opts['postprocessors'] = [{
-                                'key': 'FFmpegExtractAudio',
-                                'preferredcodec': 'mp3',
-                                'preferredquality': '192',
-                            }]
-                            content_type = 'audio/mpeg'
-                            extension = 'mp3'
-                        else:
-                            ydl_opts['format'] = f"{format_id}+bestaudio/best" if format_id else 'bestvideo+bestaudio/best'
-                            content_type = 'video/mp4'
-                            extension = 'mp4'
-                        
-                        temp_ydl_opts = {'quiet': True, 'skip_download': True, 'http_headers': ydl_opts['http_headers']}
-                        with yt_dlp.YoutubeDL(temp_ydl_opts) as ydl:
-                            info = ydl.extract_info(url, download=False)
-                            title = info.get('title', 'download').replace('/', '_')
-                            filename = f"{title}.{extension}"
-                        
-                        time.sleep(random.uniform(3, 7))
-                        process = subprocess.Popen(
-                            ['yt-dlp', '-f', ydl_opts['format'], '-o', '-', url],
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE
-                        )
-                        
-                        for chunk in iter(lambda: process.stdout.read(32768), b''):
-                            yield chunk
-                        
-                        process.stdout.close()
-                        process.wait()
-                        logger.info(f"Stream success with user cookies for {platform}")
-                        return
-                    except Exception as e:
-                        last_error = str(e)
-                        logger.warning(f"User cookies failed for {platform}: {last_error}")
-
-                if os.path.exists(COOKIE_FILE) and os.stat(COOKIE_FILE).st_size > 0:
-                    ydl_opts = ydl_opts_base.copy()
-                    ydl_opts['cookiefile'] = COOKIE_FILE
-                    try:
-                        with open(COOKIE_FILE, 'r') as f:
-                            cookie_content = f.read().strip()
-                            if not cookie_content.startswith('#') or '\t' not in cookie_content:
-                                logger.warning("Invalid cookies.txt format - must be Netscape format with tabs, skipping")
-                            else:
-                                if download_type == 'audio' and FFMPEG_AVAILABLE:
-                                    ydl_opts['format'] = 'bestaudio/best'
-                                    ydl_opts['postprocessors'] = [{
-                                        'key': 'FFmpegExtractAudio',
-                                        'preferredcodec': 'mp3',
-                                        'preferredquality': '192',
-                                    }]
-                                    content_type = 'audio/mpeg'
-                                    extension = 'mp3'
-                                else:
-                                    ydl_opts['format'] = f"{format_id}+bestaudio/best" if format_id else 'bestvideo+bestaudio/best'
-                                    content_type = 'video/mp4'
-                                    extension = 'mp4'
-                                
-                                temp_ydl_opts = {'quiet': True, 'skip_download': True, 'cookiefile': COOKIE_FILE}
-                                with yt_dlp.YoutubeDL(temp_ydl_opts) as ydl:
-                                    info = ydl.extract_info(url, download=False)
-                                    title = info.get('title', 'download').replace('/', '_')
-                                    filename = f"{title}.{extension}"
-                                
-                                time.sleep(random.uniform(3, 7))
-                                process = subprocess.Popen(
-                                    ['yt-dlp', '-f', ydl_opts['format'], '-o', '-', url],
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE
-                                )
-                                
-                                for chunk in iter(lambda: process.stdout.read(32768), b''):
-                                    yield chunk
-                                
-                                process.stdout.close()
-                                process.wait()
-                                logger.info(f"Stream success with backend cookies.txt for {platform}")
-                                return
-                    except Exception as e:
-                        last_error = str(e)
-                        logger.warning(f"Backend cookies.txt failed for {platform}: {last_error}")
-
-                ydl_opts = ydl_opts_base.copy()
-                try:
-                    if download_type == 'audio' and FFMPEG_AVAILABLE:
-                        ydl_opts['format'] = 'bestaudio/best'
-                        ydl_opts['postprocessors'] = [{
-                            'key': 'FFmpegExtractAudio',
-                            'preferredcodec': 'mp3',
-                            'preferredquality': '192',
-                        }]
-                        content_type = 'audio/mpeg'
-                        extension = 'mp3'
-                    else:
-                        ydl_opts['format'] = f"{format_id}+bestaudio/best" if format_id else 'bestvideo+bestaudio/best'
-                        content_type = 'video/mp4'
-                        extension = 'mp4'
-                    
-                    temp_ydl_opts = {'quiet': True, 'skip_download': True}
-                    with yt_dlp.YoutubeDL(temp_ydl_opts) as ydl:
-                        info = ydl.extract_info(url, download=False)
-                        title = info.get('title', 'download').replace('/', '_')
-                        filename = f"{title}.{extension}"
-                    
-                    time.sleep(random.uniform(3, 7))
-                    process = subprocess.Popen(
-                        ['yt-dlp', '-f', ydl_opts['format'], '-o', '-', url],
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE
-                    )
-                    
-                    for chunk in iter(lambda: process.stdout.read(32768), b''):
-                        yield chunk
-                    
-                    process.stdout.close()
-                    process.wait()
-                    logger.info(f"Stream success without cookies for {platform}")
-                    return
-                except Exception as e:
-                    last_error = str(e)
-                    logger.warning(f"Stream failed without cookies for {platform}: {last_error}")
-                
-                if not info:
-                    raise Exception(f"Stream failed after all attempts for {platform}: {last_error or 'Unknown error'}")
-            
-            return Response(generate(), mimetype='application/octet-stream')
+        # Satu kali ekstraksi (lewat cache), format yang sudah di-resolve diteruskan ke tahap transfer
+        info = extract_cached(url, user_cookies, session_data)
+        if not info:
+            raise Exception(f"Failed to extract info for {platform}")
+        
+        if download_type == 'audio':
+            format_selector = AUDIO_SELECTORS[audio_format]
+        elif FFMPEG_AVAILABLE:
+            format_selector = f"{format_id}+bestaudio/best" if format_id else 'bestvideo+bestaudio/best'
+        else:
+            # Tanpa ffmpeg track terpisah tidak bisa digabung, pakai format gabungan
+            format_selector = f"{format_id}/best" if format_id else 'best'
+        _, formats = resolve_formats(info, format_selector)
+        
+        fd, state['info_path'] = tempfile.mkstemp(prefix='.stream-', suffix='.info.json', dir=TEMP_DIR)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(info, f)
+        
+        process, extension = start_stream_pipeline(
+            state['info_path'], formats, download_type, user_cookies, state['processes'], audio_format
+        )
+        title = info.get('title', 'download').replace('/', '_').replace('"', '')
+        filename = f"{title}.{extension}"
+        
+        def generate():
+            try:
+                for chunk in iter(lambda: process.stdout.read(32768), b''):
+                    state['bytes'] += len(chunk)
+                    # Pipe ikut tertahan saat di-throttle, jadi yt-dlp juga melambat
+                    flow.consume(len(chunk))
+                    yield chunk
+                process.wait()
+                if process.returncode == 0:
+                    state['outcome'] = 'ok'
+                logger.info(f"Stream finished for {platform} with exit code {process.returncode}")
+            finally:
+                finish()
+        
+        response = Response(
+            generate(),
+            mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+            headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+        )
+        response.call_on_close(finish)
+        return response
     except Exception as e:
+        finish()
         logger.error(f"Stream error: {str(e)}")
         return jsonify({'status': 'error', 'message': f'Stream failed: {str(e)}'}), 500
 
+def _batch_item(url, user_cookies, session_data):
+    if not isinstance(url, str):
+        return {'status': 'error', 'url': url, 'error': 'URL must be a string', 'platform': 'unknown'}
+    platform = detect_platform(url) or 'unknown'
+    try:
+        with batch_platform_slots[platform]:
+            info = extract_cached(url, user_cookies, session_data)
+        if not info:
+            return {
+                'status': 'error',
+                'url': url,
+                'error': 'Failed to extract info',
+                'platform': platform
+            }
+        return {
+            'status': 'ready',
+            'url': url,
+            'title': info.get('title', 'Unknown Title'),
+            'type': 'video' if info.get('formats', []) else 'unknown',
+            'platform': platform
+        }
+    except Exception as e:
+        return {
+            'status': 'error',
+            'url': url,
+            'error': str(e),
+            'platform': platform
+        }
+
 @app.route('/api/batch', methods=['POST'])
 def batch_process():
     data = request.json
@@ -908,58 +1395,90 @@ def batch_process():
     
     if not urls:
         return jsonify({'status': 'error', 'message': 'No URLs provided'}), 400
+    if not isinstance(urls, list):
+        return jsonify({'status': 'error', 'message': 'urls must be a list'}), 400
     
-    results = []
-    count = 0
-    
+    # URL duplikat dalam satu batch cukup diekstrak sekali. Entry yang bukan string
+    # tidak di-dedupe (bisa unhashable) dan dilaporkan sebagai error per item
+    seen = set()
+    unique_urls = []
     for url in urls:
-        try:
-            info = extract_with_cookies(url, user_cookies, session_data)
-            if info:
-                count += 1
-                results.append({
-                    'status': 'ready',
-                    'url': url,
-                    'title': info.get('title', 'Unknown Title'),
-                    'type': 'video' if info.get('formats', []) else 'unknown',
-                    'platform': detect_platform(url) or 'unknown'
-                })
-        except Exception as e:
-            results.append({
-                'status': 'error',
-                'url': url,
-                'error': str(e),
-                'platform': detect_platform(url) or 'unknown'
-            })
+        if isinstance(url, str):
+            if url in seen:
+                continue
+            seen.add(url)
+        unique_urls.append(url)
+    urls = unique_urls
+    executor = ThreadPoolExecutor(max_workers=min(BATCH_CONCURRENCY, len(urls)))
+    futures = [executor.submit(_batch_item, url, user_cookies, session_data) for url in urls]
+    
+    stream = request.args.get('stream') == '1' or 'application/x-ndjson' in request.headers.get('Accept', '')
+    if stream:
+        def generate():
+            count = 0
+            try:
+                for future in as_completed(futures):
+                    result = future.result()
+                    if result['status'] == 'ready':
+                        count += 1
+                    yield json.dumps(result) + '\n'
+                yield json.dumps({'status': 'success', 'count': count, 'total': len(urls)}) + '\n'
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
+        
+        return Response(generate(), mimetype='application/x-ndjson')
+    
+    try:
+        results = [future.result() for future in futures]
+    finally:
+        executor.shutdown(wait=False)
     
     return jsonify({
         'status': 'success',
-        'count': count,
+        'count': sum(1 for r in results if r['status'] == 'ready'),
         'results': results
     })
 
 @app.route('/api/file/<download_id>/<filename>', methods=['GET'])
 def serve_file(download_id, filename):
-    file_path = os.path.join(TEMP_DIR, download_id, filename)
-    status_file = os.path.join(TEMP_DIR, download_id, 'status.txt')
-    
-    if not os.path.exists(file_path) or not os.path.exists(status_file):
+    job = get_job(download_id)
+    if job is None:
         abort(404, description="File or status not found")
     
-    with open(status_file, 'r') as f:
-        status = f.read().strip()
-    
-    if status != 'completed':
+    if job['state'] != 'completed':
         return jsonify({'status': 'pending', 'message': 'Download not yet completed'}), 202
     
+    if filename not in {f['name'] for f in job['files'] or []}:
+        abort(404, description="File or status not found")
+    file_path = safe_join(TEMP_DIR, download_id, filename)
+    
+    served_start = time.monotonic()
     try:
-        return Response(
-            StreamWithCleanup(file_path),
+        # File tetap ada sampai kedaluwarsa, jadi client bisa resume dengan Range.
+        # send_file memakai wsgi.file_wrapper (sendfile di gunicorn) kalau tersedia.
+        response = send_file(
+            file_path,
             mimetype='application/octet-stream',
-            headers={
-                'Content-Disposition': f'attachment; filename="{filename}"'
-            }
+            as_attachment=True,
+            download_name=filename,
+            conditional=True,
+            etag=True,
+            max_age=0
         )
+        mark_job_served(download_id)
+        if bandwidth.limited('file') and response.status_code in (200, 206):
+            # Dengan batas egress, body dikirim per chunk lewat share bandwidth, bukan sendfile
+            flow = bandwidth.open(f"file:{uuid.uuid4()}", 'file', job['platform'])
+            response.response = flow.throttle(response.response)
+            response.direct_passthrough = False
+            response.call_on_close(flow.close)
+        # Transfer lewat sendfile tidak melewati close callback, jadi yang dicatat
+        # waktu sampai header siap dan byte sesuai Content-Length (range/304 ikut)
+        metrics.observe_stage('serve', job['platform'], time.monotonic() - served_start)
+        metrics.BYTES_SERVED.labels(route='file').inc(response.content_length or 0)
+        return response
+    except FileNotFoundError:
+        abort(404, description="File or status not found")
     except Exception as e:
         logger.error(f"Error serving file: {str(e)}")
         abort(500, description="Error serving file")
@@ -967,17 +1486,30 @@ def serve_file(download_id, filename):
 @app.route('/api/cleanup', methods=['POST'])
 def manual_cleanup():
     try:
-        cleanup_expired_downloads()
-        return jsonify({'status': 'success', 'message': 'Cleanup completed'})
+        result = janitor.run_once()
+        return jsonify({'status': 'success', 'message': 'Cleanup completed', **result})
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    if not metrics.PROMETHEUS_AVAILABLE:
+        return jsonify({'status': 'error', 'message': 'prometheus_client is not installed'}), 503
+    body, content_type = metrics.render()
+    return Response(body, mimetype=content_type)
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({
         'status': 'ok',
         'ffmpeg_available': FFMPEG_AVAILABLE,
-        'temp_dir_size': sum(os.path.getsize(os.path.join(TEMP_DIR, f)) for f in os.listdir(TEMP_DIR) if os.path.isfile(os.path.join(TEMP_DIR, f)))
+        # Dari counter di registry, bukan scan TEMP_DIR. File hardlink job + store dihitung sekali
+        'temp_dir_size': janitor.disk_usage(),
+        'disk_quota': DISK_QUOTA_BYTES,
+        'jobs': count_jobs_by_state(),
+        'fragment_connections': fragment_budget.stats(),
+        'download_queue': download_pool.stats(),
+        'postprocess_queue': postprocess_pool.stats()
     })
 
 if __name__ == '__main__':
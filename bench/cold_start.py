@@ -0,0 +1,155 @@
+"""Benchmark cold start gunicorn: time-to-first-request dan memori per worker.
+
+Jalankan dari root repo:
+
+    python bench/cold_start.py --workers 4 --mode both
+
+Untuk tiap mode (preload / no-preload) gunicorn dijalankan dengan
+gunicorn.conf.py, lalu dicatat:
+  - ttfr: detik dari spawn sampai GET /api/health pertama sukses
+  - ready: detik sampai semua worker menjawab request
+  - rss/pss per worker dari /proc (PSS membagi halaman shared copy-on-write)
+
+--max-ttfr dan --max-pss-mb membuat script exit 1 kalau terlampaui, supaya
+regresi bisa ditangkap di CI.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def read_kb(path, field):
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def worker_pids(master_pid):
+    pids = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == master_pid:
+            pids.append(int(entry))
+    return sorted(pids)
+
+
+def get(url, timeout=2):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return response.status, response.headers
+
+
+def run(mode, workers, port, timeout):
+    state_dir = tempfile.mkdtemp(prefix='bench-state-')
+    temp_dir = tempfile.mkdtemp(prefix='bench-temp-')
+    env = dict(
+        os.environ, STATE_DIR=state_dir, TEMP_DIR=temp_dir,
+        PRELOAD_APP='1' if mode == 'preload' else '0',
+        PROMETHEUS_MULTIPROC_DIR=os.path.join(state_dir, 'prometheus'),
+    )
+    cmd = [
+        sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+        '-w', str(workers), '-b', f'127.0.0.1:{port}', 'app:app',
+    ]
+    started = time.monotonic()
+    process = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}/api/health'
+    ttfr = None
+    try:
+        while time.monotonic() - started < timeout:
+            try:
+                status, _ = get(url)
+                if status == 200:
+                    ttfr = time.monotonic() - started
+                    break
+            except OSError:
+                time.sleep(0.02)
+        if ttfr is None:
+            raise RuntimeError(f'{mode}: server did not answer within {timeout}s')
+
+        # Tunggu sampai semua worker hidup dan sudah melayani request
+        while len(worker_pids(process.pid)) < workers and time.monotonic() - started < timeout:
+            time.sleep(0.05)
+        for _ in range(workers * 4):
+            get(url)
+        ready = time.monotonic() - started
+
+        pids = worker_pids(process.pid)
+        per_worker = [
+            {
+                'pid': pid,
+                'rss_mb': round((read_kb(f'/proc/{pid}/status', 'VmRSS') or 0) / 1024, 1),
+                'pss_mb': round((read_kb(f'/proc/{pid}/smaps_rollup', 'Pss') or 0) / 1024, 1),
+            }
+            for pid in pids
+        ]
+        master = {
+            'rss_mb': round((read_kb(f'/proc/{process.pid}/status', 'VmRSS') or 0) / 1024, 1),
+            'pss_mb': round((read_kb(f'/proc/{process.pid}/smaps_rollup', 'Pss') or 0) / 1024, 1),
+        }
+        return {
+            'mode': mode,
+            'workers': len(pids),
+            'ttfr_s': round(ttfr, 3),
+            'ready_s': round(ready, 3),
+            'master': master,
+            'per_worker': per_worker,
+            'worker_pss_mb_max': max((w['pss_mb'] for w in per_worker), default=0),
+            'total_pss_mb': round(master['pss_mb'] + sum(w['pss_mb'] for w in per_worker), 1),
+        }
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        shutil.rmtree(state_dir, ignore_errors=True)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--mode', choices=['preload', 'no-preload', 'both'], default='both')
+    parser.add_argument('--port', type=int, default=10999)
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--max-ttfr', type=float, help='Gagal kalau time-to-first-request (detik) melebihi ini')
+    parser.add_argument('--max-pss-mb', type=float, help='Gagal kalau PSS worker terbesar (MB) melebihi ini')
+    args = parser.parse_args()
+
+    modes = ['preload', 'no-preload'] if args.mode == 'both' else [args.mode]
+    results = [run(mode, args.workers, args.port, args.timeout) for mode in modes]
+    print(json.dumps(results, indent=2))
+
+    failed = False
+    for result in results:
+        if args.max_ttfr is not None and result['ttfr_s'] > args.max_ttfr:
+            print(f"{result['mode']}: ttfr {result['ttfr_s']}s > {args.max_ttfr}s", file=sys.stderr)
+            failed = True
+        if args.max_pss_mb is not None and result['worker_pss_mb_max'] > args.max_pss_mb:
+            print(f"{result['mode']}: worker PSS {result['worker_pss_mb_max']}MB > {args.max_pss_mb}MB", file=sys.stderr)
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import os
+import sys
+import shutil
+
+# Metrik Prometheus dikumpulkan per worker di direktori ini lalu digabung saat
+# /metrics di-scrape (prometheus_client multiprocess mode). Harus di-set
+# sebelum worker mengimpor app.
+STATE_DIR = os.environ.get('STATE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'state'))
+# Nilai kosong (misalnya `PROMETHEUS_MULTIPROC_DIR=` di .env) dianggap tidak di-set, lalu
+# ditulis balik ke environment supaya app dan worker melihat direktori yang sama
+os.environ['PROMETHEUS_MULTIPROC_DIR'] = os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.path.join(STATE_DIR, 'prometheus')
+# Dengan preload, app diimpor sebelum on_starting, jadi direktori harus sudah ada
+os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+# Preload: app dan yt-dlp dimuat sekali di master lalu dibagi copy-on-write ke
+# worker. PRELOAD_APP=0 kembali ke mode lama (tiap worker impor sendiri).
+preload_app = os.environ.get('PRELOAD_APP', '1') != '0'
+
+# Long-poll status dan SSE memegang koneksi lama, jadi tiap worker melayani
+# banyak request sekaligus lewat thread (worker sync cuma satu request per proses)
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+# Harus lebih besar dari STATUS_MAX_WAIT dan SSE_MAX_DURATION
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', max(60, float(os.environ.get('STATUS_MAX_WAIT', 30)) + 30)))
+
+# Waktu yang diberikan ke worker untuk menyelesaikan/melepas job saat SIGTERM
+# (harus lebih besar dari JOB_DRAIN_TIMEOUT)
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 30))
+
+
+def on_starting(server):
+    # Sisa metrik dari run sebelumnya dibuang supaya counter mulai dari nol
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def when_ready(server):
+    if preload_app:
+        from services.warmup import warm_up
+        warm_up()
+
+
+def post_fork(server, worker):
+    # Jumlah worker dari -w tidak terlihat lewat environment, padahal pool CPU tiap worker
+    # dibagi dari jumlah itu. Pool baru jalan saat job pertama, jadi dengan preload masih
+    # sempat diubah di sini; tanpa preload app membaca WEB_CONCURRENCY saat diimpor
+    os.environ['WEB_CONCURRENCY'] = str(server.cfg.workers)
+    app_module = sys.modules.get('app')
+    if app_module is not None:
+        app_module.postprocess_pool.workers = app_module.postprocess_workers()
+
+
+def child_exit(server, worker):
+    from services.metrics import mark_process_dead
+    mark_process_dead(worker.pid)
+
+
+def worker_exit(server, worker):
+    # Juga dipanggil di master untuk worker yang sudah mati, yang itu dilewati
+    app_module = sys.modules.get('app')
+    if worker.pid != os.getpid() or app_module is None:
+        return
+    app_module.shutdown_downloads()
@@ -8,8 +8,7 @@ import random
 import logging
 import threading
 import re
-import shutil
-from services.cleanup import StreamWithCleanup, cleanup_expired_downloads, convert_to_txt
+from services.cleanup import StreamWithCleanup, cleanup_expired_downloads, convert_to_txt, is_ffmpeg_installed
 from services.cache import get_cached_media_info, cache_media_info
 
 api_bp = Blueprint('api', __name__)
@@ -33,9 +32,6 @@ USER_AGENTS = [
     'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:90.0) Gecko/20100101 Firefox/90.0',
 ]
 
-def is_ffmpeg_installed():
-    return shutil.which('ffmpeg') is not None
-
 FFMPEG_AVAILABLE = is_ffmpeg_installed()
 logger.info(f"FFmpeg available: {FFMPEG_AVAILABLE}")
 
@@ -46,44 +42,43 @@ def extract_info():
     if not url:
         return jsonify({'status': 'error', 'message': 'URL is required'}), 400
     try:
-        cached_info = get_cached_media_info(url)
-        if cached_info:
-            return jsonify(cached_info)
-
-        ydl_opts = {
-            'format': 'best',
-            'quiet': True,
-            'no_warnings': True,
-            'skip_download': True,
-            'writesubtitles': True,
-            'listsubtitles': True,
-            'ignoreerrors': True,
-            'nocheckcertificate': True,
-            'geo_bypass': True,
-            'extractor_retries': 3,
-            'socket_timeout': 30,
-            'user_agent': random.choice(USER_AGENTS)
-        }
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            if not info:
-                return jsonify({'status': 'error', 'message': 'Could not extract info'}), 400
-            has_subtitles = bool(info.get('subtitles'))
-            subtitle_languages = list(info.get('subtitles', {}).keys()) if has_subtitles else []
-            response_data = {
-                'status': 'success',
-                'data': {
-                    'title': info.get('title', 'Unknown Title'),
-                    'duration': info.get('duration'),
-                    'thumbnail': info.get('thumbnail'),
-                    'formats': info.get('formats', []),
-                    'ffmpeg_available': FFMPEG_AVAILABLE,
-                    'has_subtitles': has_subtitles,
-                    'subtitle_languages': subtitle_languages
-                }
+        info = get_cached_media_info(url)
+        if not info:
+            ydl_opts = {
+                'format': 'best',
+                'quiet': True,
+                'no_warnings': True,
+                'skip_download': True,
+                'writesubtitles': True,
+                'listsubtitles': True,
+                'ignoreerrors': True,
+                'nocheckcertificate': True,
+                'geo_bypass': True,
+                'extractor_retries': 3,
+                'socket_timeout': 30,
+                'user_agent': random.choice(USER_AGENTS)
+            }
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                info = ydl.extract_info(url, download=False)
+                if not info:
+                    return jsonify({'status': 'error', 'message': 'Could not extract info'}), 400
+                info = ydl.sanitize_info(info)
+                cache_media_info(url, info)
+        has_subtitles = bool(info.get('subtitles'))
+        subtitle_languages = list(info.get('subtitles', {}).keys()) if has_subtitles else []
+        response_data = {
+            'status': 'success',
+            'data': {
+                'title': info.get('title', 'Unknown Title'),
+                'duration': info.get('duration'),
+                'thumbnail': info.get('thumbnail'),
+                'formats': info.get('formats', []),
+                'ffmpeg_available': FFMPEG_AVAILABLE,
+                'has_subtitles': has_subtitles,
+                'subtitle_languages': subtitle_languages
             }
-            cache_media_info(url, response_data)
-            return jsonify(response_data)
+        }
+        return jsonify(response_data)
     except Exception as e:
         logger.error(f"Error extracting info: {str(e)}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
@@ -0,0 +1,144 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.json'
+
+
+def artifact_key(url, format_id, download_type, subtitle_option, subtitle_lang, context='', audio_format=None):
+    """Key kanonik untuk hasil download (url, format, tipe, opsi subtitle, konteks cookie, format audio)"""
+    parts = [url, format_id or '', download_type or 'video', subtitle_option or 0, subtitle_lang or '', context or '']
+    if audio_format:
+        parts.append(audio_format)
+    canonical = json.dumps(parts)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class ArtifactStore:
+    """Store hasil download berbasis konten.
+
+    Setiap entry adalah direktori <root>/<key>/ berisi file hasil (media
+    mentah maupun turunan seperti mp3 atau subtitle .txt) dan manifest.json.
+    Direktori download per job berisi hardlink ke file di store, jadi jumlah
+    referensi sebuah entry sama dengan st_nlink - 1 dari file-filenya.
+    on_bytes_changed(delta) dipanggil setiap ukuran store bertambah/berkurang.
+    """
+
+    def __init__(self, root, on_bytes_changed=None):
+        self.root = root
+        self.on_bytes_changed = on_bytes_changed
+        os.makedirs(root, exist_ok=True)
+
+    def _bytes_changed(self, delta):
+        if self.on_bytes_changed and delta:
+            try:
+                self.on_bytes_changed(delta)
+            except Exception as e:
+                logger.error(f"Failed to update artifact store size: {str(e)}")
+
+    def _entry_size(self, key):
+        manifest = self._read_manifest(key)
+        return (manifest or {}).get('total_bytes', 0)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.root, key)
+
+    def _read_manifest(self, key):
+        manifest_path = os.path.join(self._entry_dir(key), MANIFEST_FILE)
+        try:
+            with open(manifest_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def link_into(self, key, download_dir):
+        """Hardlink file entry ke download_dir. Return manifest, atau None kalau belum ada"""
+        manifest = self._read_manifest(key)
+        if not manifest:
+            return None
+        entry_dir = self._entry_dir(key)
+        try:
+            for name in manifest['files']:
+                _link_or_copy(os.path.join(entry_dir, name), os.path.join(download_dir, name))
+        except OSError as e:
+            logger.warning(f"Artifact {key[:12]} is incomplete, refetching: {str(e)}")
+            for name in manifest['files']:
+                try:
+                    os.remove(os.path.join(download_dir, name))
+                except OSError:
+                    pass
+            self.remove(key)
+            return None
+        os.utime(entry_dir)
+        return manifest
+
+    def ingest(self, key, download_dir, manifest):
+        """Masukkan file hasil download ke store lewat hardlink, lalu tulis manifest"""
+        entry_dir = self._entry_dir(key)
+        if os.path.exists(os.path.join(entry_dir, MANIFEST_FILE)):
+            return
+        tmp_dir = f"{entry_dir}.tmp{os.getpid()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        try:
+            for name in manifest['files']:
+                _link_or_copy(os.path.join(download_dir, name), os.path.join(tmp_dir, name))
+            total_bytes = sum(os.path.getsize(os.path.join(tmp_dir, name)) for name in manifest['files'])
+            manifest = dict(manifest, key=key, created_at=time.time(), total_bytes=total_bytes)
+            with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w') as f:
+                json.dump(manifest, f)
+            self.remove(key)
+            os.rename(tmp_dir, entry_dir)
+            self._bytes_changed(total_bytes)
+        except OSError as e:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            logger.error(f"Failed to store artifact {key[:12]}: {str(e)}")
+
+    def refcount(self, key):
+        manifest = self._read_manifest(key)
+        if not manifest:
+            return 0
+        counts = []
+        for name in manifest['files']:
+            try:
+                counts.append(os.stat(os.path.join(self._entry_dir(key), name)).st_nlink - 1)
+            except OSError:
+                counts.append(0)
+        return max(counts) if counts else 0
+
+    def remove(self, key):
+        entry_dir = self._entry_dir(key)
+        if not os.path.isdir(entry_dir):
+            return
+        size = self._entry_size(key)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        self._bytes_changed(-size)
+
+    def prune(self, max_age):
+        """Hapus entry yang tidak direferensikan job mana pun dan lebih tua dari max_age detik"""
+        if not os.path.isdir(self.root):
+            return
+        now = time.time()
+        for key in os.listdir(self.root):
+            entry_dir = self._entry_dir(key)
+            if not os.path.isdir(entry_dir):
+                continue
+            if '.tmp' in key:
+                if now - os.path.getmtime(entry_dir) > max_age:
+                    shutil.rmtree(entry_dir, ignore_errors=True)
+                continue
+            if now - os.path.getmtime(entry_dir) > max_age and self.refcount(key) == 0:
+                self.remove(key)
+                logger.info(f"Pruned unreferenced artifact: {key[:12]}")
@@ -0,0 +1,275 @@
+import os
+import time
+import logging
+import threading
+from services.state import get_db, process_owner, owner_alive
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+NODE_INGRESS_BPS = int(os.environ.get('NODE_INGRESS_BPS', 0))  # kapasitas download node, 0 = tanpa batas
+NODE_EGRESS_BPS = int(os.environ.get('NODE_EGRESS_BPS', 0))    # kapasitas kirim ke client, 0 = tanpa batas
+BANDWIDTH_INTERVAL = float(os.environ.get('BANDWIDTH_INTERVAL', 1.0))  # detik antar hitung ulang share
+# Bobot per jenis transfer, format "kind=weight,..."
+BANDWIDTH_WEIGHTS = os.environ.get('BANDWIDTH_WEIGHTS', 'stream=2,file=2,download=1')
+
+# Flow boleh naik sampai HEADROOM x laju terakhirnya, sisa kapasitas dibagi ke flow lain
+HEADROOM = 1.5
+MIN_RATE = 64 * 1024
+
+# Arah yang dipakai tiap jenis transfer. Stream adalah pipe, jadi makan dua-duanya
+DIRECTIONS = {'download': ('in',), 'stream': ('in', 'out'), 'file': ('out',)}
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS bandwidth_flows (
+    flow_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    label TEXT,
+    weight REAL NOT NULL,
+    owner TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    rate REAL,
+    share REAL,
+    throttled REAL NOT NULL DEFAULT 0
+);
+'''
+
+
+def _db():
+    return get_db('bandwidth', _SCHEMA)
+
+
+def parse_weights(value):
+    weights = {}
+    for item in (value or '').split(','):
+        kind, _, weight = item.partition('=')
+        try:
+            weights[kind.strip()] = max(0.01, float(weight))
+        except ValueError:
+            continue
+    return weights
+
+
+def allocate(capacity, flows):
+    """Weighted max-min fair share (water-filling).
+
+    flows: {flow_id: (weight, demand)}, demand None = belum diketahui.
+    Flow yang butuh kurang dari bagiannya dapat sebesar kebutuhannya,
+    sisanya dibagi lagi menurut bobot ke flow yang masih mau lebih. Kalau
+    semua flow sudah terpenuhi, sisa kapasitas tetap dibagi menurut bobot
+    supaya tidak ada kapasitas yang menganggur.
+    """
+    shares = {}
+    remaining = float(capacity)
+    pending = dict(flows)
+    while pending:
+        total_weight = sum(weight for weight, _ in pending.values())
+        per_weight = remaining / total_weight
+        satisfied = {
+            flow_id: demand for flow_id, (weight, demand) in pending.items()
+            if demand is not None and demand <= weight * per_weight
+        }
+        if not satisfied:
+            for flow_id, (weight, _) in pending.items():
+                shares[flow_id] = weight * per_weight
+            return shares
+        for flow_id, demand in satisfied.items():
+            shares[flow_id] = demand
+            remaining -= demand
+            del pending[flow_id]
+    total_weight = sum(weight for weight, _ in flows.values())
+    for flow_id, (weight, _) in flows.items():
+        shares[flow_id] += remaining * weight / total_weight
+    return shares
+
+
+class Flow:
+    """Satu transfer aktif (download, stream atau file) yang dibatasi lajunya.
+
+    consume(n) dipanggil setiap ada n byte lewat, dari thread mana pun.
+    Tiap BANDWIDTH_INTERVAL detik laju aktual dicatat dan share dihitung
+    ulang dari semua flow di node, lalu token bucket menidurkan pemanggil
+    kalau flow ini melewati share-nya.
+    """
+
+    def __init__(self, scheduler, flow_id, kind, label=None):
+        self.scheduler = scheduler
+        self.flow_id = flow_id
+        self.kind = kind
+        self.label = label
+        self.weight = scheduler.weights.get(kind, 1.0)
+        self.started_at = time.time()
+        self.share = None
+        self.rate = None
+        self.bytes = 0
+        self.throttled = 0.0
+        self.on_refresh = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self._tokens = 0.0
+        self._last_fill = time.monotonic()
+        self._window_start = self._last_fill
+        self._window_bytes = 0
+        self._last_seen = {}
+
+    def _refresh(self, now):
+        elapsed = now - self._window_start
+        if elapsed > 0:
+            self.rate = self._window_bytes / elapsed
+        self._window_start = now
+        self._window_bytes = 0
+        try:
+            self.share = self.scheduler.refresh(self)
+        except Exception as e:
+            logger.warning(f"Bandwidth refresh failed for {self.flow_id}: {str(e)}")
+        if self.on_refresh:
+            self.on_refresh(self)
+
+    def consume(self, nbytes):
+        if nbytes <= 0 or self._closed:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self.bytes += nbytes
+            self._window_bytes += nbytes
+            if now - self._window_start >= self.scheduler.interval:
+                self._refresh(now)
+            share = self.share
+            if not share:
+                return
+            # Burst maksimal seperempat detik supaya flow yang sempat diam tidak menyembur
+            self._tokens = min(share / 4, self._tokens + (now - self._last_fill) * share)
+            self._last_fill = now
+            self._tokens -= nbytes
+            delay = -self._tokens / share if self._tokens < 0 else 0
+        if delay > 0:
+            self.throttled += delay
+            metrics.BANDWIDTH_THROTTLED.labels(kind=self.kind).inc(delay)
+            time.sleep(delay)
+
+    def progress_hook(self, d):
+        """progress_hooks yt-dlp: byte baru dihitung dari downloaded_bytes per file.
+
+        Laporan pertama tiap file cuma jadi patokan, karena download yang
+        dilanjutkan dari .part sudah mulai dari byte yang ada di disk.
+        """
+        filename = d.get('tmpfilename') or d.get('filename')
+        downloaded = d.get('downloaded_bytes') or 0
+        with self._lock:
+            last = self._last_seen.get(filename, downloaded)
+            delta = downloaded - last
+            self._last_seen[filename] = max(downloaded, last)
+        if d.get('status') == 'downloading' and delta > 0:
+            self.consume(delta)
+
+    def throttle(self, iterable):
+        """Bungkus iterator body response supaya tiap chunk lewat consume()"""
+        try:
+            for chunk in iterable:
+                self.consume(len(chunk))
+                yield chunk
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+            self.close()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.scheduler.release(self)
+
+
+class BandwidthScheduler:
+    """Pembagi kapasitas ingress/egress node ke semua flow aktif, lewat SQLite.
+
+    Tiap flow menghitung share-nya sendiri dari tabel bandwidth_flows
+    dengan weighted max-min fairness: kebutuhan flow diperkirakan dari
+    laju terakhirnya x HEADROOM, jadi transfer kecil (audio, mobile) tetap
+    dapat laju yang dibutuhkannya dan sisanya dibagi ke transfer besar.
+    Kapasitas 0 berarti arah itu tidak dibatasi, tapi laju tetap dicatat.
+    """
+
+    def __init__(self, ingress=NODE_INGRESS_BPS, egress=NODE_EGRESS_BPS, interval=BANDWIDTH_INTERVAL, weights=BANDWIDTH_WEIGHTS):
+        self.capacity = {'in': max(0, ingress), 'out': max(0, egress)}
+        self.interval = max(0.1, interval)
+        self.weights = parse_weights(weights)
+
+    def limited(self, kind):
+        return any(self.capacity[direction] for direction in DIRECTIONS[kind])
+
+    def open(self, flow_id, kind, label=None):
+        flow = Flow(self, flow_id, kind, label)
+        try:
+            self._save(flow)
+            flow.share = self._share(flow)
+        except Exception as e:
+            logger.warning(f"Failed to register bandwidth flow {flow_id}: {str(e)}")
+        return flow
+
+    def _save(self, flow):
+        """Upsert baris flow, jadi flow yang sempat dibuang karena lama diam terdaftar lagi"""
+        _db().execute(
+            'INSERT INTO bandwidth_flows (flow_id, kind, label, weight, owner, started_at, updated_at, bytes, rate, share, throttled) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(flow_id) DO UPDATE SET updated_at = excluded.updated_at, '
+            'bytes = excluded.bytes, rate = excluded.rate, share = excluded.share, throttled = excluded.throttled',
+            (flow.flow_id, flow.kind, flow.label, flow.weight, process_owner(), flow.started_at, time.time(),
+             flow.bytes, flow.rate, flow.share, flow.throttled)
+        )
+
+    def _share(self, flow):
+        rows = self._active_flows()
+        share = None
+        for direction in DIRECTIONS[flow.kind]:
+            capacity = self.capacity[direction]
+            if not capacity:
+                continue
+            flows = {
+                row['flow_id']: (row['weight'], max(MIN_RATE, row['rate'] * HEADROOM) if row['rate'] else None)
+                for row in rows if direction in DIRECTIONS.get(row['kind'], ())
+            }
+            # Flow baru (belum ada laju) boleh mengambil semua sisa sampai refresh berikutnya
+            flows.setdefault(flow.flow_id, (flow.weight, None))
+            allocated = allocate(capacity, flows)[flow.flow_id]
+            share = allocated if share is None else min(share, allocated)
+        return share
+
+    def _active_flows(self):
+        """Flow yang masih hidup. Flow dari proses mati atau yang lama tidak update dibuang"""
+        db = _db()
+        stale = time.time() - max(30, self.interval * 10)
+        rows = db.execute('SELECT * FROM bandwidth_flows').fetchall()
+        active = []
+        for row in rows:
+            if row['updated_at'] < stale or not owner_alive(row['owner']):
+                db.execute('DELETE FROM bandwidth_flows WHERE flow_id = ?', (row['flow_id'],))
+            else:
+                active.append(row)
+        return active
+
+    def refresh(self, flow):
+        """Simpan laju flow lalu hitung share barunya"""
+        self._save(flow)
+        share = self._share(flow)
+        _db().execute('UPDATE bandwidth_flows SET share = ? WHERE flow_id = ?', (share, flow.flow_id))
+        return share
+
+    def release(self, flow):
+        try:
+            _db().execute('DELETE FROM bandwidth_flows WHERE flow_id = ?', (flow.flow_id,))
+        except Exception as e:
+            logger.error(f"Failed to release bandwidth flow {flow.flow_id}: {str(e)}")
+
+    def stats(self):
+        flows = [dict(row) for row in self._active_flows()]
+        usage = {}
+        for direction, capacity in self.capacity.items():
+            used = sum(row['rate'] or 0 for row in flows if direction in DIRECTIONS.get(row['kind'], ()))
+            usage[direction] = {'capacity': capacity, 'rate': round(used)}
+        for row in flows:
+            row['rate'] = round(row['rate']) if row['rate'] is not None else None
+            row['share'] = round(row['share']) if row['share'] is not None else None
+            row['throttled'] = round(row['throttled'], 2)
+        return {'directions': usage, 'weights': self.weights, 'flows': sorted(flows, key=lambda row: row['started_at'])}
@@ -1,14 +1,114 @@
+import os
+import json
 import time
+import zlib
+import hashlib
+import logging
+from services.state import get_db
 
-_cache = {}
+logger = logging.getLogger(__name__)
 
-def get_cached_media_info(url):
-    if url in _cache and time.time() - _cache[url]['timestamp'] < 3600:
-        return _cache[url]['data']
-    return None
+# Cache metadata bersama (SQLite) untuk semua worker, bertahan setelah restart
+CACHE_TTL = int(os.environ.get('CACHE_TTL', 3600))
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 2000))
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', 256 * 1024 * 1024))
+# last_access cukup akurat sampai sekian detik untuk eviksi LRU, jadi hit tidak selalu menulis
+CACHE_ACCESS_RESOLUTION = float(os.environ.get('CACHE_ACCESS_RESOLUTION', 60))
 
-def cache_media_info(url, data):
-    _cache[url] = {
-        'data': data,
-        'timestamp': time.time()
-    }
\ No newline at end of file
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS media_cache (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_media_cache_access ON media_cache (last_access);
+CREATE INDEX IF NOT EXISTS idx_media_cache_expires ON media_cache (expires_at);
+'''
+
+
+def _db():
+    return get_db('media_cache', _SCHEMA)
+
+
+def _key(url, context):
+    return hashlib.sha256(f"{url}\n{context or ''}".encode('utf-8')).hexdigest()
+
+
+def cookie_context(user_cookies=None, session_data=None):
+    """Sidik jari konteks cookie, supaya hasil ekstrak dengan cookie pribadi tidak dibagi ke pengguna lain"""
+    if not user_cookies and not session_data:
+        return ''
+    account = (session_data or {}).get('username', '')
+    return hashlib.sha256(f"{user_cookies or ''}\n{account}".encode('utf-8')).hexdigest()[:16]
+
+
+def get_cached_media_info(url, context=''):
+    key = _key(url, context)
+    now = time.time()
+    try:
+        db = _db()
+        row = db.execute('SELECT data, expires_at, last_access FROM media_cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        if row['expires_at'] <= now:
+            db.execute('DELETE FROM media_cache WHERE key = ?', (key,))
+            return None
+        if now - row['last_access'] >= CACHE_ACCESS_RESOLUTION:
+            db.execute('UPDATE media_cache SET last_access = ? WHERE key = ?', (now, key))
+        return json.loads(zlib.decompress(row['data']))
+    except Exception as e:
+        logger.error(f"Cache read error: {str(e)}")
+        return None
+
+
+def get_cache_version(url, context=''):
+    """Versi entry cache (berubah setiap entry ditulis ulang) tanpa membaca datanya, dipakai untuk ETag"""
+    key = _key(url, context)
+    try:
+        row = _db().execute('SELECT created_at, expires_at FROM media_cache WHERE key = ?', (key,)).fetchone()
+    except Exception as e:
+        logger.error(f"Cache read error: {str(e)}")
+        return None
+    if row is None or row['expires_at'] <= time.time():
+        return None
+    return f"{key[:16]}-{int(row['created_at'] * 1000)}"
+
+
+def cache_media_info(url, data, context='', ttl=None):
+    now = time.time()
+    blob = zlib.compress(json.dumps(data).encode('utf-8'))
+    if len(blob) > CACHE_MAX_BYTES:
+        return
+    try:
+        db = _db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute(
+                'INSERT OR REPLACE INTO media_cache (key, url, data, size, created_at, expires_at, last_access) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (_key(url, context), url, blob, len(blob), now, now + (ttl or CACHE_TTL), now)
+            )
+            _evict(db, now)
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+    except Exception as e:
+        logger.error(f"Cache write error: {str(e)}")
+
+
+def _evict(db, now):
+    db.execute('DELETE FROM media_cache WHERE expires_at <= ?', (now,))
+    count, total = db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM media_cache').fetchone()
+    if count <= CACHE_MAX_ENTRIES and total <= CACHE_MAX_BYTES:
+        return
+    # LRU: buang entry yang paling lama tidak diakses sampai di bawah batas
+    for key, size in db.execute('SELECT key, size FROM media_cache ORDER BY last_access ASC').fetchall():
+        if count <= CACHE_MAX_ENTRIES and total <= CACHE_MAX_BYTES:
+            break
+        db.execute('DELETE FROM media_cache WHERE key = ?', (key,))
+        count -= 1
+        total -= size
@@ -1,5 +1,6 @@
 import os
 import shutil
+import functools
 import time
 import logging
 import re
@@ -38,6 +39,8 @@ def cleanup_expired_downloads():
     current_time = time.time()
     for download_id in os.listdir(TEMP_DIR):
         download_path = os.path.join(TEMP_DIR, download_id)
+        if download_id.startswith('.'):
+            continue
         if os.path.isdir(download_path):
             if current_time - os.path.getmtime(download_path) > DOWNLOAD_EXPIRY:
                 try:
@@ -62,5 +65,7 @@ def convert_to_txt(subtitle_file, output_file):
         logger.error(f"Error converting subtitle to txt: {str(e)}")
         return False
 
+@functools.lru_cache(maxsize=None)
 def is_ffmpeg_installed():
-    return shutil.which('ffmpeg') is not None
\ No newline at end of file
+    """Probe ffmpeg sekali per proses (dengan preload, sekali di master gunicorn)"""
+    return shutil.which('ffmpeg') is not None
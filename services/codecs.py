@@ -0,0 +1,153 @@
+import os
+
+# Format audio yang bisa diminta client. 'best' = stream asli tanpa encode ulang,
+# 'm4a'/'opus' = salin kalau codec sumber cocok, 'mp3' = encode ulang (kecuali sumbernya mp3)
+AUDIO_FORMATS = ('best', 'm4a', 'opus', 'mp3')
+DEFAULT_AUDIO_FORMAT = os.environ.get('DEFAULT_AUDIO_FORMAT', 'best')
+MP3_QUALITY = '192'
+
+# Selector yang mendahulukan format dengan codec target, supaya cukup stream copy
+AUDIO_SELECTORS = {
+    'best': 'bestaudio/best',
+    'm4a': 'bestaudio[acodec^=mp4a]/bestaudio[ext=m4a]/bestaudio/best',
+    'opus': 'bestaudio[acodec=opus]/bestaudio/best',
+    'mp3': 'bestaudio[acodec=mp3]/bestaudio/best',
+}
+
+# Ekstensi yang dibiarkan apa adanya oleh FFmpegExtractAudio dengan preferredcodec 'best'
+COMMON_AUDIO_EXTS = ('m4a', 'mp3', 'opus', 'webm', 'weba', 'ogg', 'oga', 'aac', 'flac', 'wav', 'mka', 'wma')
+# Codec yang bisa disalin FFmpegExtractAudio ke container audionya sendiri
+COPYABLE_AUDIO_CODECS = ('aac', 'mp3', 'opus', 'vorbis', 'flac', 'alac', 'wav')
+
+# Pipeline /api/stream: container untuk codec yang disalin, dan encoder kalau harus encode ulang
+STREAM_AUDIO_CONTAINERS = {
+    'aac': ('m4a', ['-movflags', 'frag_keyframe+empty_moov+default_base_moof', '-f', 'mp4']),
+    'opus': ('opus', ['-f', 'opus']),
+    'vorbis': ('ogg', ['-f', 'ogg']),
+    'mp3': ('mp3', ['-f', 'mp3']),
+}
+STREAM_AUDIO_ENCODERS = {
+    'aac': ['-c:a', 'aac', '-b:a', '192k'],
+    'opus': ['-c:a', 'libopus', '-b:a', '160k'],
+    'mp3': ['-c:a', 'libmp3lame', '-b:a', f'{MP3_QUALITY}k'],
+}
+# Matroska menerima hampir semua codec audio, dipakai untuk stream copy codec yang tidak dikenal
+STREAM_FALLBACK_CONTAINER = ('mka', ['-f', 'matroska'])
+_TARGET_CODECS = {'m4a': 'aac', 'opus': 'opus', 'mp3': 'mp3'}
+# Tebakan codec dari ekstensi kalau extractor tidak melaporkan acodec
+_EXT_AUDIO_CODECS = {'m4a': 'aac', 'aac': 'aac', 'mp3': 'mp3', 'opus': 'opus', 'ogg': 'vorbis', 'oga': 'vorbis', 'flac': 'flac', 'wav': 'wav'}
+
+
+def normalize_audio_format(value):
+    """Return format audio yang valid, atau None kalau tidak dikenal"""
+    value = (value or DEFAULT_AUDIO_FORMAT).lower()
+    return value if value in AUDIO_FORMATS else None
+
+
+def audio_codec(acodec):
+    """Nama codec pendek dari field acodec yt-dlp ('mp4a.40.2' -> 'aac')"""
+    if not acodec or acodec == 'none':
+        return None
+    acodec = acodec.lower()
+    # mp4a.6b/mp4a.69 adalah MPEG audio (mp3) di dalam mp4
+    if acodec in ('mp3', 'mp4a.6b', 'mp4a.69'):
+        return 'mp3'
+    acodec = acodec.split('.')[0]
+    return 'aac' if acodec in ('mp4a', 'aac') else acodec
+
+
+def _source_audio_codec(fmt):
+    return audio_codec(fmt.get('acodec')) or _EXT_AUDIO_CODECS.get(fmt.get('ext'))
+
+
+def audio_postprocessor(audio_format):
+    """FFmpegExtractAudio untuk format ini. yt-dlp sendiri yang menyalin stream kalau codec-nya cocok"""
+    postprocessor = {'key': 'FFmpegExtractAudio', 'preferredcodec': audio_format}
+    if audio_format == 'mp3':
+        postprocessor['preferredquality'] = MP3_QUALITY
+    return postprocessor
+
+
+def audio_mode(fmt, audio_format):
+    """'copy' kalau format sumber ini cukup disalin (atau dibiarkan) untuk audio_format, 'encode' kalau harus encode ulang"""
+    codec = _source_audio_codec(fmt)
+    if audio_format == 'best':
+        return 'copy' if fmt.get('ext') in COMMON_AUDIO_EXTS or codec in COPYABLE_AUDIO_CODECS else 'encode'
+    return 'copy' if codec == _TARGET_CODECS[audio_format] else 'encode'
+
+
+def stream_audio_plan(fmt, audio_format):
+    """Rencana ffmpeg untuk stream audio: (argumen output, ekstensi, mode).
+
+    Argumen None berarti format sumber bisa dikirim langsung tanpa ffmpeg.
+    """
+    codec = _source_audio_codec(fmt)
+    if audio_format == 'best':
+        if fmt.get('vcodec') in (None, 'none') and fmt.get('ext') in COMMON_AUDIO_EXTS:
+            return None, fmt['ext'], 'copy'
+        if codec not in STREAM_AUDIO_CONTAINERS:
+            # 'best' tidak pernah encode ulang: codec tanpa container sendiri (atau tidak dikenal) disalin ke matroska
+            extension, container = STREAM_FALLBACK_CONTAINER
+            return ['-vn', '-c:a', 'copy'] + container, extension, 'copy'
+        target = codec
+    else:
+        target = _TARGET_CODECS[audio_format]
+    extension, container = STREAM_AUDIO_CONTAINERS[target]
+    if codec == target:
+        return ['-vn', '-c:a', 'copy'] + container, extension, 'copy'
+    return ['-vn'] + STREAM_AUDIO_ENCODERS[target] + container, extension, 'encode'
+
+
+# Codec yang bisa disalin (remux) ke container mp4 tanpa transcode
+MP4_VIDEO_CODECS = ('h264', 'hevc', 'av1')
+MP4_AUDIO_CODECS = ('aac', 'mp3', 'opus')
+# Kalau codec tidak dilaporkan extractor, ekstensi ini dianggap sudah h264/aac
+MP4_EXTS = ('mp4', 'm4a', 'm4v', 'mov')
+
+
+def video_codec(vcodec):
+    """Nama codec pendek dari field vcodec yt-dlp ('avc1.64001F' -> 'h264')"""
+    if not vcodec or vcodec == 'none':
+        return None
+    vcodec = vcodec.lower().split('.')[0]
+    if vcodec in ('avc1', 'avc3', 'avc', 'h264'):
+        return 'h264'
+    if vcodec in ('hvc1', 'hev1', 'hevc', 'h265'):
+        return 'hevc'
+    if vcodec in ('av01', 'av1'):
+        return 'av1'
+    if vcodec in ('vp09', 'vp9'):
+        return 'vp9'
+    return vcodec
+
+
+def _mp4_compatible(fmt):
+    """'none' berarti track itu tidak ada, codec yang tidak dilaporkan dinilai dari ekstensinya"""
+    ext_compatible = fmt.get('ext') in MP4_EXTS
+    vcodec, acodec = fmt.get('vcodec'), fmt.get('acodec')
+    if not vcodec:
+        if not ext_compatible:
+            return False
+    elif vcodec != 'none' and video_codec(vcodec) not in MP4_VIDEO_CODECS:
+        return False
+    if not acodec:
+        if not ext_compatible:
+            return False
+    elif acodec != 'none' and audio_codec(acodec) not in MP4_AUDIO_CODECS:
+        return False
+    return True
+
+
+def video_postprocess_plan(formats):
+    """'remux' kalau semua track bisa disalin ke mp4, 'convert' kalau ada yang harus di-transcode.
+
+    Format yang tidak diketahui (formats kosong) dianggap harus di-transcode.
+    """
+    if formats and all(_mp4_compatible(fmt) for fmt in formats):
+        return 'remux'
+    return 'convert'
+
+
+def video_postprocessor(plan):
+    key = 'FFmpegVideoRemuxer' if plan == 'remux' else 'FFmpegVideoConvertor'
+    return {'key': key, 'preferedformat': 'mp4'}
@@ -0,0 +1,34 @@
+import os
+import gzip
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 5))
+
+
+def supported_encodings():
+    return ['br', 'gzip'] if brotli else ['gzip']
+
+
+def compress_body(body, accept_encodings):
+    """Kompres body sesuai Accept-Encoding client (br diutamakan kalau modul brotli ada).
+
+    accept_encodings adalah request.accept_encodings dari Werkzeug.
+    Return (body, encoding), encoding None kalau tidak dikompres.
+    """
+    if len(body) < COMPRESS_MIN_BYTES:
+        return body, None
+    encoding = accept_encodings.best_match(supported_encodings())
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY), 'br'
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=GZIP_LEVEL), 'gzip'
+    return body, None
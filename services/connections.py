@@ -0,0 +1,139 @@
+import os
+import time
+import logging
+from contextlib import contextmanager
+from services.state import get_db, process_owner, owner_alive
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+FRAGMENT_CONNECTION_BUDGET = int(os.environ.get('FRAGMENT_CONNECTION_BUDGET', 32))  # koneksi fragment per node
+FRAGMENT_MAX_WIDTH = int(os.environ.get('FRAGMENT_MAX_WIDTH', 16))                  # lebar maksimum satu job
+FRAGMENT_LEASE_TTL = int(os.environ.get('FRAGMENT_LEASE_TTL', 6 * 3600))            # lease yang lebih tua dianggap bocor
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS connection_leases (
+    job_id TEXT PRIMARY KEY,
+    width INTEGER NOT NULL,
+    owner TEXT NOT NULL,
+    acquired_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+'''
+
+
+def _db():
+    return get_db('connections', _SCHEMA)
+
+
+class FragmentLease:
+    """Lebar (jumlah koneksi fragment) yang sedang dipegang satu job.
+
+    Lebar 0 berarti belum memegang apa-apa: lease baru diambil lewat acquire()
+    saat downloader fragment benar-benar mulai, download HTTP biasa tidak ikut makan budget.
+    """
+
+    def __init__(self, budget, job_id):
+        self.budget = budget
+        self.job_id = job_id
+        self.width = 0
+
+    def acquire(self):
+        """Ambil (atau hitung ulang) lebar dari kondisi node sekarang"""
+        previous = self.width
+        try:
+            self.width = self.budget.acquire(self.job_id)
+        except Exception as e:
+            logger.warning(f"Failed to acquire fragment lease for {self.job_id}: {str(e)}")
+        metrics.FRAGMENT_CONNECTIONS.inc(self.width - previous)
+        return self.width or 1
+
+    def rebalance(self):
+        """Hitung ulang lebar di antara file/format, hanya kalau lease sedang dipegang"""
+        return self.acquire() if self.width else None
+
+
+class ConnectionBudget:
+    """Budget koneksi fragment HLS/DASH untuk seluruh node, dibagi lewat SQLite.
+
+    Tiap job memegang lease selebar min(max_width, budget / jumlah job,
+    sisa budget), minimal 1. Jumlah job diambil dari lease yang ada atau
+    dari `demand()` (misalnya job yang sedang antri + jalan), mana yang
+    lebih besar, jadi job yang sendirian dapat lebar penuh dan job yang
+    datang saat node ramai dapat lebih sempit. Lebar job yang sudah jalan
+    dihitung ulang lewat FragmentLease.rebalance() setiap pindah format,
+    jadi lebarnya ikut menyempit (atau melebar lagi) sesuai isi node.
+    """
+
+    def __init__(self, budget=FRAGMENT_CONNECTION_BUDGET, max_width=FRAGMENT_MAX_WIDTH, ttl=FRAGMENT_LEASE_TTL, demand=None):
+        self.budget = max(1, budget)
+        self.max_width = max(1, max_width)
+        self.ttl = ttl
+        self.demand = demand
+
+    def _demand(self):
+        if not self.demand:
+            return 1
+        try:
+            return max(1, self.demand())
+        except Exception as e:
+            logger.warning(f"Failed to read download demand: {str(e)}")
+            return 1
+
+    def _reap(self, db, now):
+        """Buang lease milik proses yang sudah mati atau yang terlalu lama"""
+        db.execute('DELETE FROM connection_leases WHERE acquired_at < ?', (now - self.ttl,))
+        for row in db.execute('SELECT job_id, owner FROM connection_leases').fetchall():
+            if not owner_alive(row['owner']):
+                db.execute('DELETE FROM connection_leases WHERE job_id = ?', (row['job_id'],))
+                logger.info(f"Reclaimed fragment lease of dead worker: {row['job_id']}")
+
+    def acquire(self, job_id):
+        """Ambil atau perbarui lease job ini, return lebarnya"""
+        now = time.time()
+        demand = self._demand()
+        db = _db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            self._reap(db, now)
+            others = db.execute('SELECT width FROM connection_leases WHERE job_id != ?', (job_id,)).fetchall()
+            used = sum(row['width'] for row in others)
+            fair = self.budget // max(len(others) + 1, demand)
+            width = max(1, min(self.max_width, fair, self.budget - used))
+            db.execute(
+                'INSERT INTO connection_leases (job_id, width, owner, acquired_at, updated_at) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT(job_id) DO UPDATE SET width = excluded.width, updated_at = excluded.updated_at',
+                (job_id, width, process_owner(), now, now)
+            )
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        return width
+
+    def release(self, job_id):
+        try:
+            _db().execute('DELETE FROM connection_leases WHERE job_id = ?', (job_id,))
+        except Exception as e:
+            logger.error(f"Failed to release fragment lease for {job_id}: {str(e)}")
+
+    @contextmanager
+    def lease(self, job_id):
+        lease = FragmentLease(self, job_id)
+        try:
+            yield lease
+        finally:
+            if lease.width:
+                self.release(job_id)
+                metrics.FRAGMENT_CONNECTIONS.dec(lease.width)
+
+    def stats(self):
+        rows = _db().execute('SELECT job_id, width, owner, acquired_at FROM connection_leases ORDER BY acquired_at').fetchall()
+        leases = [dict(row) for row in rows]
+        return {
+            'budget': self.budget,
+            'max_width': self.max_width,
+            'demand': self._demand(),
+            'in_use': sum(lease['width'] for lease in leases),
+            'leases': leases,
+        }
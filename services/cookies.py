@@ -0,0 +1,181 @@
+import os
+import re
+import hmac
+import time
+import hashlib
+import logging
+import threading
+from http.cookiejar import MozillaCookieJar, LoadError
+from services.state import STATE_DIR, get_db
+
+logger = logging.getLogger(__name__)
+
+SESSION_COOKIE_TTL = int(os.environ.get('SESSION_COOKIE_TTL', 6 * 3600))
+
+SECRET_FILE = os.path.join(STATE_DIR, 'session_secret')
+
+# Pesan error yt-dlp/HTTP yang berarti cookie sesi tidak (lagi) diterima. 403, video private
+# atau konten premium bukan berarti sesinya mati (geo block, anti-bot, akun tanpa akses), jadi tidak ikut
+AUTH_ERROR_PATTERN = re.compile(
+    r'sign in|log ?in required|(?:please|need to|must) log ?in|not logged in|requires? (?:authentication|login)|'
+    r'registered users|unauthori[sz]ed|HTTP Error 401|cookies are no longer valid|session (?:has )?expired',
+    re.IGNORECASE
+)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS session_jars (
+    key TEXT PRIMARY KEY,
+    platform TEXT,
+    cookies TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_session_jars_expires ON session_jars (expires_at);
+'''
+
+
+def _db():
+    return get_db('cookies', _SCHEMA)
+
+
+def is_auth_error(message):
+    return bool(message and AUTH_ERROR_PATTERN.search(message))
+
+
+def _load_secret():
+    """Secret HMAC per instalasi, dibuat sekali secara atomik dan dibagi semua worker"""
+    try:
+        with open(SECRET_FILE, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+    os.makedirs(STATE_DIR, exist_ok=True)
+    tmp_path = f"{SECRET_FILE}.tmp{os.getpid()}"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(os.urandom(32))
+    try:
+        os.link(tmp_path, SECRET_FILE)
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(tmp_path)
+    with open(SECRET_FILE, 'rb') as f:
+        return f.read()
+
+
+class SessionJarCache:
+    """Cookie hasil login per (platform, akun), dibagi semua worker lewat SQLite.
+
+    Key adalah HMAC dari platform, username dan password dengan secret per
+    instalasi, jadi password tidak pernah disimpan dan password yang salah
+    tidak bisa memakai jar milik login yang benar.
+    """
+
+    def __init__(self, ttl=SESSION_COOKIE_TTL):
+        self.ttl = ttl
+        self._secret = None
+
+    def key(self, platform, session_data):
+        if self._secret is None:
+            self._secret = _load_secret()
+        material = '\n'.join([platform or 'unknown', session_data.get('username') or '', session_data.get('password') or ''])
+        return hmac.new(self._secret, material.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def get(self, platform, session_data):
+        try:
+            return self.get_by_key(self.key(platform, session_data))
+        except Exception as e:
+            logger.error(f"Session jar cache read error: {str(e)}")
+            return None
+
+    def get_by_key(self, key):
+        """Cookie untuk key HMAC yang sudah dihitung (misalnya dari journal job), tanpa perlu password"""
+        try:
+            row = _db().execute('SELECT cookies, expires_at FROM session_jars WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if row['expires_at'] <= time.time():
+                _db().execute('DELETE FROM session_jars WHERE key = ?', (key,))
+                return None
+            return row['cookies']
+        except Exception as e:
+            logger.error(f"Session jar cache read error: {str(e)}")
+            return None
+
+    def put(self, platform, session_data, cookies):
+        now = time.time()
+        try:
+            db = _db()
+            db.execute(
+                'INSERT OR REPLACE INTO session_jars (key, platform, cookies, created_at, expires_at) VALUES (?, ?, ?, ?, ?)',
+                (self.key(platform, session_data), platform, cookies, now, now + self.ttl)
+            )
+            db.execute('DELETE FROM session_jars WHERE expires_at <= ?', (now,))
+        except Exception as e:
+            logger.error(f"Session jar cache write error: {str(e)}")
+
+    def invalidate(self, platform, session_data):
+        try:
+            _db().execute('DELETE FROM session_jars WHERE key = ?', (self.key(platform, session_data),))
+            logger.info(f"Invalidated cached session cookies for {platform}")
+        except Exception as e:
+            logger.error(f"Session jar cache delete error: {str(e)}")
+
+
+class CookieFile:
+    """cookies.txt (format Netscape) yang di-parse sekali dan dimuat ulang hanya kalau mtime/ukurannya berubah"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._jar = None
+
+    def _current_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _reload(self, stamp):
+        self._stamp = stamp
+        self._jar = None
+        if stamp is None or stamp[1] == 0:
+            return
+        with open(self.path, 'r') as f:
+            cookie_content = f.read().strip()
+        if not cookie_content.startswith('#') or '\t' not in cookie_content:
+            logger.warning("Invalid cookies.txt format - must be Netscape format with tabs, skipping")
+            return
+        jar = MozillaCookieJar()
+        try:
+            jar.load(self.path, ignore_discard=True, ignore_expires=True)
+        except (LoadError, OSError) as e:
+            logger.warning(f"Failed to parse cookies.txt, skipping: {str(e)}")
+            return
+        self._jar = jar
+        logger.info(f"Loaded cookies.txt with {len(jar)} cookies")
+
+    @property
+    def stamp(self):
+        """(mtime_ns, size) terakhir yang dimuat, berubah setiap cookies.txt diganti"""
+        return self._stamp
+
+    def jar(self):
+        """MozillaCookieJar hasil parse cookies.txt, None kalau file tidak ada atau formatnya salah.
+
+        Cuma stat() kalau file tidak berubah. Jar ini dibagi, jangan diubah:
+        salin cookie-nya ke jar milik YoutubeDL.
+        """
+        stamp = self._current_stamp()
+        if stamp != self._stamp:
+            with self._lock:
+                if stamp != self._stamp:
+                    self._reload(stamp)
+        return self._jar
+
+    def valid(self):
+        """True kalau cookies.txt ada dan formatnya benar"""
+        return self.jar() is not None
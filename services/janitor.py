@@ -0,0 +1,168 @@
+import os
+import time
+import heapq
+import fcntl
+import shutil
+import logging
+import threading
+from services.state import STATE_DIR
+from services.journal import remove_journal
+from services.jobs import (
+    get_job, delete_job, get_counter, jobs_created_since, least_recently_served_jobs, TERMINAL_STATES
+)
+
+logger = logging.getLogger(__name__)
+
+LOCK_FILE = os.path.join(STATE_DIR, 'janitor.lock')
+
+
+class Janitor:
+    """Pembersih download kadaluarsa di background.
+
+    Hanya satu worker per host yang jadi leader (flock non-blocking di
+    STATE_DIR/janitor.lock), worker lain mencoba ulang tiap interval.
+    Leader menyimpan min-heap (expires_at, id) yang diisi bertahap dari
+    registry, jadi tiap tick hanya menyentuh job yang sudah jatuh tempo,
+    bukan seluruh isi TEMP_DIR. Kalau quota > 0 dan total byte di disk
+    melewatinya, job final yang paling lama tidak dikirim dievict duluan.
+    Leader juga memanggil `recover` tiap tick untuk melanjutkan job yang
+    ditinggal worker mati.
+    """
+
+    def __init__(self, temp_dir, store, expiry, quota=0, interval=30, recover=None):
+        self.temp_dir = temp_dir
+        self.store = store
+        self.expiry = expiry
+        self.quota = quota
+        self.interval = max(1, interval)
+        self.recover = recover
+        self._lock = threading.Lock()
+        self._pid = None
+        self._lock_fd = None
+        self._heap = []
+        self._last_rowid = 0
+        self._ticks = 0
+
+    def ensure_started(self):
+        """Jalankan thread janitor sekali per proses (aman setelah fork gunicorn)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._lock_fd = None
+            self._heap = []
+            self._last_rowid = 0
+            threading.Thread(target=self._run, name='janitor', daemon=True).start()
+
+    def _try_lead(self):
+        if self._lock_fd is not None:
+            return True
+        os.makedirs(STATE_DIR, exist_ok=True)
+        fd = os.open(LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        logger.info(f"Janitor leader elected (pid {os.getpid()})")
+        self.sweep_orphans()
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                if self._try_lead():
+                    self.tick()
+            except Exception as e:
+                logger.error(f"Janitor error: {str(e)}")
+            time.sleep(self.interval)
+
+    def _refresh(self):
+        """Tambahkan job baru (rowid di atas watermark) ke heap"""
+        for rowid, download_id, created_at, expires_at in jobs_created_since(self._last_rowid):
+            heapq.heappush(self._heap, (expires_at or created_at + self.expiry, download_id))
+            self._last_rowid = max(self._last_rowid, rowid)
+
+    def _remove(self, download_id):
+        shutil.rmtree(os.path.join(self.temp_dir, download_id), ignore_errors=True)
+        delete_job(download_id)
+        remove_journal(download_id)
+
+    def expire_due(self, now=None):
+        now = now or time.time()
+        removed = 0
+        while self._heap and self._heap[0][0] <= now:
+            _, download_id = heapq.heappop(self._heap)
+            job = get_job(download_id)
+            if job is None:
+                continue
+            # Job yang masih jalan dibiarkan, kecuali sudah macet lebih dari masa berlaku
+            if job['state'] not in TERMINAL_STATES and now - job['updated_at'] < self.expiry:
+                heapq.heappush(self._heap, (job['updated_at'] + self.expiry, download_id))
+                continue
+            self._remove(download_id)
+            removed += 1
+            logger.info(f"Cleaned up expired download: {download_id}")
+        return removed
+
+    def disk_usage(self):
+        """Byte di TEMP_DIR: store sekali, ditambah file job yang tidak di-hardlink ke store"""
+        return get_counter('job_own_bytes') + get_counter('store_bytes')
+
+    def enforce_quota(self):
+        """Evict job final LRU sampai total byte di bawah quota"""
+        if self.quota <= 0 or self.disk_usage() <= self.quota:
+            return 0
+        evicted = 0
+        while self.disk_usage() > self.quota:
+            candidates = least_recently_served_jobs()
+            if not candidates:
+                break
+            for job in candidates:
+                self._remove(job['id'])
+                evicted += 1
+                logger.info(f"Evicted download over disk quota: {job['id']}")
+                if self.disk_usage() <= self.quota:
+                    break
+            # Entry store yang sudah tidak dipakai job mana pun ikut dibuang
+            self.store.prune(0)
+        return evicted
+
+    def sweep_orphans(self):
+        """Direktori lama yang tidak tercatat di registry (sekali saat jadi leader)"""
+        now = time.time()
+        for download_id in os.listdir(self.temp_dir):
+            download_path = os.path.join(self.temp_dir, download_id)
+            if download_id.startswith('.') or not os.path.isdir(download_path):
+                continue
+            if now - os.path.getmtime(download_path) > self.expiry and get_job(download_id) is None:
+                shutil.rmtree(download_path, ignore_errors=True)
+                logger.info(f"Cleaned up orphaned download directory: {download_id}")
+
+    def tick(self):
+        if self.recover:
+            try:
+                self.recover()
+            except Exception as e:
+                logger.error(f"Job recovery error: {str(e)}")
+        with self._lock:
+            self._refresh()
+            removed = self.expire_due()
+            evicted = self.enforce_quota()
+            self._ticks += 1
+            if self._ticks % 10 == 0:
+                self.store.prune(self.expiry)
+        return {'expired': removed, 'evicted': evicted}
+
+    def run_once(self):
+        """Satu putaran penuh dari request (misalnya /api/cleanup), tanpa perlu jadi leader"""
+        with self._lock:
+            self._refresh()
+            removed = self.expire_due()
+            evicted = self.enforce_quota()
+            self.sweep_orphans()
+            self.store.prune(self.expiry)
+        return {'expired': removed, 'evicted': evicted}
@@ -0,0 +1,701 @@
+import os
+import re
+import json
+import time
+import heapq
+import queue
+import logging
+import threading
+from services.state import get_db, process_owner, owner_alive
+
+logger = logging.getLogger(__name__)
+
+# State job yang sudah final
+TERMINAL_STATES = ('completed', 'error')
+
+# Dibangunkan setiap ada perubahan job di proses ini (untuk long-poll & SSE)
+_job_changed = threading.Condition()
+
+# Nama postprocessor yt-dlp -> tahap job
+_PP_STAGES = {
+    'Merger': 'merge',
+    'ExtractAudio': 'convert',
+    'VideoConvertor': 'convert',
+    'VideoRemuxer': 'remux',
+}
+
+# Pesan retry/skip fragment dari downloader yt-dlp (lewat opsi 'logger')
+_FRAGMENT_RETRY = re.compile(r'Retrying fragment (\d+) \((\d+)/(\d+|inf)\)')
+_FRAGMENT_SKIP = re.compile(r'Skipping fragment (\d+)')
+FRAGMENT_HISTORY = 50
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    error TEXT,
+    warning TEXT,
+    owner TEXT,
+    url TEXT,
+    platform TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    files TEXT,
+    total_bytes INTEGER NOT NULL DEFAULT 0,
+    own_bytes INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    progress TEXT,
+    expires_at REAL,
+    last_served_at REAL
+);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+'''
+
+_INDEXES = '''
+CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, updated_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs (created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_expires ON jobs (expires_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_lru ON jobs (COALESCE(last_served_at, finished_at, created_at));
+'''
+
+_JSON_COLUMNS = ('files', 'result', 'progress')
+# Kolom ukuran -> counter agregatnya. own_bytes = byte file job yang tidak di-hardlink ke store,
+# jadi job_own_bytes + store_bytes adalah pemakaian disk sebenarnya (tanpa hitung ganda)
+_BYTE_COUNTERS = {'total_bytes': 'job_bytes', 'own_bytes': 'job_own_bytes'}
+
+
+class WorkerPool:
+    """Pool thread terbatas dengan antrian terbatas untuk job di background.
+
+    Thread dibuat saat submit pertama di proses ini, supaya aman dipakai
+    setelah fork oleh gunicorn.
+    """
+
+    def __init__(self, name, workers, max_queued):
+        self.name = name
+        self.workers = max(1, workers)
+        self.max_queued = max(1, max_queued)
+        self._lock = threading.Lock()
+        self._queue = None
+        self._threads = []
+        self._pid = None
+        self._active = 0
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        self._queue = queue.Queue(maxsize=self.max_queued)
+        self._threads = []
+        self._active = 0
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        self._pid = os.getpid()
+        logger.info(f"Worker pool '{self.name}' started with {self.workers} workers")
+
+    def _run(self):
+        while True:
+            fn, args, kwargs = self._queue.get()
+            with self._lock:
+                self._active += 1
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                logger.error(f"Unhandled error in {self.name} job: {str(e)}")
+            finally:
+                with self._lock:
+                    self._active -= 1
+                self._queue.task_done()
+
+    def submit(self, fn, *args, **kwargs):
+        """Masukkan job ke antrian. Return False kalau antrian penuh."""
+        with self._lock:
+            self._ensure_started()
+        try:
+            self._queue.put_nowait((fn, args, kwargs))
+            return True
+        except queue.Full:
+            return False
+
+    def stats(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                return {'workers': self.workers, 'active': 0, 'queued': 0}
+            return {'workers': self.workers, 'active': self._active, 'queued': self._queue.qsize()}
+
+
+class PriorityWorkerPool(WorkerPool):
+    """WorkerPool dengan antrian prioritas per lane: job dengan perkiraan durasi terpendek jalan duluan.
+
+    Key heap = perkiraan durasi + aging x waktu masuk antrian. Aging sama
+    untuk semua job, jadi urutan heap tidak berubah seiring waktu dan job
+    panjang pasti maju setelah menunggu cukup lama (tidak kelaparan).
+    `lanes` = {lane: jumlah worker yang mendahulukan lane itu}, supaya
+    misalnya job audio tidak antri di belakang video. Worker sisanya (dan
+    worker lane yang lane-nya kosong) mengambil job dengan key terkecil
+    dari semua lane. `on_drop(fn, args, kwargs)` dipanggil untuk tiap job
+    yang dibuang dari antrian saat shutdown, supaya resource yang ikut
+    diserahkan ke job itu bisa dilepas.
+
+    Kalau `slot` (semaphore) diberikan, worker mengambil slot dulu baru
+    memilih job, jadi job yang masuk selama menunggu slot tetap bersaing
+    sesuai prioritasnya. Job yang terpilih memegang slot itu dan wajib
+    melepasnya sendiri. `on_slot(waited)` dipanggil setelah slot didapat.
+    """
+
+    def __init__(self, name, workers, max_queued, lanes=None, aging=1.0, on_dequeue=None, on_drop=None, slot=None, on_slot=None):
+        super().__init__(name, workers, max_queued)
+        self.lanes = dict(lanes or {})
+        self.aging = aging
+        self.on_dequeue = on_dequeue
+        self.on_drop = on_drop
+        self.slot = slot
+        self.on_slot = on_slot
+        self._ready = threading.Condition(self._lock)
+        self._heaps = {}
+        self._queued = 0
+        self._seq = 0
+        self._closed = False
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        self._heaps = {}
+        self._queued = 0
+        self._active = 0
+        self._closed = False
+        self._threads = []
+        preferred = [lane for lane, count in self.lanes.items() for _ in range(count)]
+        for i in range(self.workers):
+            lane = preferred[i] if i < len(preferred) else None
+            t = threading.Thread(target=self._run, args=(lane,), name=f"{self.name}-{lane or 'any'}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        self._pid = os.getpid()
+        logger.info(f"Priority pool '{self.name}' started with {self.workers} workers, lanes {self.lanes}")
+
+    def _wait_queued(self):
+        """Tunggu sampai ada job di antrian (dipanggil dengan lock dipegang)"""
+        while not self._queued or self._closed:
+            self._ready.wait()
+
+    def _next(self, preferred):
+        """Ambil job berikutnya (dipanggil dengan lock dipegang)"""
+        self._wait_queued()
+        if self._heaps.get(preferred):
+            lane = preferred
+        else:
+            lane = min((lane for lane, heap in self._heaps.items() if heap), key=lambda lane: self._heaps[lane][0])
+        self._queued -= 1
+        # Bangunkan put_prioritized yang menunggu tempat di antrian
+        self._ready.notify_all()
+        return lane, heapq.heappop(self._heaps[lane])
+
+    def _run(self, preferred=None):
+        while True:
+            if self.slot:
+                with self._lock:
+                    self._wait_queued()
+                waiting = time.monotonic()
+                self.slot.acquire()
+                with self._lock:
+                    if not self._queued or self._closed:
+                        # Job sudah diambil worker lain selama menunggu slot
+                        self.slot.release()
+                        continue
+                    lane, (_, _, enqueued, fn, args, kwargs) = self._next(preferred)
+                    self._active += 1
+                if self.on_slot:
+                    self.on_slot(time.monotonic() - waiting)
+            else:
+                with self._lock:
+                    lane, (_, _, enqueued, fn, args, kwargs) = self._next(preferred)
+                    self._active += 1
+            if self.on_dequeue:
+                self.on_dequeue(lane, time.monotonic() - enqueued)
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                logger.error(f"Unhandled error in {self.name} job: {str(e)}")
+            finally:
+                with self._lock:
+                    self._active -= 1
+                    self._ready.notify_all()
+
+    def submit_prioritized(self, lane, expected_seconds, fn, *args, **kwargs):
+        """Masukkan job ke lane dengan perkiraan durasi (detik). Return False kalau antrian penuh."""
+        with self._lock:
+            self._ensure_started()
+            if self._closed or self._queued >= self.max_queued:
+                return False
+            now = time.monotonic()
+            self._seq += 1
+            key = expected_seconds + self.aging * now
+            heapq.heappush(self._heaps.setdefault(lane, []), (key, self._seq, now, fn, args, kwargs))
+            self._queued += 1
+            self._ready.notify_all()
+        return True
+
+    def put_prioritized(self, lane, expected_seconds, fn, *args, **kwargs):
+        """Seperti submit_prioritized, tapi menunggu kalau antrian penuh (backpressure).
+
+        Return False hanya kalau pool sudah berhenti.
+        """
+        with self._lock:
+            self._ensure_started()
+            while not self._closed and self._queued >= self.max_queued:
+                self._ready.wait()
+            if self._closed:
+                return False
+            now = time.monotonic()
+            self._seq += 1
+            key = expected_seconds + self.aging * now
+            heapq.heappush(self._heaps.setdefault(lane, []), (key, self._seq, now, fn, args, kwargs))
+            self._queued += 1
+            self._ready.notify_all()
+        return True
+
+    def submit(self, fn, *args, **kwargs):
+        return self.submit_prioritized('default', 0, fn, *args, **kwargs)
+
+    def is_queued(self, match):
+        """True kalau ada job di antrian dengan match(fn, args, kwargs)"""
+        with self._lock:
+            return any(match(fn, args, kwargs) for heap in self._heaps.values() for *_, fn, args, kwargs in heap)
+
+    def reprioritize(self, match, expected_seconds):
+        """Ganti perkiraan durasi job yang masih antri. Waktu masuk antrian (aging) tidak berubah.
+
+        Return True kalau job-nya ketemu (belum diambil worker).
+        """
+        with self._lock:
+            for heap in self._heaps.values():
+                for i, (_, seq, enqueued, fn, args, kwargs) in enumerate(heap):
+                    if match(fn, args, kwargs):
+                        heap[i] = (expected_seconds + self.aging * enqueued, seq, enqueued, fn, args, kwargs)
+                        heapq.heapify(heap)
+                        return True
+        return False
+
+    def shutdown(self, timeout):
+        """Berhenti menerima dan mengambil job, buang antrian, tunggu job yang jalan sampai timeout.
+
+        Return jumlah job yang masih jalan saat timeout habis.
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            if self._pid != os.getpid():
+                return 0
+            self._closed = True
+            dropped = [item for heap in self._heaps.values() for item in heap]
+            self._heaps = {}
+            self._queued = 0
+            self._ready.notify_all()
+        if dropped:
+            logger.info(f"Pool '{self.name}' dropped {len(dropped)} queued jobs on shutdown")
+        for _, _, _, fn, args, kwargs in dropped:
+            if self.on_drop:
+                try:
+                    self.on_drop(fn, args, kwargs)
+                except Exception as e:
+                    logger.error(f"Error releasing dropped {self.name} job: {str(e)}")
+        with self._lock:
+            while self._active and time.monotonic() < deadline:
+                self._ready.wait(deadline - time.monotonic())
+            return self._active
+
+    def stats(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                return {'workers': self.workers, 'active': 0, 'queued': 0, 'lanes': {}}
+            now = time.monotonic()
+            lanes = {
+                lane: {'queued': len(heap), 'oldest_wait': round(now - min(item[2] for item in heap), 2) if heap else 0}
+                for lane, heap in self._heaps.items()
+            }
+            return {'workers': self.workers, 'active': self._active, 'queued': self._queued, 'lanes': lanes}
+
+
+def _migrate(conn):
+    columns = {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}
+    for column in ('expires_at', 'last_served_at'):
+        if column not in columns:
+            conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} REAL')
+    if 'own_bytes' not in columns:
+        conn.execute('ALTER TABLE jobs ADD COLUMN own_bytes INTEGER NOT NULL DEFAULT 0')
+    conn.executescript(_INDEXES)
+
+
+def _db():
+    return get_db('jobs', _SCHEMA, _migrate)
+
+
+def get_counter(name):
+    row = _db().execute('SELECT value FROM counters WHERE name = ?', (name,)).fetchone()
+    return row['value'] if row else 0
+
+
+def add_counter(name, delta, db=None):
+    (db or _db()).execute(
+        'INSERT INTO counters (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value',
+        (name, delta)
+    )
+
+
+def job_owner():
+    """Identitas worker pemilik job (host:pid)"""
+    return process_owner()
+
+
+def _notify_change():
+    with _job_changed:
+        _job_changed.notify_all()
+
+
+def _row_to_job(row):
+    job = dict(row)
+    for column in _JSON_COLUMNS:
+        if job.get(column):
+            job[column] = json.loads(job[column])
+    return job
+
+
+def create_job(download_id, url=None, platform=None, state='queued', expires_in=3600):
+    now = time.time()
+    db = _db()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        # rowid diambil dari counter supaya tidak dipakai ulang walaupun job terbaru dihapus (watermark janitor)
+        rowid = db.execute(
+            "SELECT MAX(COALESCE((SELECT value FROM counters WHERE name = 'job_rowid'), 0), "
+            "COALESCE((SELECT MAX(rowid) FROM jobs), 0)) + 1"
+        ).fetchone()[0]
+        db.execute(
+            'INSERT INTO jobs (rowid, id, state, owner, url, platform, created_at, updated_at, expires_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (rowid, download_id, state, job_owner(), url, platform, now, now, now + expires_in)
+        )
+        db.execute(
+            "INSERT INTO counters (name, value) VALUES ('job_rowid', ?) ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+            (rowid,)
+        )
+        db.execute('COMMIT')
+    except Exception:
+        db.execute('ROLLBACK')
+        raise
+    _notify_change()
+
+
+def update_job(download_id, **fields):
+    """Update kolom job. Kolom files/result/progress di-encode JSON, updated_at selalu diperbarui"""
+    fields['updated_at'] = time.time()
+    if fields.get('state') == 'downloading':
+        fields.setdefault('started_at', fields['updated_at'])
+        fields.setdefault('owner', job_owner())
+    if fields.get('state') in TERMINAL_STATES:
+        fields.setdefault('finished_at', fields['updated_at'])
+    for column in _JSON_COLUMNS:
+        if column in fields and fields[column] is not None:
+            fields[column] = json.dumps(fields[column])
+    assignments = ', '.join(f'{column} = ?' for column in fields)
+    db = _db()
+    sized = [column for column in _BYTE_COUNTERS if column in fields]
+    if not sized:
+        db.execute(f'UPDATE jobs SET {assignments} WHERE id = ?', (*fields.values(), download_id))
+    else:
+        # Counter byte ikut diperbarui dalam transaksi yang sama
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = db.execute('SELECT total_bytes, own_bytes FROM jobs WHERE id = ?', (download_id,)).fetchone()
+            db.execute(f'UPDATE jobs SET {assignments} WHERE id = ?', (*fields.values(), download_id))
+            if row:
+                for column in sized:
+                    add_counter(_BYTE_COUNTERS[column], fields[column] - row[column], db)
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+    _notify_change()
+
+
+def get_job(download_id):
+    row = _db().execute('SELECT * FROM jobs WHERE id = ?', (download_id,)).fetchone()
+    return _row_to_job(row) if row else None
+
+
+def delete_job(download_id):
+    db = _db()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        row = db.execute('SELECT total_bytes, own_bytes FROM jobs WHERE id = ?', (download_id,)).fetchone()
+        if row:
+            db.execute('DELETE FROM jobs WHERE id = ?', (download_id,))
+            for column, counter in _BYTE_COUNTERS.items():
+                add_counter(counter, -row[column], db)
+        db.execute('COMMIT')
+    except Exception:
+        db.execute('ROLLBACK')
+        raise
+
+
+def mark_job_served(download_id):
+    """Catat waktu terakhir file job dikirim (untuk eviksi LRU), tanpa mengubah updated_at"""
+    _db().execute('UPDATE jobs SET last_served_at = ? WHERE id = ?', (time.time(), download_id))
+
+
+def list_jobs(state=None, limit=100, offset=0):
+    if state:
+        rows = _db().execute('SELECT * FROM jobs WHERE state = ? ORDER BY updated_at DESC LIMIT ? OFFSET ?', (state, limit, offset))
+    else:
+        rows = _db().execute('SELECT * FROM jobs ORDER BY updated_at DESC LIMIT ? OFFSET ?', (limit, offset))
+    return [_row_to_job(row) for row in rows.fetchall()]
+
+
+def count_jobs_by_state():
+    return {row['state']: row['n'] for row in _db().execute('SELECT state, COUNT(*) AS n FROM jobs GROUP BY state')}
+
+
+def jobs_created_since(last_rowid):
+    """(rowid, id, created_at, expires_at) job yang dibuat setelah rowid `last_rowid`.
+
+    rowid selalu naik (lihat create_job), jadi job yang dibuat di detik yang
+    sama atau dengan jam mundur tidak terlewat seperti kalau memakai created_at.
+    """
+    rows = _db().execute(
+        'SELECT rowid, id, created_at, expires_at FROM jobs WHERE rowid > ? ORDER BY rowid', (last_rowid,)
+    )
+    return [tuple(row) for row in rows.fetchall()]
+
+
+def claim_orphaned_jobs(limit=20):
+    """Ambil alih job queued/downloading/postprocessing yang pemiliknya sudah mati atau dilepas saat shutdown.
+
+    Klaim atomik per job (UPDATE dengan owner lama di WHERE), jadi satu job
+    hanya diambil satu worker. Return id job yang berhasil diklaim.
+    """
+    if limit <= 0:
+        return []
+    db = _db()
+    rows = db.execute(
+        "SELECT id, owner FROM jobs WHERE state IN ('queued', 'downloading', 'postprocessing') ORDER BY created_at"
+    ).fetchall()
+    claimed = []
+    for row in rows:
+        if len(claimed) >= limit:
+            break
+        if row['owner'] and owner_alive(row['owner']):
+            continue
+        cursor = db.execute(
+            "UPDATE jobs SET owner = ?, state = 'queued', updated_at = ? "
+            "WHERE id = ? AND owner IS ? AND state IN ('queued', 'downloading', 'postprocessing')",
+            (job_owner(), time.time(), row['id'], row['owner'])
+        )
+        if cursor.rowcount:
+            claimed.append(row['id'])
+    if claimed:
+        _notify_change()
+    return claimed
+
+
+def release_owned_jobs(keep=()):
+    """Lepas job proses ini yang belum selesai (saat shutdown) supaya worker lain bisa melanjutkannya.
+
+    Job di `keep` (thread-nya masih jalan) tidak dilepas: owner tetap proses
+    ini, jadi baru bisa diklaim setelah prosesnya benar-benar keluar.
+    """
+    keep = list(keep)
+    placeholders = ', '.join('?' for _ in keep)
+    excluded = f' AND id NOT IN ({placeholders})' if keep else ''
+    cursor = _db().execute(
+        "UPDATE jobs SET owner = NULL, state = 'queued', updated_at = ? "
+        f"WHERE owner = ? AND state IN ('queued', 'downloading', 'postprocessing'){excluded}",
+        (time.time(), job_owner(), *keep)
+    )
+    return cursor.rowcount
+
+
+def least_recently_served_jobs(limit=50):
+    """Job final yang paling lama tidak dikirim ke client, kandidat eviksi kuota disk"""
+    placeholders = ', '.join('?' for _ in TERMINAL_STATES)
+    rows = _db().execute(
+        f'SELECT id, state, total_bytes FROM jobs WHERE state IN ({placeholders}) '
+        'ORDER BY COALESCE(last_served_at, finished_at, created_at) LIMIT ?',
+        (*TERMINAL_STATES, limit)
+    )
+    return [dict(row) for row in rows.fetchall()]
+
+
+def is_terminal_status(status):
+    return status == 'completed' or (status or '').startswith('error')
+
+
+def job_view(job):
+    """Representasi job untuk API. `status` tetap string lama (queued/downloading/completed/error: ...)"""
+    if job is None:
+        return None
+    status = f"error: {job['error'] or 'Unknown error'}" if job['state'] == 'error' else job['state']
+    view = {
+        'status': status,
+        'state': job['state'],
+        'platform': job['platform'],
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+        'updated_at': job['updated_at'],
+    }
+    if job['error']:
+        view['error'] = job['error']
+    if job['result']:
+        view['result'] = job['result']
+    if job['files']:
+        view['files'] = job['files']
+        view['total_bytes'] = job['total_bytes']
+    if job['progress']:
+        view['progress'] = job['progress']
+    return view
+
+
+def get_job_view(download_id):
+    return job_view(get_job(download_id))
+
+
+def wait_for_job_change(download_id, since, timeout):
+    """Long-poll: tunggu sampai job berubah setelah `since`, selesai, atau timeout habis"""
+    deadline = time.time() + timeout
+    while True:
+        view = get_job_view(download_id)
+        remaining = deadline - time.time()
+        if view is None or view['updated_at'] > since or is_terminal_status(view['status']) or remaining <= 0:
+            return view
+        # Job di proses lain tidak membangunkan condition, jadi cek ulang berkala
+        with _job_changed:
+            _job_changed.wait(min(0.5, remaining))
+
+
+class ProgressTracker:
+    """Catat progress satu job dari progress_hooks dan postprocessor_hooks yt-dlp.
+
+    Ditulis ke registry paling sering tiap `interval` detik, kecuali saat
+    tahap berganti.
+    """
+
+    def __init__(self, download_id, interval=0.5):
+        self.download_id = download_id
+        self.interval = interval
+        self.record = {
+            'stage': 'fetch',
+            'downloaded_bytes': 0,
+            'total_bytes': None,
+            'speed': None,
+            'eta': None,
+            'percent': None,
+            'filename': None,
+            'files_done': 0,
+            'updated_at': time.time(),
+        }
+        self._last_write = 0
+        # Hook dan log dipanggil dari thread fragment yt-dlp secara bersamaan
+        self._lock = threading.RLock()
+        self.on_fragment_event = None
+
+    def update(self, force=False, **fields):
+        with self._lock:
+            stage_changed = 'stage' in fields and fields['stage'] != self.record['stage']
+            self.record.update(fields)
+            now = time.time()
+            if not (force or stage_changed) and now - self._last_write < self.interval:
+                return
+            self.record['updated_at'] = now
+            self._last_write = now
+            try:
+                update_job(self.download_id, progress=dict(self.record))
+            except Exception as e:
+                logger.warning(f"Failed to write progress: {str(e)}")
+
+    def fragment_event(self, kind, index, attempt=None):
+        """Catat retry/skip satu fragment (dipanggil dari _YtdlpLogger)"""
+        with self._lock:
+            if kind == 'retry':
+                # Percobaan terakhir per fragment, hanya FRAGMENT_HISTORY fragment terbaru
+                attempts = dict(self.record.get('fragment_attempts') or {})
+                attempts.pop(str(index), None)
+                attempts[str(index)] = attempt
+                while len(attempts) > FRAGMENT_HISTORY:
+                    attempts.pop(next(iter(attempts)))
+                self.update(fragment_retries=self.record.get('fragment_retries', 0) + 1, fragment_attempts=attempts)
+            else:
+                skipped = self.record.get('fragments_skipped') or []
+                self.update(force=True, fragments_skipped=(skipped + [index])[-FRAGMENT_HISTORY:])
+        if self.on_fragment_event:
+            self.on_fragment_event(kind)
+
+    def ydl_logger(self):
+        return _YtdlpLogger(self)
+
+    def download_hook(self, d):
+        total = d.get('total_bytes') or d.get('total_bytes_estimate')
+        downloaded = d.get('downloaded_bytes') or 0
+        fields = {
+            'stage': 'fetch',
+            'downloaded_bytes': downloaded,
+            'total_bytes': total,
+            'speed': d.get('speed'),
+            'eta': d.get('eta'),
+            'percent': round(downloaded * 100.0 / total, 1) if total else None,
+            'filename': os.path.basename(d.get('filename') or '') or None,
+        }
+        if d.get('fragment_count'):
+            fields['fragment_index'] = d.get('fragment_index')
+            fields['fragment_count'] = d.get('fragment_count')
+        with self._lock:
+            if d.get('status') == 'finished':
+                fields['files_done'] = self.record['files_done'] + 1
+                self.update(force=True, **fields)
+            else:
+                self.update(**fields)
+
+    def postprocessor_hook(self, d):
+        stage = _PP_STAGES.get(d.get('postprocessor'), 'postprocess')
+        self.update(force=d.get('status') != 'processing', stage=stage, postprocessor=d.get('postprocessor'), speed=None, eta=None)
+
+
+class _YtdlpLogger:
+    """Opsi 'logger' yt-dlp: teruskan pesan ke logging dan catat retry/skip fragment ke ProgressTracker"""
+
+    def __init__(self, tracker):
+        self.tracker = tracker
+
+    def _fragment(self, message):
+        match = _FRAGMENT_RETRY.search(message)
+        if match:
+            self.tracker.fragment_event('retry', int(match.group(1)), int(match.group(2)))
+            return True
+        match = _FRAGMENT_SKIP.search(message)
+        if match:
+            self.tracker.fragment_event('skip', int(match.group(1)))
+            return True
+        return False
+
+    def debug(self, message):
+        if self._fragment(message):
+            logger.warning(f"{self.tracker.download_id}: {message}")
+        elif message.startswith('[debug] ') or message.startswith('[download] '):
+            logger.debug(message)
+        else:
+            logger.info(message)
+
+    def info(self, message):
+        logger.info(message)
+
+    def warning(self, message):
+        self._fragment(message)
+        logger.warning(message)
+
+    def error(self, message):
+        logger.error(message)
@@ -0,0 +1,63 @@
+import os
+import json
+import logging
+from services.state import STATE_DIR
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_DIR = os.path.join(STATE_DIR, 'journal')
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))  # termasuk percobaan pertama
+
+
+def _path(download_id):
+    return os.path.join(JOURNAL_DIR, f"{download_id}.json")
+
+
+def _write(download_id, entry):
+    """Tulis atomik (tmp + rename) dengan mode 0600"""
+    os.makedirs(JOURNAL_DIR, mode=0o700, exist_ok=True)
+    tmp_path = f"{_path(download_id)}.tmp{os.getpid()}"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(entry, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, _path(download_id))
+
+
+def write_journal(download_id, params):
+    """Catat parameter job sebelum masuk antrian, supaya bisa dijalankan ulang setelah worker mati.
+
+    params tidak boleh berisi cookie atau password (lihat journal_params di app.py).
+    """
+    _write(download_id, {'params': params, 'attempts': 0})
+
+
+def read_journal(download_id):
+    try:
+        with open(_path(download_id)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def record_attempt(download_id):
+    """Naikkan hitungan percobaan job ini, return nilainya (0 kalau tidak ada journal)"""
+    entry = read_journal(download_id)
+    if entry is None:
+        return 0
+    entry['attempts'] = entry.get('attempts', 0) + 1
+    try:
+        _write(download_id, entry)
+    except OSError as e:
+        logger.warning(f"Failed to update journal for {download_id}: {str(e)}")
+    return entry['attempts']
+
+
+def remove_journal(download_id):
+    try:
+        os.remove(_path(download_id))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Failed to remove journal for {download_id}: {str(e)}")
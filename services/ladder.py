@@ -0,0 +1,124 @@
+import os
+import time
+import random
+import logging
+from services.state import get_db
+
+logger = logging.getLogger(__name__)
+
+# Urutan default tangga cookie, dipakai juga sebagai tie-breaker
+DEFAULT_RUNGS = ('session', 'user', 'cookiefile', 'none')
+
+LADDER_ALPHA = float(os.environ.get('LADDER_ALPHA', 0.2))            # bobot EWMA hasil terbaru
+LADDER_MIN_ATTEMPTS = int(os.environ.get('LADDER_MIN_ATTEMPTS', 5))  # sebelum rung boleh di-skip
+LADDER_SKIP_BELOW = float(os.environ.get('LADDER_SKIP_BELOW', 0.05))  # success rate minimal
+LADDER_EXPLORE = float(os.environ.get('LADDER_EXPLORE', 0.1))        # peluang rung yang di-skip tetap dicoba
+
+# Prior untuk rung yang belum punya data, sama untuk semua rung jadi urutan default tetap
+PRIOR_SUCCESS = 0.5
+PRIOR_LATENCY = 5.0
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS ladder_stats (
+    phase TEXT NOT NULL,
+    platform TEXT NOT NULL,
+    rung TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    successes INTEGER NOT NULL DEFAULT 0,
+    success_rate REAL NOT NULL,
+    latency REAL NOT NULL,
+    last_success_at REAL,
+    last_failure_at REAL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (phase, platform, rung)
+);
+'''
+
+
+def _db():
+    return get_db('ladder', _SCHEMA)
+
+
+def record_rung(phase, platform, rung, ok, seconds):
+    """Update EWMA success rate dan latency satu rung"""
+    key = platform or 'unknown'
+    now = time.time()
+    db = _db()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        row = db.execute(
+            'SELECT success_rate, latency FROM ladder_stats WHERE phase = ? AND platform = ? AND rung = ?',
+            (phase, key, rung)
+        ).fetchone()
+        success_rate = row['success_rate'] if row else PRIOR_SUCCESS
+        latency = row['latency'] if row else seconds
+        success_rate += LADDER_ALPHA * ((1.0 if ok else 0.0) - success_rate)
+        latency += LADDER_ALPHA * (seconds - latency)
+        db.execute(
+            'INSERT INTO ladder_stats (phase, platform, rung, attempts, successes, success_rate, latency, '
+            'last_success_at, last_failure_at, updated_at) VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT(phase, platform, rung) DO UPDATE SET attempts = attempts + 1, '
+            'successes = successes + excluded.successes, success_rate = excluded.success_rate, '
+            'latency = excluded.latency, last_success_at = COALESCE(excluded.last_success_at, last_success_at), '
+            'last_failure_at = COALESCE(excluded.last_failure_at, last_failure_at), updated_at = excluded.updated_at',
+            (phase, key, rung, 1 if ok else 0, success_rate, latency, now if ok else None, None if ok else now, now)
+        )
+        db.execute('COMMIT')
+    except Exception:
+        db.execute('ROLLBACK')
+        raise
+
+
+def _expected_cost(stats):
+    """Perkiraan detik per sukses: latency / success_rate. Urut naik = urutan optimal percobaan berurutan"""
+    if not stats:
+        return PRIOR_LATENCY / PRIOR_SUCCESS
+    return stats['latency'] / max(stats['success_rate'], 0.01)
+
+
+def order_rungs(phase, platform, rungs):
+    """Urutkan rung menurut perkiraan waktu sampai sukses.
+
+    Rung yang sudah dicoba minimal LADDER_MIN_ATTEMPTS kali dengan success
+    rate di bawah LADDER_SKIP_BELOW di-skip, kecuali terpilih untuk
+    eksplorasi (dicoba paling akhir). Kalau semua rung ter-skip, urutan
+    default dipakai.
+    """
+    rungs = list(rungs)
+    try:
+        rows = _db().execute(
+            'SELECT * FROM ladder_stats WHERE phase = ? AND platform = ?', (phase, platform or 'unknown')
+        ).fetchall()
+    except Exception as e:
+        logger.error(f"Failed to read ladder stats: {str(e)}")
+        return rungs
+    stats = {row['rung']: row for row in rows}
+    ordered = sorted(rungs, key=lambda rung: _expected_cost(stats.get(rung)))
+    kept, skipped = [], []
+    for rung in ordered:
+        row = stats.get(rung)
+        if row and row['attempts'] >= LADDER_MIN_ATTEMPTS and row['success_rate'] < LADDER_SKIP_BELOW:
+            skipped.append(rung)
+        else:
+            kept.append(rung)
+    if not kept:
+        return rungs
+    explored = [rung for rung in skipped if random.random() < LADDER_EXPLORE]
+    if skipped:
+        logger.info(f"Ladder {phase}/{platform or 'unknown'}: skipping {[r for r in skipped if r not in explored]}")
+    return kept + explored
+
+
+def ladder_stats(platform=None):
+    """Statistik semua rung (untuk endpoint inspeksi), diurutkan per phase/platform"""
+    if platform:
+        rows = _db().execute('SELECT * FROM ladder_stats WHERE platform = ? ORDER BY phase, platform, rung', (platform,))
+    else:
+        rows = _db().execute('SELECT * FROM ladder_stats ORDER BY phase, platform, rung')
+    result = []
+    for row in rows.fetchall():
+        entry = dict(row)
+        entry['expected_cost'] = round(_expected_cost(row), 3)
+        entry['skipped'] = row['attempts'] >= LADDER_MIN_ATTEMPTS and row['success_rate'] < LADDER_SKIP_BELOW
+        result.append(entry)
+    return result
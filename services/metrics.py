@@ -0,0 +1,208 @@
+import os
+import time
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Multiprocess mode aktif kalau PROMETHEUS_MULTIPROC_DIR di-set sebelum proses
+# worker mengimpor modul ini (lihat gunicorn.conf.py)
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+try:
+    from prometheus_client import (
+        Counter, Gauge, Histogram, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+    )
+    from prometheus_client.core import GaugeMetricFamily
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    logger.warning("Module 'prometheus_client' not found, /metrics is disabled. Install it with 'pip install prometheus-client'")
+    PROMETHEUS_AVAILABLE = False
+
+# Sama dengan bucket di monitoring.js
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+SIZE_BUCKETS = tuple(mb * 1024 * 1024 for mb in (1, 10, 50, 100, 500, 1024, 2048))
+STAGES = ('extract', 'download', 'postprocess', 'serve')
+
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+
+if PROMETHEUS_AVAILABLE:
+    DOWNLOAD_REQUESTS = Counter('download_requests_total', 'Total number of download requests', ['status'])
+    DOWNLOAD_DURATION = Histogram(
+        'download_duration_seconds', 'Duration of download jobs in seconds', ['status'], buckets=DURATION_BUCKETS
+    )
+    DOWNLOAD_SIZE = Histogram('download_size_bytes', 'Size of downloaded files in bytes', buckets=SIZE_BUCKETS)
+    ACTIVE_WORKERS = Gauge('active_workers', 'Number of download slots in use', ['kind'], multiprocess_mode='livesum')
+    STAGE_DURATION = Histogram(
+        'stage_duration_seconds', 'Duration of a request stage in seconds',
+        ['stage', 'platform', 'outcome'], buckets=DURATION_BUCKETS
+    )
+    COOKIE_STEP_ATTEMPTS = Counter(
+        'cookie_step_attempts_total', 'Cookie ladder steps tried', ['phase', 'platform', 'step']
+    )
+    COOKIE_STEP_SUCCESSES = Counter(
+        'cookie_step_successes_total', 'Cookie ladder steps that succeeded', ['phase', 'platform', 'step']
+    )
+    SLOT_WAIT = Histogram(
+        'download_slot_wait_seconds', 'Time spent waiting for a download slot', ['kind'],
+        buckets=(0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+    )
+    BYTES_SERVED = Counter('bytes_served_total', 'Bytes sent to clients', ['route'])
+    YDL_POOL_CHECKOUTS = Counter('ydl_pool_checkouts_total', 'YoutubeDL instances taken from the pool', ['result'])
+    FRAGMENT_CONNECTIONS = Gauge(
+        'fragment_connections', 'Fragment connections leased from the node budget', multiprocess_mode='livesum'
+    )
+    FRAGMENT_EVENTS = Counter('fragment_events_total', 'Fragment retries and skips', ['platform', 'kind'])
+    QUEUE_WAIT = Histogram(
+        'download_queue_wait_seconds', 'Time download jobs spent in the priority queue', ['lane'],
+        buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+    )
+    BANDWIDTH_THROTTLED = Counter(
+        'bandwidth_throttled_seconds_total', 'Time transfers slept to stay within their bandwidth share', ['kind']
+    )
+    POSTPROCESS_PATHS = Counter(
+        'postprocess_paths_total', 'Jobs by postprocessing path (stream copy or re-encode)', ['kind', 'path']
+    )
+else:
+    DOWNLOAD_REQUESTS = DOWNLOAD_DURATION = DOWNLOAD_SIZE = ACTIVE_WORKERS = STAGE_DURATION = _NoopMetric()
+    COOKIE_STEP_ATTEMPTS = COOKIE_STEP_SUCCESSES = SLOT_WAIT = BYTES_SERVED = YDL_POOL_CHECKOUTS = _NoopMetric()
+    FRAGMENT_CONNECTIONS = FRAGMENT_EVENTS = BANDWIDTH_THROTTLED = QUEUE_WAIT = POSTPROCESS_PATHS = _NoopMetric()
+
+
+def _platform(platform):
+    return platform or 'unknown'
+
+
+class _Stage:
+    def __init__(self):
+        self.outcome = 'ok'
+        self.excluded = 0.0
+
+    def fail(self):
+        self.outcome = 'error'
+
+    def exclude(self, seconds):
+        """Kurangi durasi yang sudah dicatat sebagai stage lain (misalnya postprocess di dalam download)"""
+        self.excluded += seconds
+
+
+@contextmanager
+def track_stage(stage, platform):
+    """Catat durasi satu stage ke stage_duration_seconds. Exception dihitung outcome=error"""
+    record = _Stage()
+    start = time.monotonic()
+    try:
+        yield record
+    except BaseException:
+        record.fail()
+        raise
+    finally:
+        elapsed = max(0.0, time.monotonic() - start - record.excluded)
+        STAGE_DURATION.labels(stage=stage, platform=_platform(platform), outcome=record.outcome).observe(elapsed)
+
+
+def observe_stage(stage, platform, seconds, outcome='ok'):
+    STAGE_DURATION.labels(stage=stage, platform=_platform(platform), outcome=outcome).observe(seconds)
+
+
+class PostprocessTimer:
+    """postprocessor_hook yt-dlp yang mencatat durasi tiap postprocessor sebagai stage postprocess"""
+
+    def __init__(self, platform):
+        self.platform = platform
+        self.total = 0.0
+        self._started = {}
+
+    def hook(self, d):
+        name = d.get('postprocessor')
+        if d.get('status') == 'started':
+            self._started[name] = time.monotonic()
+        elif d.get('status') == 'finished' and name in self._started:
+            elapsed = time.monotonic() - self._started.pop(name)
+            self.total += elapsed
+            observe_stage('postprocess', self.platform, elapsed)
+
+
+def cookie_step_tried(phase, platform, step):
+    COOKIE_STEP_ATTEMPTS.labels(phase=phase, platform=_platform(platform), step=step).inc()
+
+
+def cookie_step_succeeded(phase, platform, step):
+    COOKIE_STEP_SUCCESSES.labels(phase=phase, platform=_platform(platform), step=step).inc()
+
+
+def slot_acquired(kind, waited):
+    SLOT_WAIT.labels(kind=kind).observe(waited)
+    ACTIVE_WORKERS.labels(kind=kind).inc()
+
+
+def slot_released(kind):
+    ACTIVE_WORKERS.labels(kind=kind).dec()
+
+
+def queue_waited(lane, waited):
+    QUEUE_WAIT.labels(lane=lane).observe(waited)
+
+
+def fragment_event(platform, kind):
+    FRAGMENT_EVENTS.labels(platform=_platform(platform), kind=kind).inc()
+
+
+def postprocess_path(kind, path):
+    POSTPROCESS_PATHS.labels(kind=kind, path=path).inc()
+
+
+if PROMETHEUS_AVAILABLE:
+    class StateCollector:
+        """Gauge yang dibaca dari registry job saat scrape, jadi sama di semua worker"""
+
+        def collect(self):
+            from services.jobs import get_counter, count_jobs_by_state
+            usage = GaugeMetricFamily('temp_dir_bytes', 'Bytes used by downloads and the artifact store', labels=['area'])
+            usage.add_metric(['jobs'], get_counter('job_own_bytes'))
+            usage.add_metric(['store'], get_counter('store_bytes'))
+            yield usage
+            counts = count_jobs_by_state()
+            queued = GaugeMetricFamily('download_queue_size', 'Download jobs waiting for a worker')
+            queued.add_metric([], counts.get('queued', 0))
+            yield queued
+            jobs = GaugeMetricFamily('download_jobs', 'Download jobs in the registry by state', labels=['state'])
+            for state, count in counts.items():
+                jobs.add_metric([state], count)
+            yield jobs
+
+    if not MULTIPROC_DIR:
+        REGISTRY.register(StateCollector())
+
+
+def render():
+    """Return (body, content_type) untuk endpoint /metrics"""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(StateCollector())
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    """Dipanggil dari hook child_exit gunicorn supaya gauge livesum worker mati tidak ikut terhitung"""
+    if PROMETHEUS_AVAILABLE and MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,69 @@
+import os
+import time
+import logging
+from services.state import get_db
+
+logger = logging.getLogger(__name__)
+
+# Token bucket per platform, dibagi semua worker lewat SQLite.
+# PACING_RATES contoh: "youtube=0.5,tiktok=0.3" (request per detik)
+PACING_RATE = float(os.environ.get('PACING_RATE', 1.0))
+PACING_BURST = int(os.environ.get('PACING_BURST', 3))
+PACING_RATES = {
+    name.strip(): float(rate)
+    for name, rate in (item.split('=', 1) for item in os.environ.get('PACING_RATES', '').split(',') if '=' in item)
+}
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS pacing_buckets (
+    platform TEXT PRIMARY KEY,
+    tat REAL NOT NULL
+);
+'''
+
+
+def _db():
+    return get_db('pacing', _SCHEMA)
+
+
+def platform_rate(platform):
+    return PACING_RATES.get(platform or 'unknown', PACING_RATE)
+
+
+def reserve(platform):
+    """Ambil satu token untuk platform. Return berapa detik harus menunggu sebelum request boleh jalan.
+
+    Pakai GCRA: tat (theoretical arrival time) disimpan per platform.
+    Platform yang idle langsung dapat token (wait 0) sampai PACING_BURST
+    request beruntun, setelah itu request dijadwalkan tiap 1/rate detik.
+    """
+    key = platform or 'unknown'
+    rate = platform_rate(key)
+    if rate <= 0:
+        return 0.0
+    interval = 1.0 / rate
+    db = _db()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        now = time.time()
+        row = db.execute('SELECT tat FROM pacing_buckets WHERE platform = ?', (key,)).fetchone()
+        tat = max(row['tat'] if row else now, now) + interval
+        db.execute('INSERT OR REPLACE INTO pacing_buckets (platform, tat) VALUES (?, ?)', (key, tat))
+        db.execute('COMMIT')
+    except Exception:
+        db.execute('ROLLBACK')
+        raise
+    return max(0.0, tat - now - PACING_BURST * interval)
+
+
+def pace(platform):
+    """Tunggu giliran request ke platform sesuai budget global. Return lama menunggu (detik)"""
+    try:
+        wait = reserve(platform)
+    except Exception as e:
+        logger.error(f"Pacing error for {platform}: {str(e)}")
+        return 0.0
+    if wait > 0:
+        logger.info(f"Pacing {platform or 'unknown'}: waiting {wait:.2f}s for a request slot")
+        time.sleep(wait)
+    return wait
@@ -0,0 +1,94 @@
+import os
+import fcntl
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from services.state import STATE_DIR
+
+logger = logging.getLogger(__name__)
+
+LOCK_DIR = os.path.join(STATE_DIR, 'locks')
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Gabungkan panggilan yang sama yang sedang berjalan di proses ini.
+
+    Thread pertama untuk sebuah key menjalankan fn, thread lain dengan key
+    yang sama menunggu dan menerima hasil (atau exception) yang sama.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                leader = True
+
+        if not leader:
+            logger.info(f"Joining in-flight {self.name} call")
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+
+@contextmanager
+def process_lock(key):
+    """Lock eksklusif lintas proses (flock) untuk sebuah key.
+
+    File lock dihapus oleh pemegang lock sebelum dilepas. Proses yang
+    terlanjur menunggu di inode lama mengecek setelah flock didapat apakah
+    path masih menunjuk ke inode yang sama, kalau tidak dia membuka ulang
+    dan menunggu lagi, jadi tidak ada dua pemegang lock sekaligus. Pemanggil
+    tetap harus mengecek ulang hasil bersama (misalnya cache) setelah lock
+    didapat.
+    """
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    path = os.path.join(LOCK_DIR, hashlib.sha256(key.encode('utf-8')).hexdigest()[:32] + '.lock')
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            current = os.stat(path)
+        except FileNotFoundError:
+            current = None
+        held = os.fstat(fd)
+        if current is not None and (current.st_dev, current.st_ino) == (held.st_dev, held.st_ino):
+            break
+        # File sudah dihapus pemegang sebelumnya, lock di inode lama tidak berarti apa-apa
+        os.close(fd)
+    try:
+        yield
+    finally:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
@@ -0,0 +1,53 @@
+import os
+import socket
+import sqlite3
+import threading
+
+# Direktori state bersama untuk semua worker gunicorn di host yang sama
+STATE_DIR = os.environ.get('STATE_DIR', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'state'))
+
+_local = threading.local()
+
+
+def get_db(name, schema=None, migrate=None):
+    """Koneksi SQLite per thread (dan per proses) ke STATE_DIR/<name>.db.
+
+    Koneksi tidak pernah dibagi lintas fork, jadi aman dipakai worker
+    gunicorn. Schema (dan migrate, kalau ada) dijalankan sekali per koneksi baru.
+    """
+    if getattr(_local, 'pid', None) != os.getpid():
+        _local.conns = {}
+        _local.pid = os.getpid()
+    conn = _local.conns.get(name)
+    if conn is None:
+        os.makedirs(STATE_DIR, exist_ok=True)
+        conn = sqlite3.connect(os.path.join(STATE_DIR, f'{name}.db'), timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA mmap_size=268435456')
+        if schema:
+            conn.executescript(schema)
+        if migrate:
+            migrate(conn)
+        _local.conns[name] = conn
+    return conn
+
+
+def process_owner():
+    """Identitas proses ini (host:pid) untuk baris state yang dimiliki satu worker"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def owner_alive(owner):
+    """False hanya kalau owner ada di host ini dan pid-nya sudah tidak jalan"""
+    host, _, pid = (owner or '').rpartition(':')
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (ValueError, PermissionError):
+        return True
+    return True
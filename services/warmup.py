@@ -0,0 +1,29 @@
+import gc
+import time
+import logging
+import yt_dlp
+from yt_dlp.extractor import gen_extractor_classes
+from yt_dlp.postprocessor.ffmpeg import FFmpegPostProcessor
+from services.cleanup import is_ffmpeg_installed
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up():
+    """Muat bagian yt-dlp yang mahal sekali di master gunicorn (preload).
+
+    Worker hasil fork mewarisi modul, registry extractor, plugin dan cache
+    versi ffmpeg secara copy-on-write, jadi tidak perlu memuat ulang.
+    gc.freeze() memindahkan semua objek ke generasi permanen supaya GC di
+    worker tidak menyentuh (dan menyalin) halaman memori milik master.
+    """
+    start = time.monotonic()
+    extractors = len(gen_extractor_classes())
+    # Instance pertama memuat plugin dan daftar extractor default
+    yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True}).close()
+    if is_ffmpeg_installed():
+        # Versi ffmpeg/ffprobe disimpan di cache level class FFmpegPostProcessor
+        FFmpegPostProcessor.get_versions()
+    gc.collect()
+    gc.freeze()
+    logger.info(f"Warm-up loaded {extractors} extractors in {time.monotonic() - start:.2f}s")
@@ -0,0 +1,224 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import yt_dlp
+from yt_dlp.postprocessor import get_postprocessor
+from yt_dlp.postprocessor.common import PostProcessor
+from yt_dlp.utils import YoutubeDLError
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+YDL_POOL_SIZE = int(os.environ.get('YDL_POOL_SIZE', 2))           # instance idle per profil
+YDL_POOL_PROFILES = int(os.environ.get('YDL_POOL_PROFILES', 32))  # profil yang disimpan (LRU)
+
+# Opsi yang di-set ulang setiap pemakaian, jadi tidak ikut menentukan profil
+PER_USE_OPTIONS = (
+    'outtmpl', 'format', 'postprocessors', 'progress_hooks', 'postprocessor_hooks', 'post_hooks',
+    'writesubtitles', 'subtitleslangs', 'subtitlesformat', 'merge_output_format', 'skip_download',
+    'listsubtitles', 'fixup', 'noprogress', 'logger', 'concurrent_fragment_downloads',
+)
+# User agent dipilih sekali per instance (rotasi per instance, bukan per request)
+_IGNORED_OPTIONS = ('user_agent',)
+
+
+def profile_key(opts, version=None):
+    """Sidik jari opsi yang menentukan cara YoutubeDL dibangun (cookie, header, retry, ...)"""
+    profile = {k: v for k, v in opts.items() if k not in PER_USE_OPTIONS and k not in _IGNORED_OPTIONS}
+    canonical = json.dumps([profile, version], sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _reset(ydl, opts):
+    """Kembalikan params ke snapshot setelah __init__ lalu pasang opsi per pemakaian.
+
+    Mengulang bagian __init__ YoutubeDL yang bergantung pada opsi tersebut
+    (outtmpl, format selector, hook, postprocessor). Extractor, cookie jar
+    dan koneksi HTTP (request director) tetap dipakai ulang.
+    """
+    params = dict(ydl._pool_base)
+    params['http_headers'] = ydl._pool_base['http_headers'].copy()
+    for key in PER_USE_OPTIONS:
+        if key in opts:
+            params[key] = opts[key]
+    ydl.params = params
+    ydl._parse_outtmpl()
+    ydl.format_selector = (
+        params.get('format') if params.get('format') in (None, '-')
+        else params['format'] if callable(params['format'])
+        else ydl.build_format_selector(params['format']))
+    ydl._post_hooks = []
+    ydl._progress_hooks = []
+    ydl._postprocessor_hooks = []
+    for hook in params.get('post_hooks', []):
+        ydl.add_post_hook(hook)
+    for hook in params.get('progress_hooks', []):
+        ydl.add_progress_hook(hook)
+    for hook in params.get('postprocessor_hooks', []):
+        ydl.add_postprocessor_hook(hook)
+    ydl._pps = {when: [] for when in ydl._pps}
+    for pp_def_raw in params.get('postprocessors', []):
+        pp_def = dict(pp_def_raw)
+        when = pp_def.pop('when', 'post_process')
+        ydl.add_post_processor(get_postprocessor(pp_def.pop('key'))(ydl, **pp_def), when=when)
+    ydl._download_retcode = 0
+    ydl._num_downloads = 0
+    ydl._num_videos = 0
+    ydl._playlist_level = 0
+    ydl._playlist_urls = set()
+    ydl._printed_messages = set()
+
+
+class YoutubeDLPool:
+    """Pool instance YoutubeDL yang sudah diinisialisasi, per profil opsi.
+
+    Satu instance hanya dipakai satu thread dalam satu waktu. Pool dibuat
+    ulang setelah fork (per pid), jadi koneksi tidak pernah dibagi antar
+    worker gunicorn. Instance yang melempar error selain error yt-dlp
+    biasa dibuang, bukan dikembalikan ke pool.
+    """
+
+    def __init__(self, size=YDL_POOL_SIZE, max_profiles=YDL_POOL_PROFILES):
+        self.size = max(0, size)
+        self.max_profiles = max(1, max_profiles)
+        self._lock = threading.Lock()
+        self._idle = OrderedDict()
+        self._pid = None
+
+    def _profiles(self):
+        if self._pid != os.getpid():
+            self._idle = OrderedDict()
+            self._pid = os.getpid()
+        return self._idle
+
+    def _create(self, opts, key, cookiejar=None):
+        ydl = yt_dlp.YoutubeDL(dict(opts))
+        if cookiejar is not None:
+            # Jar yang sudah di-parse disalin ke jar instance ini, yt-dlp tidak perlu membaca file cookie lagi
+            for cookie in cookiejar:
+                ydl.cookiejar.set_cookie(cookie)
+        ydl._pool_key = key
+        ydl._pool_base = {k: v for k, v in ydl.params.items() if k not in PER_USE_OPTIONS}
+        ydl._pool_base['http_headers'] = ydl.params['http_headers'].copy()
+        return ydl
+
+    def checkout(self, opts, version=None, cookiejar=None):
+        key = profile_key(opts, version)
+        with self._lock:
+            idle = self._profiles().get(key)
+            ydl = idle.pop() if idle else None
+        if ydl is None:
+            metrics.YDL_POOL_CHECKOUTS.labels(result='miss').inc()
+            return self._create(opts, key, cookiejar)
+        metrics.YDL_POOL_CHECKOUTS.labels(result='hit').inc()
+        try:
+            _reset(ydl, opts)
+        except Exception as e:
+            logger.warning(f"Failed to reset pooled YoutubeDL, creating a new one: {str(e)}")
+            self._close(ydl)
+            return self._create(opts, key, cookiejar)
+        return ydl
+
+    def checkin(self, ydl, healthy=True):
+        if not healthy or self.size == 0:
+            self._close(ydl)
+            return
+        evicted = []
+        with self._lock:
+            profiles = self._profiles()
+            idle = profiles.setdefault(ydl._pool_key, [])
+            profiles.move_to_end(ydl._pool_key)
+            if len(idle) < self.size:
+                idle.append(ydl)
+                ydl = None
+            while len(profiles) > self.max_profiles:
+                _, old = profiles.popitem(last=False)
+                evicted.extend(old)
+        for instance in evicted + ([ydl] if ydl else []):
+            self._close(instance)
+
+    def _close(self, ydl):
+        try:
+            ydl.close()
+        except Exception as e:
+            logger.warning(f"Error closing YoutubeDL: {str(e)}")
+
+    @contextmanager
+    def get(self, opts, version=None, cookiejar=None):
+        """Pinjam instance untuk satu pemakaian (pengganti `with yt_dlp.YoutubeDL(opts)`).
+
+        `cookiejar` hanya dipasang ke instance baru; `version` harus ikut
+        berubah kalau isi jar berubah supaya instance lama tidak dipakai.
+        """
+        ydl = self.checkout(opts, version, cookiejar)
+        healthy = False
+        try:
+            yield ydl
+            healthy = True
+        except YoutubeDLError:
+            healthy = True
+            raise
+        finally:
+            self.checkin(ydl, healthy)
+
+    def stats(self):
+        with self._lock:
+            profiles = self._profiles()
+            return {'profiles': len(profiles), 'idle': sum(len(idle) for idle in profiles.values())}
+
+
+class DeferredPostprocess:
+    """Tunda post_process yt-dlp (merge, fixup, postprocessor) supaya bisa jalan terpisah dari download.
+
+    Selama capture(ydl) aktif, file yang selesai diunduh cuma dicatat.
+    run(ydl) menjalankan semua yang tertunda dengan instance lain, misalnya
+    dari thread pool CPU setelah slot download dilepas.
+    """
+
+    def __init__(self):
+        self.pending = []
+
+    @contextmanager
+    def capture(self, ydl):
+        def post_process(filename, info, files_to_move=None):
+            # Disalin sekarang, setelah ini yt-dlp membuang key yang sama dengan info induknya
+            self.pending.append((filename, dict(info), dict(files_to_move or {})))
+            info['filepath'] = filename
+            return info
+        ydl.post_process = post_process
+        try:
+            yield self
+        finally:
+            del ydl.post_process
+
+    def run(self, ydl):
+        """Jalankan post_process yang tertunda, return info hasil tiap file"""
+        results = []
+        while self.pending:
+            filename, info, files_to_move = self.pending.pop(0)
+            # Merger/fixup dibuat oleh instance download, pindahkan ke instance ini beserta hook-nya
+            for pp in info.get('__postprocessors') or []:
+                pp._progress_hooks = [pp.report_progress]
+                pp.set_downloader(ydl)
+            results.append(ydl.post_process(filename, info, files_to_move))
+        return results
+
+
+class BeforeDownload(PostProcessor):
+    """Panggil callback(ydl, info) dengan format yang sudah di-resolve, tepat sebelum downloader dibuat.
+
+    Dipasang dengan ydl.add_post_processor(..., when='before_dl'); dilepas
+    lagi oleh pool di checkout berikutnya.
+    """
+
+    def __init__(self, ydl, callback):
+        super().__init__(ydl)
+        self._callback = callback
+
+    def run(self, info):
+        self._callback(self._downloader, info)
+        return [], info